@@ -0,0 +1,47 @@
+"""
+Compare the speed of the PDB parsers on a directory of PDB files.
+
+Usage: python benchmarks/bench_parsers.py [pdb directory] [repeats]
+"""
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from hw2skeleton import io
+
+
+def time_parser(filepaths, parser, repeats):
+    """
+    Best wall clock time of parsing all files in one batch with the given parser.
+
+    Input:  list of PDB file paths
+            parser name
+            number of repeats
+    Output: time in seconds
+    """
+    best = float('inf')
+    for i in range(repeats):
+        start = time.perf_counter()
+        io.parse_active_sites(filepaths, parser=parser)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else "data"
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    filepaths = sorted(glob.glob(os.path.join(directory, "*.pdb")))
+    times = {parser: time_parser(filepaths, parser, repeats) for parser in io.PARSERS}
+
+    print("%d files from %s, best of %d"%(len(filepaths), directory, repeats))
+    for parser in io.PARSERS:
+        print("%-8s %8.2f ms  %8.0f files/s  %5.1fx"%(parser, times[parser]*1000, len(filepaths)/times[parser],
+                                                     times['line']/times[parser]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""
+Time loading, scoring and clustering on synthetic corpora of increasing size.
+
+Corpora are made by copying the PDB files of a template directory with randomly jittered
+coordinates. For every corpus size, each stage (read_active_sites, active_site_score,
+cluster_by_partitioning, cluster_hierarchically) is timed on its own, best of a few repeats,
+and its peak memory is measured in a separate run under tracemalloc. Every stage runs in this
+process (read_active_sites with a single worker), so tracemalloc sees all of its memory.
+Results are printed with the scaling exponent between consecutive sizes, and can be written to
+JSON and compared against an earlier run to catch regressions.
+
+Usage: python benchmarks/bench_suite.py [--sizes N [N ...]] [--output results.json]
+                                        [--compare baseline.json] [--tolerance 0.25]
+"""
+import argparse
+import contextlib
+import datetime
+import glob
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from hw2skeleton import io
+from hw2skeleton import cluster
+from hw2skeleton import utils
+from hw2skeleton import features
+
+
+## Stages in the order they run, each needs the output of the one before
+STAGES = ('read', 'score', 'partition', 'hierarchical')
+
+
+def synthesize_corpus(directory, n_sites, templates="data", jitter=0.5, seed=0):
+    """
+    Write n_sites PDB files to a directory, each a copy of a template file with every coordinate
+    moved by normal noise. A directory that already holds n_sites PDB files copied from the same
+    templates is reused.
+
+    Input:  output directory
+            number of files
+            directory of template PDB files
+            standard deviation of the noise, in Angstroms
+            random seed
+    Output: None
+    """
+    os.makedirs(directory, exist_ok=True)
+    filepaths = sorted(glob.glob(os.path.join(templates, "*.pdb")))
+    if len(glob.glob(os.path.join(directory, "*.pdb"))) == n_sites and same_residues(directory, filepaths):
+        return
+
+    ## Split every template into its lines, and the coordinates of its ATOM lines. Every other
+    #  line (such as the TER that ends every residue) is copied as it is.
+    parts = []
+    for filepath in filepaths:
+        with open(filepath, "r") as f:
+            lines = f.read().splitlines()
+        atoms = [i for i, line in enumerate(lines) if line.startswith('ATOM')]
+        coords = np.array([[float(lines[i][30 + 8*j:38 + 8*j]) for j in range(3)] for i in atoms])
+        parts.append((lines, atoms, coords))
+
+    rng = np.random.default_rng(seed)
+    for i in range(n_sites):
+        lines, atoms, coords = parts[i % len(parts)]
+        lines = list(lines)
+        moved = (coords + rng.normal(0.0, jitter, size=coords.shape)).tolist()
+        for j, (x, y, z) in zip(atoms, moved):
+            lines[j] = "%s%8.3f%8.3f%8.3f%s"%(lines[j][:30], x, y, z, lines[j][54:])
+        with open(os.path.join(directory, "%d.pdb"%i), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    assert same_residues(directory, filepaths), "synthetic sites do not parse like their templates"
+
+
+def same_residues(directory, templates):
+    """
+    Check that the first copy of every template in a corpus has as many residues as the template.
+
+    Input:  corpus directory
+            list of template PDB files
+    Output: True if every residue count matches
+    """
+    for i, template in enumerate(templates):
+        copy = os.path.join(directory, "%d.pdb"%i)
+        if not os.path.exists(copy):
+            break
+        if len(io.read_active_site(copy).residues) != len(io.read_active_site(template).residues):
+            return False
+    return True
+
+
+def run_stage(stage, directory, state, k):
+    """
+    Run one stage of the pipeline.
+
+    Input:  stage name
+            corpus directory
+            dictionary passed between stages (holds the active sites)
+            number of clusters
+    Output: None
+    """
+    if stage == 'read':
+        ## Parsed in this process: tracemalloc only sees this process's memory, and a process
+        #  pool would add its start up to the time
+        with contextlib.redirect_stdout(None):
+            state['active_sites'] = io.read_active_sites(directory, workers=1, cache=False)
+    elif stage == 'score':
+        ## Raw scores are kept in the store and the feature cache, drop them so every repeat
+        #  computes them
+        for store in {id(site.store): site.store for site in state['active_sites']}.values():
+            store.raw_scores = None
+        features.cache.clear()
+        utils.active_site_score(state['active_sites'])
+    elif stage == 'partition':
+        cluster.cluster_by_partitioning(state['active_sites'], k, 20)
+    elif stage == 'hierarchical':
+        cluster.cluster_hierarchically(state['active_sites'], k)
+
+
+def benchmark(directory, repeats, k, memory):
+    """
+    Time every stage on one corpus, and optionally measure its peak memory.
+
+    Input:  corpus directory
+            number of timed repeats of each stage
+            number of clusters
+            whether to measure peak memory
+    Output: dictionary from stage name to {'seconds': best time, 'peak_bytes': peak memory or None}
+    """
+    results = {}
+    state = {}
+    for stage in STAGES:
+        best = float('inf')
+        for i in range(repeats):
+            start = time.perf_counter()
+            run_stage(stage, directory, state, k)
+            best = min(best, time.perf_counter() - start)
+        results[stage] = {'seconds': best, 'peak_bytes': None}
+
+    ## Peak memory in a separate pass, tracemalloc slows down whatever it traces
+    if memory:
+        state = {}
+        tracemalloc.start()
+        try:
+            for stage in STAGES:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                run_stage(stage, directory, state, k)
+                results[stage]['peak_bytes'] = tracemalloc.get_traced_memory()[1] - before
+        finally:
+            tracemalloc.stop()
+
+    return results
+
+
+def scaling(records):
+    """
+    Scaling exponent of every stage between consecutive corpus sizes: time grows as size**exponent.
+
+    Input:  list of result records
+    Output: dictionary from (stage, size) to the exponent from the previous size
+    """
+    exponents = {}
+    for stage in STAGES:
+        points = sorted([(r['size'], r['seconds']) for r in records if r['stage'] == stage])
+        for (n_a, t_a), (n_b, t_b) in zip(points[:-1], points[1:]):
+            if t_a > 0 and t_b > 0 and n_b > n_a:
+                exponents[(stage, n_b)] = math.log(t_b/t_a)/math.log(n_b/n_a)
+    return exponents
+
+
+def compare(records, baseline, tolerance):
+    """
+    Find stages that got slower than in a baseline run.
+
+    Input:  list of result records
+            list of baseline result records
+            allowed relative slowdown (0.25 is 25% slower)
+    Output: list of (stage, size, baseline seconds, seconds) for every regression
+    """
+    before = {(r['stage'], r['size']): r['seconds'] for r in baseline}
+    regressions = []
+    for r in records:
+        key = (r['stage'], r['size'])
+        if key in before and r['seconds'] > before[key]*(1 + tolerance):
+            regressions.append((r['stage'], r['size'], before[key], r['seconds']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading, scoring and clustering at scale")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="corpus sizes in active sites (default 1000 10000 100000)")
+    parser.add_argument("--templates", default="data", help="directory of template PDB files (default data)")
+    parser.add_argument("--workdir", help="directory to keep the corpora in and reuse between runs "
+                                          "(default a temporary directory that is removed afterwards)")
+    parser.add_argument("--repeats", type=int, default=3, help="timed repeats per stage, the best is kept (default 3)")
+    parser.add_argument("-k", type=int, default=10, help="number of clusters (default 10)")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the peak memory pass")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative slowdown against the baseline counted as a regression (default 0.25)")
+    parser.add_argument("--plot", metavar="PATH", help="save a log-log plot of the scaling curves")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="hw2skeleton-bench-")
+    records = []
+    try:
+        for size in args.sizes:
+            directory = os.path.join(workdir, "corpus-%d"%size)
+            synthesize_corpus(directory, size, args.templates)
+            for stage, result in benchmark(directory, args.repeats, args.k, args.memory).items():
+                records.append(dict(stage=stage, size=size, **result))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+
+    exponents = scaling(records)
+    print("%-14s %9s %12s %12s %12s %9s"%("stage", "sites", "seconds", "sites/s", "peak MB", "exponent"))
+    for r in sorted(records, key=lambda r: (STAGES.index(r['stage']), r['size'])):
+        peak = "%12.1f"%(r['peak_bytes']/1e6) if r['peak_bytes'] is not None else "%12s"%"-"
+        exponent = exponents.get((r['stage'], r['size']))
+        print("%-14s %9d %12.4f %12.0f %s %9s"%(r['stage'], r['size'], r['seconds'], r['size']/r['seconds'], peak,
+                                                "%.2f"%exponent if exponent is not None else "-"))
+
+    if args.output:
+        meta = {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(), 'numpy': np.__version__,
+                'platform': platform.platform(), 'cpus': os.cpu_count(),
+                'repeats': args.repeats, 'k': args.k}
+        with open(args.output, "w") as f:
+            json.dump({'meta': meta, 'results': records}, f, indent=2)
+
+    if args.plot:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as pp
+        pp.figure(figsize=(8, 6))
+        for stage in STAGES:
+            points = sorted([(r['size'], r['seconds']) for r in records if r['stage'] == stage])
+            pp.loglog([p[0] for p in points], [p[1] for p in points], 'x-', label=stage)
+        pp.grid(True)
+        pp.legend()
+        pp.xlabel("active sites")
+        pp.ylabel("seconds")
+        pp.savefig(args.plot)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)['results']
+        regressions = compare(records, baseline, args.tolerance)
+        for stage, size, before, after in regressions:
+            print("REGRESSION %s at %d sites: %.4fs -> %.4fs (%.0f%% slower)"%(stage, size, before, after,
+                                                                            (after/before - 1)*100))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+# Only numpy is imported at the top of the modules of this package. scipy, matplotlib, the process
+# pool machinery and cProfile each take longer to import than the rest of the package, so they are
+# imported inside the functions that use them, and only cost anything when used.
+# test/test_startup.py checks that "python -m hw2skeleton --help" imports none of them.
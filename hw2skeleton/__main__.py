@@ -1,24 +1,203 @@
+import argparse
+import os
 import sys
-from .io import read_active_sites, write_clustering, write_mult_clusterings
-from .cluster import cluster_by_partitioning, cluster_hierarchically
-from .utils import active_site_score
+import tracemalloc
+from .io import read_active_sites, write_clustering, write_mult_clusterings, FORMATS
+from .cluster import cluster_by_partitioning, cluster_hierarchically, hierarchical_linkage, cut_hierarchy
+from .cluster import summary_linkage
+from .cluster import weighted_features, pairwise_distances, MiniBatchKMeans
+from .cluster import validate_clustering, visualize_h_cluster
+from .utils import active_site_score, site_features
+from .geometry import shape_distances
+from .sweep import cluster_with_restarts
+from .dataset import read_dataset, write_dataset
+from . import metrics
 
-# Some quick stuff to make sure the program is called correctly
-if len(sys.argv) < 4:
-    print("Usage: python -m hw2skeleton [-P| -H] <pdb directory> <output file>")
+## Batch mode has a command line of its own, see batch.py
+if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+    from .batch import main
+    main(sys.argv[2:])
     sys.exit(0)
 
-active_sites = read_active_sites(sys.argv[2])
-active_site_score(active_sites)
+parser = argparse.ArgumentParser(prog="python -m hw2skeleton",
+                                 usage="python -m hw2skeleton [-P| -H] <pdb directory> <output file> [-k K [K ...]]\n"
+                                       "       python -m hw2skeleton batch <dataset> [<dataset> ...] -o <output dir> "
+                                       "[-m P H] [-k K [K ...]] [-j WORKERS]")
+method = parser.add_mutually_exclusive_group(required=True)
+method.add_argument("-P", dest="method", action="store_const", const="P", help="partitioning (k-means) clustering")
+method.add_argument("-H", dest="method", action="store_const", const="H", help="hierarchical clustering")
+parser.add_argument("directory", help="directory of PDB files, or a packed dataset file")
+parser.add_argument("output", help="file to write the clustering to")
+parser.add_argument("-k", type=int, nargs="+",
+                    help="number of clusters, several values write one clustering per value (default 3, or the "
+                         "k of an existing --model)")
+parser.add_argument("--format", choices=FORMATS,
+                    help="output format, picked from the output file extension (.csv, .jsonl, .npz) if not given, "
+                         "otherwise text")
+parser.add_argument("--iterations", type=int, default=20,
+                    help="maximum number of k-means iterations (default 20)")
+parser.add_argument("--restarts", type=int, default=1,
+                    help="with -P, run this many independently seeded k-means runs and keep the one with the "
+                         "lowest cluster score (default 1)")
+parser.add_argument("--seed", type=int, default=0, help="random seed of the k-means runs (default 0)")
+parser.add_argument("-j", "--workers", type=int, default=1,
+                    help="with --restarts, number of runs to do in parallel, and with --similarity shape, number "
+                         "of threads comparing shapes, 0 for one per CPU (default 1)")
+parser.add_argument("--threshold", type=float, nargs="+", default=[],
+                    help="with -H, also cut the hierarchy at these merge distances")
+parser.add_argument("--similarity", choices=["score", "euclidean", "cosine", "shape"], default="score",
+                    help="compare sites by score, by the weighted euclidean or cosine distance between "
+                         "their lysine, arginine and hydrophobicity scores, or (with -H) by the 3-D shape "
+                         "of their atoms (default score)")
+parser.add_argument("--weights", type=float, nargs=3, metavar="W",
+                    help="weights of the lysine, arginine and hydrophobicity scores for --similarity")
+parser.add_argument("--max-memory", type=float, metavar="MB",
+                    help="with -H, cluster micro-clusters of the sites held in about MB megabytes instead of the "
+                         "sites themselves, for sets of sites too large for a distance matrix (feature "
+                         "similarities then use Ward linkage)")
+parser.add_argument("--model", metavar="PATH",
+                    help="with -P, update the online k-means model saved at PATH with the sites (creating "
+                         "it with -k if missing), save it, and write its clustering")
+parser.add_argument("--cache", action="store_true",
+                    help="keep a cache of the parsed sites in the PDB directory, so later runs only parse new or "
+                         "changed files")
+parser.add_argument("--lazy", action="store_true",
+                    help="keep only the names and scores of the sites of a PDB directory in memory, reading a "
+                         "site's atoms from its file only when they are needed")
+parser.add_argument("--write-dataset", metavar="PATH",
+                    help="also write the active sites to a packed, memory-mappable dataset file")
+parser.add_argument("--validate", action="store_true",
+                    help="check that every clustering holds each active site exactly once")
+parser.add_argument("--plot", action="store_true",
+                    help="plot the cluster centroids of every clustering")
+parser.add_argument("--metrics", nargs="?", const=True, metavar="PATH",
+                    help="write stage timings and counters as JSON to PATH (default <output>.metrics.json)")
+parser.add_argument("--profile", metavar="PATH",
+                    help="run under cProfile, save the stats to PATH and print the slowest functions")
+parser.add_argument("--trace-memory", action="store_true",
+                    help="trace memory allocations, adding the peak memory of every stage to the metrics")
+args = parser.parse_args()
+if args.similarity == 'shape' and args.method == 'P':
+    parser.error("--similarity shape needs hierarchical clustering (-H)")
+if args.max_memory is not None and (args.method != 'H' or args.similarity == 'shape'):
+    parser.error("--max-memory needs hierarchical clustering (-H) by score or features")
+if args.restarts > 1 and (args.method != 'P' or args.model):
+    parser.error("--restarts needs partitioning (-P) without --model")
+if args.model and (args.method != 'P' or args.similarity != 'score'):
+    parser.error("--model needs partitioning (-P) by score")
+if (args.lazy or args.cache) and os.path.isfile(args.directory):
+    parser.error("--lazy and --cache read PDB directories, a packed dataset is already memory mapped")
+
+## A saved model keeps the k it was created with
+model = None
+if args.model:
+    if args.k is not None and len(args.k) > 1:
+        parser.error("--model clusters with a single -k")
+    if os.path.exists(args.model):
+        try:
+            model = MiniBatchKMeans.load(args.model)
+        except (IOError, KeyError) as error:
+            parser.error("cannot use --model %s: %s"%(args.model, error))
+        if args.k is not None and args.k[0] != model.k:
+            parser.error("--model %s has k=%d, not %d"%(args.model, model.k, args.k[0]))
+    else:
+        model = MiniBatchKMeans(args.k[0] if args.k is not None else 3)
+if args.k is None:
+    args.k = [model.k] if model is not None else [3]
+
+if args.trace_memory:
+    tracemalloc.start()
+profiler = None
+if args.profile:
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+with metrics.timer('read'):
+    if os.path.isfile(args.directory):
+        active_sites = read_dataset(args.directory)
+    else:
+        active_sites = read_active_sites(args.directory, cache=args.cache, lazy=args.lazy)
+
+if args.write_dataset:
+    with metrics.timer('write_dataset'):
+        write_dataset(args.write_dataset, active_sites)
+
+## A saved model scores the sites with the normalization its centers were learned with
+with metrics.timer('score'):
+    if model is not None:
+        model.score(active_sites)
+    else:
+        active_site_score(active_sites)
+
+## With a feature similarity, partitioning clusters the weighted feature vectors and the
+#  hierarchy is built from their precomputed pairwise distances, or from micro-clusters of the
+#  feature vectors with --max-memory
+features = None
+distances = None
+with metrics.timer('similarity'):
+    if args.similarity != 'score' and (args.method == 'P' or args.max_memory is not None):
+        features = weighted_features(site_features(active_sites), args.similarity, args.weights)
+    if args.similarity == 'shape':
+        distances = shape_distances(active_sites, workers=args.workers or -1)
+    elif args.similarity != 'score' and args.method == 'H' and args.max_memory is None:
+        distances = pairwise_distances(site_features(active_sites), args.similarity, args.weights)
 
 # Choose clustering algorithm
-if sys.argv[1][0:2] == '-P':
-    print("Clustering using Partitioning method")
-    clustering = cluster_by_partitioning(active_sites, 3, 20)
-    write_clustering(sys.argv[3], clustering)
-
-if sys.argv[1][0:2] == '-H':
-    print("Clustering using hierarchical method")
-    clusterings = cluster_hierarchically(active_sites, 3)
-    write_clustering(sys.argv[3], clusterings)
-    #write_mult_clusterings(sys.argv[3], clusterings)
+with metrics.timer('cluster'):
+    if args.method == 'P':
+        print("Clustering using Partitioning method")
+        if model is not None:
+            model.fit_stream(active_sites)
+            model.save(args.model)
+            clusterings = [model.cluster(active_sites)]
+        elif args.restarts > 1:
+            clusterings = [cluster_with_restarts(active_sites, k, args.restarts, args.seed, args.iterations,
+                                                 args.workers or None, features)[0] for k in args.k]
+        else:
+            clusterings = [cluster_by_partitioning(active_sites, k, args.iterations, seed=args.seed, features=features)
+                           for k in args.k]
+
+    if args.method == 'H':
+        print("Clustering using hierarchical method")
+        if args.max_memory is not None:
+            leaves, merges = summary_linkage(active_sites, features, int(args.max_memory*2**20))
+            try:
+                clusterings = [cut_hierarchy(active_sites, merges, k=k, leaves=leaves) for k in args.k]
+            except ValueError as error:
+                parser.error("%s (--max-memory)"%error)
+            clusterings += [cut_hierarchy(active_sites, merges, threshold=t, leaves=leaves) for t in args.threshold]
+        elif len(args.k) == 1 and len(args.threshold) == 0:
+            clusterings = [cluster_hierarchically(active_sites, args.k[0], distances)]
+        else:
+            ## Build the tree once and cut it for every k and threshold
+            merges = hierarchical_linkage(active_sites, distances)
+            clusterings = [cut_hierarchy(active_sites, merges, k=k) for k in args.k]
+            clusterings += [cut_hierarchy(active_sites, merges, threshold=t) for t in args.threshold]
+
+if args.validate:
+    for clustering in clusterings:
+        validate_clustering(active_sites, clustering)
+
+if args.plot:
+    for clustering in clusterings:
+        visualize_h_cluster(clustering, True)
+
+with metrics.timer('write'):
+    if len(clusterings) == 1:
+        write_clustering(args.output, clusterings[0], args.format)
+    else:
+        write_mult_clusterings(args.output, clusterings, args.format)
+
+if profiler is not None:
+    profiler.disable()
+    profiler.dump_stats(args.profile)
+    import pstats
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+
+if args.trace_memory:
+    tracemalloc.stop()
+
+if args.metrics:
+    path = args.output + ".metrics.json" if args.metrics is True else args.metrics
+    metrics.write_report(path, arguments=vars(args), sites=len(active_sites), clusters=[len(c) for c in clusterings])
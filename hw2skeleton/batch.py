@@ -0,0 +1,165 @@
+# Cluster many datasets with many methods and k values in one process
+
+import argparse
+import os
+import time
+from .io import read_active_sites, write_clustering, write_mult_clusterings, FORMATS
+from .cluster import cluster_by_partitioning, hierarchical_linkage, cut_hierarchy
+from .utils import active_site_score
+from .dataset import read_dataset
+
+
+## Clustering methods, by the flag the single dataset command line uses for them
+METHODS = ('P', 'H')
+
+
+def load_scored(path, cache=False, workers=None):
+    """
+    Read in and score the active sites of a PDB directory or a packed dataset file.
+
+    Input:  directory of PDB files, or dataset file
+            whether to use the cache of a PDB directory
+            number of worker processes for parsing (see io.read_active_sites)
+    Output: list of scored active sites
+    """
+    if os.path.isfile(path):
+        active_sites = read_dataset(path)
+    else:
+        active_sites = read_active_sites(path, workers=workers, cache=cache)
+
+    active_site_score(active_sites)
+
+    return active_sites
+
+
+def cluster_all(active_sites, method, ks, iterations=20):
+    """
+    Cluster a set of active sites at every k with one method. The hierarchy is built once and
+    cut at every k.
+
+    Input:  list of scored active sites
+            'P' (partitioning) or 'H' (hierarchical)
+            list of numbers of clusters
+            maximum number of k-means iterations
+    Output: list of clusterings, one per k
+    """
+    if method == 'P':
+        return [cluster_by_partitioning(active_sites, k, iterations) for k in ks]
+    if method == 'H':
+        merges = hierarchical_linkage(active_sites)
+        return [cut_hierarchy(active_sites, merges, k=k) for k in ks]
+    raise ValueError("Unknown clustering method %r"%method)
+
+
+def output_path(output_dir, path, method, format='text'):
+    """
+    File the clusterings of one dataset by one method are written to.
+
+    Input:  output directory
+            dataset directory or file
+            clustering method
+            output format (see io.FORMATS)
+    Output: <output_dir>/<dataset name>_<method>.<txt, csv, jsonl or npz>
+    """
+    name = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+    return os.path.join(output_dir, "%s_%s.%s"%(name, method, 'txt' if format == 'text' else format))
+
+
+def run_dataset(path, methods, ks, output_dir, iterations=20, cache=False, workers=None, format='text'):
+    """
+    Load and score one dataset once, cluster it with every method at every k, and write the
+    clusterings of each method to one file in the output directory.
+
+    Input:  dataset directory or file
+            list of clustering methods
+            list of numbers of clusters
+            output directory
+            maximum number of k-means iterations
+            whether to use the cache of a PDB directory
+            number of worker processes for parsing
+            output format (see io.FORMATS)
+    Output: list of (output file, number of clusters of every clustering), one per method
+    """
+    active_sites = load_scored(path, cache, workers)
+
+    written = []
+    for method in methods:
+        clusterings = cluster_all(active_sites, method, ks, iterations)
+        filename = output_path(output_dir, path, method, format)
+        if len(clusterings) == 1:
+            write_clustering(filename, clusterings[0], format)
+        else:
+            write_mult_clusterings(filename, clusterings, format)
+        written.append((filename, [len(clustering) for clustering in clusterings]))
+
+    return written
+
+
+def run_batch(paths, methods, ks, output_dir, iterations=20, cache=False, workers=1, format='text'):
+    """
+    Run run_dataset on several datasets, in a pool of worker processes when workers > 1.
+
+    Every dataset is handled start to finish by one worker, so only file names and cluster
+    sizes travel between processes. With a pool, each worker parses its files itself instead
+    of starting a pool of its own.
+
+    Input:  list of dataset directories or files
+            list of clustering methods
+            list of numbers of clusters
+            output directory (created if missing)
+            maximum number of k-means iterations
+            whether to use the cache of a PDB directory
+            number of worker processes (None for one per CPU)
+            output format (see io.FORMATS)
+    Output: list of (output file, number of clusters of every clustering), in the order of the
+            datasets and methods
+    """
+    for method in methods:
+        if method not in METHODS:
+            raise ValueError("Unknown clustering method %r"%method)
+    if len(set([output_path(output_dir, path, METHODS[0]) for path in paths])) != len(paths):
+        raise ValueError("Datasets must have different names, their results would overwrite each other")
+    os.makedirs(output_dir, exist_ok=True)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(paths))
+
+    if workers <= 1:
+        results = [run_dataset(path, methods, ks, output_dir, iterations, cache, None, format) for path in paths]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_dataset, path, methods, ks, output_dir, iterations, cache, 1, format)
+                       for path in paths]
+            results = [future.result() for future in futures]
+
+    return [written for result in results for written in result]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m hw2skeleton batch",
+                                     description="Cluster several datasets at several k with several methods, "
+                                                 "loading and scoring each dataset once")
+    parser.add_argument("datasets", nargs="+", help="directories of PDB files, or packed dataset files")
+    parser.add_argument("-o", "--output-dir", required=True,
+                        help="directory to write <dataset>_<method> files to, one clustering per k")
+    parser.add_argument("-m", "--methods", nargs="+", choices=METHODS, default=list(METHODS),
+                        help="P for partitioning, H for hierarchical (default both)")
+    parser.add_argument("-k", type=int, nargs="+", default=[3], help="numbers of clusters (default 3)")
+    parser.add_argument("--format", choices=FORMATS, default='text',
+                        help="output format, text, csv, jsonl or npz (default text)")
+    parser.add_argument("--iterations", type=int, default=20, help="maximum number of k-means iterations (default 20)")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="number of datasets to process in parallel, 0 for one per CPU (default 1)")
+    parser.add_argument("--cache", action="store_true",
+                        help="keep a cache of the parsed sites in each PDB directory, so later runs only parse new "
+                             "or changed files")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    written = run_batch(args.datasets, args.methods, args.k, args.output_dir, args.iterations, args.cache,
+                        args.workers or None, args.format)
+    for filename, sizes in written:
+        print("Wrote %s (%s clusters)"%(filename, ", ".join([str(size) for size in sizes])))
+    print("Clustered %d datasets in %.2fs"%(len(args.datasets), time.perf_counter() - start))
@@ -0,0 +1,153 @@
+# On-disk cache of parsed active sites, and the helpers every saved file is written with
+
+import contextlib
+import os
+import numpy as np
+from .store import StructureStore
+
+
+## Every .npz file the package saves (this cache, k-means models, site indices) holds a version
+#  number, bumped whenever the layout of the file or the meaning of a saved array changes
+CACHE_VERSION = 1
+
+## File name of the cache kept in a PDB directory, when no other path is given
+CACHE_NAME = ".hw2skeleton-cache.npz"
+
+
+def cache_path(dir):
+    """
+    Default location of the cache for a PDB directory.
+
+    Input:  directory
+    Output: path of the cache file
+    """
+    return os.path.join(dir, CACHE_NAME)
+
+
+@contextlib.contextmanager
+def atomic_write(path):
+    """
+    Open a file for writing through a temporary file next to it, which is moved into place once
+    it is complete, so a reader never sees a half written file.
+
+    Input:  file path
+    Output: context manager giving a binary file object
+    """
+    temporary = path + ".tmp"
+    try:
+        with open(temporary, "wb") as f:
+            yield f
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def save_npz(path, version, **arrays):
+    """
+    Write arrays and a version number to a .npz file, through atomic_write.
+
+    Input:  file path
+            version of the file layout
+            arrays by name
+    Output: None
+    """
+    with atomic_write(path) as f:
+        np.savez(f, version=version, **arrays)
+
+
+def load_npz(path, version, kind):
+    """
+    Read every array of a .npz file written by save_npz, refusing other versions.
+
+    Input:  file path
+            expected version
+            what the file holds, for the error message (e.g. 'site index')
+    Output: dictionary of arrays by name (without the version)
+    """
+    with np.load(path, allow_pickle=False) as saved:
+        if int(saved['version']) != version:
+            raise IOError("%s has %s version %s, expected %d"%(path, kind, saved['version'], version))
+        return {name: saved[name] for name in saved.files if name != 'version'}
+
+
+def file_stamps(filepaths):
+    """
+    Modification time and size of every file, used to tell whether a cached parse is stale.
+
+    Input:  list of file paths
+    Output: (n_files, 2) int64 array of (mtime in nanoseconds, size in bytes)
+    """
+    stamps = np.zeros((len(filepaths), 2), dtype=np.int64)
+    for i, filepath in enumerate(filepaths):
+        stat = os.stat(filepath)
+        stamps[i] = (stat.st_mtime_ns, stat.st_size)
+    return stamps
+
+
+def load_cache(path):
+    """
+    Load a cache file.
+
+    A missing, unreadable or out of date cache is treated as empty.
+
+    Input:  path of the cache file
+    Output: dictionary from file name to (mtime, size) stamp
+            StructureStore of the cached sites, one site per file in the same order
+            (None if there is no usable cache)
+    """
+    try:
+        with np.load(path, allow_pickle=False) as cache:
+            if int(cache['version']) != CACHE_VERSION:
+                return {}, None
+            store = StructureStore(*[cache[array] for array in StructureStore.ARRAYS])
+            store.raw_scores = cache['raw_scores']
+            files = cache['files'].tolist()
+            stamps = [tuple(stamp) for stamp in cache['stamps'].tolist()]
+    except (OSError, KeyError, ValueError):
+        return {}, None
+
+    return dict(zip(files, stamps)), store
+
+
+def load_summary(path):
+    """
+    Load only the file stamps and raw scores of a cache file, leaving the residues and atoms on
+    disk.
+
+    A missing, unreadable or out of date cache is treated as empty.
+
+    Input:  path of the cache file
+    Output: dictionary from file name to (mtime, size) stamp
+            (n_files, 3) array of raw scores, one row per file in the same order
+            (None if there is no usable cache)
+    """
+    try:
+        with np.load(path, allow_pickle=False) as cache:
+            if int(cache['version']) != CACHE_VERSION:
+                return {}, None
+            raw_scores = cache['raw_scores']
+            files = cache['files'].tolist()
+            stamps = [tuple(stamp) for stamp in cache['stamps'].tolist()]
+    except (OSError, KeyError, ValueError):
+        return {}, None
+
+    return dict(zip(files, stamps)), raw_scores
+
+
+def save_cache(path, files, stamps, store):
+    """
+    Write the parsed sites of a directory to a cache file.
+
+    The file is written through atomic_write, so a reader never sees a half written cache.
+
+    Input:  path of the cache file
+            list of file names, one per site in the store
+            (n_files, 2) array of file stamps from file_stamps
+            StructureStore with raw_scores filled in
+    Output: None
+    """
+    arrays = {array: getattr(store, array) for array in StructureStore.ARRAYS}
+
+    save_npz(path, CACHE_VERSION, files=np.array(files, dtype=str), stamps=stamps,
+             raw_scores=store.raw_scores, **arrays)
@@ -1,8 +1,17 @@
-from .utils import Atom, Residue, ActiveSite
-import matplotlib.pyplot as pp
+import heapq
+import itertools
+from .utils import Atom, Residue, ActiveSite, site_features
+from .utils import site_raw_scores, score_normalization, write_scores
+from .geometry import site_shapes, shape_distance
+from .cache import save_npz, load_npz
+from . import metrics
 import numpy as np
 
-def compute_similarity(site_a, site_b):
+## Points per chunk when assigning points to k-means centers, which bounds the memory of the
+#  (chunk, k) distance arrays
+CHUNK_SIZE = 65536
+
+def compute_similarity(site_a, site_b, method='score', weights=None):
     """
     Compute the similarity between two given ActiveSite instances.
 
@@ -10,7 +19,18 @@ def compute_similarity(site_a, site_b):
     for every active site. To check the similarity just find the absolute difference in the scores. A smaller
     difference means more similar.
 
+    Instead of the single score, the sites can also be compared by their feature vectors of
+    normalized lysine, arginine and hydrophobicity scores (see utils.site_features), with a
+    weighted Euclidean or cosine distance. To compare many sites, compute all distances at
+    once with pairwise_distances.
+
+    With 'shape' the sites are compared by the 3-D arrangement of their atoms instead, after
+    aligning them (see geometry.shape_distance). For many sites use geometry.shape_distances,
+    which aligns and indexes every site only once.
+
     Input: two ActiveSite instances
+           similarity method, 'score', 'euclidean', 'cosine' or 'shape'
+           weight of each feature (all 1 if None), for 'euclidean' and 'cosine'
     Output: the similarity between them (a floating point number)
     """
 
@@ -18,168 +38,1076 @@ def compute_similarity(site_a, site_b):
 
     # Fill in your code here!
 
-    similarity = abs(site_a.score - site_b.score)
-
+    metrics.count('distance_evaluations')
+    if method == 'score':
+        similarity = abs(site_a.score - site_b.score)
+    elif method == 'shape':
+        shape_a, shape_b = site_shapes([site_a, site_b])
+        similarity = shape_distance(shape_a, shape_b)
+    else:
+        similarity = float(pairwise_distances(site_features([site_a, site_b]), method, weights)[0])
 
     return similarity
 
 
-def cluster_by_partitioning(active_sites, k, iterations):
+def weighted_features(features, method='euclidean', weights=None):
+    """
+    Transform feature vectors so that plain Euclidean geometry on the result matches a weighted
+    distance on the original vectors.
+
+    Every feature is scaled by the square root of its weight. For 'cosine' the vectors are then
+    scaled to unit length (a zero vector stays zero), and the Euclidean distance between two of
+    them is sqrt(2*cosine distance), so clusterings by either agree.
+
+    Input:  (n, d) array of feature vectors, or (n,) array of single features
+            distance method, 'euclidean' or 'cosine'
+            weight of each feature (all 1 if None)
+    Output: (n, d) float array
+    """
+    X = np.asarray(features, dtype=float)
+    if X.ndim == 1:
+        X = X[:, None]
+
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)
+        if weights.shape != (X.shape[1],) or (weights < 0).any():
+            raise ValueError("Expected %d non-negative feature weights"%X.shape[1])
+        X = X*np.sqrt(weights)
+
+    if method == 'cosine':
+        norms = np.sqrt((X*X).sum(axis=1))
+        X = X/np.where(norms > 0, norms, 1.0)[:, None]
+    elif method != 'euclidean':
+        raise ValueError("Unknown distance method %r"%method)
+
+    return X
+
+
+def condensed_index(n, i, j):
+    """
+    Position of the distance between points i and j in a condensed distance matrix of n points.
+
+    The condensed matrix holds the upper triangle of the n x n distance matrix row by row (the
+    format of scipy.spatial.distance.pdist), so the distances from point i to all points after
+    it start at i*n - i*(i + 1)/2.
+
+    Input:  Number of points
+            Two different point indices (integers or arrays)
+    Output: Index into the condensed matrix
+    """
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    return i*n - i*(i + 1)//2 + (j - i - 1)
+
+
+def pairwise_distances(features, method='euclidean', weights=None, dtype=np.float64, block_size=2**22):
+    """
+    Compute the distance between every pair of feature vectors, as a condensed distance matrix.
+
+    Distances are computed in blocks of rows against all later points, so that at most about
+    block_size distances are held in working memory at once, and stored straight into the
+    condensed matrix. The result takes n*(n - 1)/2 values of dtype. float32 halves that, but
+    hierarchical_linkage needs float64 distances and would make a float64 copy of it.
+
+    Input:  (n, d) array of feature vectors, e.g. from utils.site_features
+            distance method, 'euclidean' (weighted Euclidean distance) or 'cosine'
+            (1 - weighted cosine similarity, 1 between a zero vector and anything)
+            weight of each feature (all 1 if None)
+            dtype to store the distances in
+            number of distances to compute at once
+    Output: Array of n*(n - 1)/2 distances, the distance between i < j at condensed_index(n, i, j)
+    """
+    X = weighted_features(features, method, weights)
+    n = len(X)
+    distances = np.empty(n*(n - 1)//2, dtype=dtype)
+
+    rows = max(1, block_size//max(n, 1))
+    for start in range(0, n - 1, rows):
+        stop = min(start + rows, n - 1)
+
+        ## Distances from this block of rows to every point from the block on
+        block = X[start:stop]
+        if method == 'cosine':
+            block_distances = np.clip(1.0 - block @ X[start:].T, 0.0, 2.0)
+        else:
+            squared = np.zeros((stop - start, n - start))
+            for j in range(X.shape[1]):
+                squared += (block[:, j, None] - X[None, start:, j])**2
+            block_distances = np.sqrt(squared)
+
+        ## The upper triangle of the block, row by row, is one contiguous run of the matrix
+        upper = np.arange(n - start)[None, :] > np.arange(stop - start)[:, None]
+        distances[condensed_index(n, start, start + 1):condensed_index(n, stop, stop + 1)] = block_distances[upper]
+
+    metrics.count('distance_evaluations', len(distances))
+
+    return distances
+
+
+def cluster_by_partitioning(active_sites, k, iterations, tol=1e-4, n_init=1, seed=0, init='k-means++',
+                            features=None):
     """
     Cluster a given set of ActiveSite instances using a partitioning method.
     I am clustering by k_means.
 
-    Input: a list of ActiveSite instances, k clusters, number of k_means iterations
+    The clustering is done on active_site.score by kmeans, which stops early once the means stop
+    moving. With n_init > 1 several differently seeded runs are done at once, and the one with
+    the tightest clusters is kept.
+
+    To cluster on feature vectors instead of the score, pass them as features, e.g.
+    weighted_features(site_features(active_sites), method, weights).
+
+    Input: a list of ActiveSite instances, k clusters, maximum number of k_means iterations
+           convergence tolerance, number of seeded runs, random seed and seeding method
+           (see kmeans)
+           (n, d) array of features to cluster on, one row per active site (scores if None)
     Output: a clustering of ActiveSite instances
             (this is really a list of clusters, each of which is list of
             ActiveSite instances)
     """
-    # Fill in your code here!
 
     if len(active_sites) <= 1:
         return active_sites
 
-    ## Initializing k_means dictionary with arbitrary k means
-    k_means = {active_sites[i].score:[] for i in range(0,k)}
+    if features is None:
+        features = np.array([active_site.score for active_site in active_sites], dtype=float)
+    labels, centers, inertia, n_iter = kmeans(features, k, iterations, tol=tol, n_init=n_init, seed=seed, init=init)
 
-    ## Loop clustering for the desired number of iterations
-    for i in range(0, iterations):
+    return group_by_center(active_sites, labels, centers)
 
-        ## Find the closest mean for every site in active sites, measured by score
-        for site in active_sites:
-            closest_mean = 1000000000 ## Initialize with massive value that will hopefully not cause bugs
-                                      ## site.scores are centered around 0, so this number should never be met
 
-            ## Check how far to every mean, save if closer mean is found
-            for k_mean in k_means.keys():
-                if abs(site.score - k_mean) < abs(site.score - closest_mean):
-                    closest_mean = k_mean
+def group_by_center(active_sites, labels, centers):
+    """
+    Group active sites by the center they were assigned to.
 
-            ## Use the closest found mean to append the active site to the k_means dictionary
-            k_means[closest_mean].append(site)
+    Input:  a list of ActiveSite instances
+            array of center indices, one per active site
+            (k, d) array of centers
+    Output: a list of clusters in order of their centers (summed over features), leaving out
+            any cluster that ended up empty, each in the order of active_sites
+    """
+    clusters = [[] for i in range(len(centers))]
+    for active_site, label in zip(active_sites, labels.tolist()):
+        clusters[label].append(active_site)
 
-        ## Placeholder for new k_means dictionary keys
-        new_means = [sum([list_item.score for list_item in mean_list])/len(mean_list) for mean_list in k_means.values()]
+    return [clusters[i] for i in np.argsort(centers.sum(axis=1), kind='stable') if len(clusters[i]) > 0]
 
-        ## Save old k_means dictionary in case this is the last iteration
-        return_means = k_means
 
-        ## Create new k_means dictionary using newly generated means
-        k_means = {new_mean:[] for new_mean in new_means}
+def kmeans(X, k, iterations=300, tol=1e-4, n_init=1, seed=0, init='k-means++', chunk_size=CHUNK_SIZE):
+    """
+    Lloyd's k-means on an array of points, with every step done as batched NumPy operations.
+
+    Each run is seeded from its own random stream spawned from seed, either by k-means++ (centers
+    picked with probability proportional to the squared distance to the closest center picked
+    so far) or from the first k points ('first'). All n_init runs are iterated together. A run
+    has converged when the squared distance its centers moved is at most tol times the mean
+    variance of the points. A center that loses all of its points is moved to the point
+    farthest from its own center.
+
+    Input:  (n, d) array of points, or (n,) array of 1-D points
+            number of clusters
+            maximum number of iterations
+            convergence tolerance
+            number of independently seeded runs
+            random seed (an integer or a numpy SeedSequence)
+            seeding method, 'k-means++' or 'first'
+            number of points to compute distances for at once
+    Output: array of cluster labels, one per point
+            (k, d) array of cluster centers
+            inertia (sum of squared distances of points to their centers)
+            number of iterations until convergence
+            (all for the run with the lowest inertia)
+    """
+    X = np.asarray(X, dtype=float)
+    if X.ndim == 1:
+        X = X[:, None]
+    n = len(X)
+    k = min(k, n)
+
+    if init == 'k-means++':
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        rngs = [np.random.default_rng(s) for s in seed.spawn(n_init)]
+        centers = np.stack([_kmeans_plus_plus(X, k, rng) for rng in rngs])
+    elif init == 'first':
+        centers = np.repeat(X[None, :k], n_init, axis=0)
+    else:
+        raise ValueError("Unknown k-means seeding %r"%init)
+
+    tol = tol*X.var(axis=0).mean()
+    converged = np.zeros(n_init, dtype=bool)
+    n_iter = np.zeros(n_init, dtype=int)
+
+    for i in range(iterations):
+        labels, distances = _kmeans_assign(X, centers, chunk_size)
+        new_centers = _kmeans_update(X, k, labels, distances, centers)
+
+        shift = ((new_centers - centers)**2).sum(axis=(1, 2))
+        centers = new_centers
+
+        n_iter[~converged] = i + 1
+        converged |= shift <= tol
+        metrics.count('kmeans_iterations')
+        if converged.all():
+            break
+
+    ## Assignment to the final centers, and the best run
+    labels, distances = _kmeans_assign(X, centers, chunk_size)
+    inertia = distances.sum(axis=1)
+    best = int(np.argmin(inertia))
+
+    return labels[best], centers[best], float(inertia[best]), int(n_iter[best])
+
+
+def _kmeans_plus_plus(X, k, rng):
+    """
+    Pick k starting centers by k-means++.
 
-    ## Once all iterations are complete, return the lists of the clustered active sites as a list
-    return [value for value in return_means.values()]
+    Input:  (n, d) array of points
+            number of centers
+            numpy random Generator
+    Output: (k, d) array of centers
+    """
+    n = len(X)
+    chosen = [int(rng.integers(n))]
+    closest = ((X - X[chosen[0]])**2).sum(axis=1)
+
+    for i in range(1, k):
+        total = closest.sum()
+        if total > 0:
+            ## Sample proportionally to the squared distance through the cumulative sum
+            pick = int(np.searchsorted(np.cumsum(closest), rng.random()*total, side='right'))
+            pick = min(pick, n - 1)
+        else:
+            pick = int(rng.integers(n))
+        chosen.append(pick)
+        closest = np.minimum(closest, ((X - X[pick])**2).sum(axis=1))
+
+    return X[chosen]
+
+
+def _kmeans_assign(X, centers, chunk_size):
+    """
+    Assign every point to its closest center, for every run.
 
+    In 1-D the closest center is found by binary search among the midpoints between the sorted
+    centers, in O(n log k). Otherwise distances to all centers are computed a chunk of points
+    at a time.
 
-def cluster_hierarchically(active_sites, k):
+    Input:  (n, d) array of points
+            (n_runs, k, d) array of centers
+            number of points to compute distances for at once
+    Output: (n_runs, n) array of labels
+            (n_runs, n) array of squared distances to the assigned center
+    """
+    n_runs = len(centers)
+    labels = np.empty((n_runs, len(X)), dtype=np.intp)
+    distances = np.empty((n_runs, len(X)))
+
+    ## In 1-D only the distance to the closest center is computed
+    metrics.count('distance_evaluations', n_runs*len(X)*(1 if X.shape[1] == 1 else centers.shape[1]))
+
+    for run in range(n_runs):
+        if X.shape[1] == 1:
+            order = np.argsort(centers[run, :, 0], kind='stable')
+            sorted_centers = centers[run, order, 0]
+            closest = np.searchsorted((sorted_centers[1:] + sorted_centers[:-1])/2, X[:, 0])
+            labels[run] = order[closest]
+            distances[run] = (X[:, 0] - sorted_centers[closest])**2
+            continue
+
+        for start in range(0, len(X), chunk_size):
+            chunk = X[start:start + chunk_size]
+            squared = ((chunk[:, None, :] - centers[run][None, :, :])**2).sum(axis=2)
+            labels[run, start:start + chunk_size] = squared.argmin(axis=1)
+            distances[run, start:start + chunk_size] = squared.min(axis=1)
+
+    return labels, distances
+
+
+def _kmeans_update(X, k, labels, distances, centers):
+    """
+    Move every center to the mean of its points. A center without points is moved to the point
+    farthest from its own center instead.
+
+    Input:  (n, d) array of points
+            number of clusters
+            (n_runs, n) arrays of labels and squared distances from _kmeans_assign
+            (n_runs, k, d) array of the current centers
+    Output: (n_runs, k, d) array of new centers
+    """
+    n_runs, n = labels.shape
+    d = X.shape[1]
+
+    ## One bincount over all runs, with the labels of run r shifted by r*k
+    flat = (labels + (np.arange(n_runs)*k)[:, None]).ravel()
+    counts = np.bincount(flat, minlength=n_runs*k).reshape(n_runs, k)
+    sums = np.stack([np.bincount(flat, weights=np.tile(X[:, j], n_runs), minlength=n_runs*k)
+                     for j in range(d)], axis=1).reshape(n_runs, k, d)
+
+    new_centers = centers.copy()
+    filled = counts > 0
+    new_centers[filled] = sums[filled]/counts[filled][:, None]
+
+    for run, cluster in zip(*np.nonzero(~filled)):
+        farthest = int(np.argmax(distances[run]))
+        new_centers[run, cluster] = X[farthest]
+        distances[run, farthest] = 0.0
+
+    return new_centers
+
+
+class MiniBatchKMeans:
+    """
+    Online k-means that is fed active sites a batch at a time, and assigns new sites to its
+    clusters without re-clustering.
+
+    Every batch is assigned to the closest centers, and each center moves to the running mean of
+    all points ever assigned to it (mini-batch k-means, Sculley 2010): a center with c points
+    that gets b new points with sum s moves by (s - b*center)/(c + b). The centers are seeded by
+    k-means++ from the first k points seen. A center that has not had a point yet is moved to
+    the point of the batch farthest from its center.
+
+    Sites are clustered on active_site.score, or on their feature vectors (utils.site_features)
+    with features='vector'. Scores depend on the normalization of the corpus, so the model keeps
+    the normalization of the first sites it scores (see score) and scores later sites with it,
+    keeping the meaning of its centers. The model remembers the names of the sites it has
+    learned from, and skips them when they are fed again.
+
+    The model state can be saved to and loaded from a .npz file between runs.
+    """
+
+    ## Version of saved models (see cache.save_npz)
+    VERSION = 2
+
+    FEATURES = ('score', 'vector')
+
+    def __init__(self, k, seed=0, features='score'):
+        if features not in self.FEATURES:
+            raise ValueError("Unknown k-means features %r"%features)
+        self.k = k
+        self.seed = seed
+        self.features = features
+        self.centers = None
+        self.counts = None
+        self.n_batches = 0
+        self.mean = None
+        self.deviation = None
+        self.seen = set()
+        self._pending = []
+
+    def points(self, active_sites):
+        """
+        The points the model clusters active sites by.
+
+        Input:  A list of active sites
+        Output: (n, d) array of points
+        """
+        if self.features == 'vector':
+            return site_features(active_sites)
+        return np.array([active_site.score for active_site in active_sites], dtype=float).reshape(-1, 1)
+
+    def score(self, active_sites):
+        """
+        Score active sites (see utils.active_site_score) with the normalization of the model. The
+        first sites scored fix the normalization, so they get the scores active_site_score would
+        give them.
+
+        Input:  A list of active sites
+        Output: None
+        """
+        raw = site_raw_scores(active_sites)
+        if self.mean is None:
+            self.mean, self.deviation = score_normalization(raw)
+        write_scores(active_sites, raw, self.mean, self.deviation)
+
+    def partial_fit(self, active_sites):
+        """
+        Update the clusters with a batch of active sites, skipping sites (by name) the model has
+        learned from before.
+
+        Input:  A list of active sites
+        Output: self
+        """
+        new = []
+        for active_site in active_sites:
+            if active_site.name not in self.seen:
+                self.seen.add(active_site.name)
+                new.append(active_site)
+        return self.partial_fit_points(self.points(new))
+
+    def partial_fit_points(self, X):
+        """
+        Update the clusters with a batch of points.
+
+        Input:  (n, d) array of points
+        Output: self
+        """
+        X = np.asarray(X, dtype=float)
+        if X.ndim == 1:
+            X = X[:, None]
+        if len(X) == 0:
+            return self
+
+        ## Each batch gets its own random stream, so a model picks up the same way after loading
+        rng = np.random.default_rng([self.seed, self.n_batches])
+        self.n_batches += 1
+        metrics.count('minibatch_batches')
+
+        if self.centers is None:
+            ## Hold on to points until there are enough to seed every center
+            self._pending.append(X)
+            X = np.concatenate(self._pending)
+            if len(X) < self.k:
+                return self
+            self._pending = []
+            self.centers = _kmeans_plus_plus(X, self.k, rng)
+            self.counts = np.zeros(self.k, dtype=np.int64)
+
+        labels, distances = _kmeans_assign(X, self.centers[None], CHUNK_SIZE)
+        labels = labels[0]
+        distances = distances[0]
+
+        ## Centers that still have no points take the batch points farthest from their centers,
+        #  from clusters that keep at least one point
+        members = self.counts + np.bincount(labels, minlength=self.k)
+        farthest = iter(np.argsort(-distances, kind='stable').tolist())
+        for cluster in np.nonzero(members == 0)[0].tolist():
+            for i in farthest:
+                if members[labels[i]] > 1:
+                    members[labels[i]] -= 1
+                    labels[i] = cluster
+                    members[cluster] = 1
+                    break
+
+        counts = np.bincount(labels, minlength=self.k)
+        sums = np.stack([np.bincount(labels, weights=X[:, j], minlength=self.k) for j in range(X.shape[1])], axis=1)
+
+        self.counts = self.counts + counts
+        moved = counts > 0
+        self.centers[moved] += (sums[moved] - counts[moved][:, None]*self.centers[moved])/self.counts[moved][:, None]
+
+        return self
+
+    def fit_stream(self, active_sites, batch_size=256):
+        """
+        Update the clusters with active sites from any iterable, such as a generator of
+        read_active_site results, in batches of batch_size.
+
+        Input:  Iterable of active sites
+                Number of sites per batch
+        Output: self
+        """
+        iterator = iter(active_sites)
+        batch = list(itertools.islice(iterator, batch_size))
+        while len(batch) > 0:
+            self.partial_fit(batch)
+            batch = list(itertools.islice(iterator, batch_size))
+        return self
+
+    def predict(self, active_sites):
+        """
+        Assign active sites to the closest cluster, without changing the clusters.
+
+        Input:  A list of active sites
+        Output: Array of cluster labels, one per active site
+        """
+        return self.predict_points(self.points(active_sites))
+
+    def predict_points(self, X):
+        """
+        Assign points to the closest cluster, without changing the clusters.
+
+        Input:  (n, d) array of points
+        Output: Array of cluster labels, one per point
+        """
+        if self.centers is None:
+            raise ValueError("The k-means model has not seen %d points yet"%self.k)
+        X = np.asarray(X, dtype=float)
+        if X.ndim == 1:
+            X = X[:, None]
+        return _kmeans_assign(X, self.centers[None], CHUNK_SIZE)[0][0]
+
+    def cluster(self, active_sites):
+        """
+        Group active sites by the cluster they are assigned to.
+
+        Input:  A list of active sites
+        Output: a clustering of ActiveSite instances, clusters in order of their centers (summed
+                over features), leaving out empty clusters
+        """
+        return group_by_center(active_sites, self.predict(active_sites), self.centers)
+
+    def save(self, path):
+        """
+        Write the model state to a .npz file.
+
+        Input:  file path
+        Output: None
+        """
+        pending = np.concatenate(self._pending) if len(self._pending) > 0 else np.zeros((0, 1))
+        save_npz(path, self.VERSION, k=self.k, seed=self.seed, features=self.features,
+                 n_batches=self.n_batches, pending=pending, seen=np.array(sorted(self.seen), dtype=str),
+                 mean=self.mean if self.mean is not None else np.zeros(0),
+                 deviation=self.deviation if self.deviation is not None else np.zeros(0),
+                 centers=self.centers if self.centers is not None else np.zeros((0, 1)),
+                 counts=self.counts if self.counts is not None else np.zeros(0, dtype=np.int64))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a model saved with save.
+
+        Input:  file path
+        Output: MiniBatchKMeans
+        """
+        state = load_npz(path, cls.VERSION, 'k-means model')
+        model = cls(int(state['k']), seed=int(state['seed']), features=str(state['features']))
+        model.n_batches = int(state['n_batches'])
+        model.seen = set(state['seen'].tolist())
+        if len(state['mean']) > 0:
+            model.mean = state['mean']
+            model.deviation = state['deviation']
+        if len(state['pending']) > 0:
+            model._pending = [state['pending']]
+        if len(state['centers']) > 0:
+            model.centers = state['centers']
+            model.counts = state['counts']
+
+        return model
+
+
+def cluster_hierarchically(active_sites, k, distances=None, method='average', max_memory=None, features=None):
     """
     Cluster the given set of ActiveSite instances using a hierarchical algorithm.                                                                  #
 
+    This is agglomerative clustering with centroid linkage on active_site.score: starting with
+    every active site as its own cluster, the two clusters with the closest centroids (average
+    scores) are merged until k clusters are left. See centroid_linkage for how this is done in
+    O(n log n).
+
+    To get clusterings for several k, use hierarchical_linkage once and cut_hierarchy for each k.
+
+    Given a precomputed condensed distance matrix (see pairwise_distances) the sites are
+    clustered on those distances instead, with the linkage method of
+    scipy.cluster.hierarchy.linkage.
+
+    For sets of sites too large for that, max_memory clusters BIRCH-style micro-clusters of the
+    scores, or of the given feature vectors, instead of the sites themselves (see
+    summary_linkage), in about max_memory bytes on top of the sites.
+
     Input: a list of ActiveSite instances
+           number of clusters
+           condensed distance matrix between the active sites (None to use the scores)
+           linkage method used with a distance matrix
+           memory ceiling in bytes, to cluster micro-clusters of the sites (None to cluster the
+           sites themselves)
+           (n, d) array of feature vectors to build micro-clusters of (None to use the scores)
     Output: a list of clusterings
             (each clustering is a list of lists of Sequence objects)
     """
 
-    # Fill in your code here!
-
     if len(active_sites) <= 1:
         return active_sites
 
-    ## Initialize starting clusters (every active site is its own cluster)
-    clusters = {active_site:[active_site] for active_site in active_sites}
+    if max_memory is not None:
+        leaves, merges = summary_linkage(active_sites, features, max_memory)
+        return cut_hierarchy(active_sites, merges, k=k, leaves=leaves)
+
+    if distances is not None:
+        return cut_hierarchy(active_sites, hierarchical_linkage(active_sites, distances, method), k=k)
+
+    ## Only merge down to k clusters, there is no need to build the rest of the tree
+    scores = np.array([active_site.score for active_site in active_sites], dtype=float)
+    merges = centroid_linkage(scores, n_clusters=k)
+
+    return group_by_label(active_sites, merge_labels(merges, len(active_sites)), scores)
+
 
-    ## Flag for if the clustering gets stuck, turns it from a reciprocal closest search, to a closest search
-    super_add_mode = False
+def hierarchical_linkage(active_sites, distances=None, method='average'):
+    """
+    Build the full hierarchical clustering tree (dendrogram) of a set of active sites, merging
+    all the way down to a single cluster.
+
+    Without a distance matrix this is centroid linkage on the scores. With one, the tree is
+    built by scipy.cluster.hierarchy.linkage from the precomputed distances, so no distance is
+    computed twice. Cutting at a threshold needs a method whose merge distances never shrink
+    ('single', 'complete', 'average', 'weighted' or 'ward'). scipy works on float64 distances,
+    so a matrix of any other dtype is copied to float64 first.
+
+    Input:  a list of ActiveSite instances
+            condensed distance matrix between the active sites (None to use the scores)
+            linkage method used with a distance matrix
+    Output: (n - 1, 4) linkage array (see centroid_linkage), rows in merge order
+    """
+    if distances is not None:
+        n = len(active_sites)
+        if len(distances) != n*(n - 1)//2:
+            raise ValueError("Expected %d distances for %d active sites, got %d"%(n*(n - 1)//2, n, len(distances)))
+        from scipy.cluster import hierarchy
+        metrics.count('merges', n - 1)
+        return hierarchy.linkage(np.asarray(distances, dtype=np.float64), method=method)
 
-    ## While our total clusters are greater than k clusters
-    while len(clusters) > k:
+    scores = np.array([active_site.score for active_site in active_sites], dtype=float)
+    return centroid_linkage(scores)
 
-        ## Determine how many clusters are present (this becomes important at the end of the loop)
-        cluster_length = len(clusters)
 
-        ## Initialize new cluster dictionary
-        new_clusters = {}
+def cut_hierarchy(active_sites, merges, k=None, threshold=None, leaves=None):
+    """
+    Cut a hierarchical clustering tree into clusters, either at a number of clusters or at a
+    merge distance. Cutting only replays the merges, so it is cheap to cut the same tree many
+    times.
+
+    Input:  a list of ActiveSite instances
+            linkage array from hierarchical_linkage for the same list
+            number of clusters to cut at, or
+            merge distance to cut at (clusters closer than this are merged)
+            leaf of the tree of every active site, for a tree over micro-clusters from
+            summary_linkage (None if every site is a leaf)
+    Output: a clustering (a list of lists of ActiveSite instances)
+            raises ValueError if k is more than the leaves of a tree over micro-clusters, which
+            cannot be split any further
+    """
+    if (k is None) == (threshold is None):
+        raise ValueError("Cut a hierarchy at either k or threshold")
 
-        ## Initialize best found cluster
-        best_cluster = []
+    if len(active_sites) <= 1:
+        return [list(active_sites)]
+    n = len(active_sites) if leaves is None else len(merges) + 1
+    if k is not None and k > n and n < len(active_sites):
+        raise ValueError("Cannot cut %d clusters from a tree over %d micro-clusters, give them more memory"%(k, n))
 
-        ## Initialize best found cluster distance
-        best_value = 1000000000
+    ## Merge distances only grow in 1-D (and for the monotone linkage methods), so every cut
+    #  keeps a prefix of the merges
+    if k is not None:
+        kept = n - min(max(k, 1), n)
+    else:
+        kept = int(np.searchsorted(merges[:, 2], threshold, side='left'))
 
-        ## Initialize best found cluster dictionary key
-        best_key = []
+    labels = merge_labels(merges[:kept], n)
+    if leaves is not None:
+        labels = labels[leaves]
+    scores = np.array([active_site.score for active_site in active_sites], dtype=float)
 
+    return group_by_label(active_sites, labels, scores)
 
-        ## Loop over every cluster in the cluster dictionary
-        for centroid_main in clusters.keys():
 
-            ## Save the value of the current cluster (this is a list)
-            centroid_cluster = clusters[centroid_main]
+def group_by_label(active_sites, labels, scores):
+    """
+    Group active sites by cluster label.
 
-            ## Find the closest centroid to the current cluster centroid, excluding the current cluster
-            ## Returns the closest cluster, as well as the score difference
-            closest_centroid, closest_value = find_closest(centroid_main, clusters, [centroid_main])
+    Input:  a list of ActiveSite instances
+            array of cluster labels, one per active site
+            array of scores, one per active site
+    Output: a list of clusters ordered by centroid, each sorted by score
+    """
+    clusters = {}
+    for i in np.argsort(scores, kind='stable'):
+        clusters.setdefault(labels[i], []).append(active_sites[i])
 
-            ## Find the closest centroid to the closest found centroid, excluding the closest foudn centroid
-            reciprocal_centroid, reciprocal_value = find_closest(closest_centroid[0], clusters, closest_centroid)
+    return [cluster for cluster in clusters.values()]
 
-            ## Check to see if both centroids are closest to each other, or see if clustering is stuck
-            if centroid_main in reciprocal_centroid or super_add_mode:
 
-                ## Is the found cluster score difference better than any other found cluster
-                if abs(closest_value) < abs(best_value):
+def centroid_linkage(sums, counts=None, n_clusters=1):
+    """
+    Agglomerative clustering of 1-D values with centroid linkage.
+
+    In one dimension the closest cluster to any cluster is always one of its two neighbours in
+    sorted order, and merging two neighbours leaves the order of the centroids unchanged. So the
+    clusters are kept in a linked list sorted by centroid, with a heap of the distances between
+    neighbouring clusters. Every merge pops the closest pair off the heap (the pair are each
+    other's nearest neighbours, so this is the reciprocal nearest neighbour merge), and pushes
+    the two new neighbour distances, for O(n log n) in total. Ties are merged left to right.
+
+    Clusters are summarized by the sum and count of their values, so starting clusters can hold
+    more than one value.
+
+    Input:  Array of the sum of the values in each starting cluster (the values themselves if
+            every cluster holds a single value)
+            Array of the number of values in each starting cluster (all 1 if None)
+            Number of clusters to stop at
+    Output: (n_merges, 4) linkage array in the format used by scipy.cluster.hierarchy: row i
+            merges clusters row[0] and row[1] at centroid distance row[2] into a new cluster
+            n + i holding row[3] values. Starting clusters are numbered 0 to n - 1.
+    """
+    sums = np.asarray(sums, dtype=float)
+    counts = np.ones(len(sums)) if counts is None else np.asarray(counts, dtype=float)
+    n = len(sums)
+
+    ## Linked list of clusters in centroid order, each slot holds one live cluster
+    order = np.argsort(sums/counts, kind='stable')
+    slot_sum = sums[order].tolist()
+    slot_count = counts[order].tolist()
+    slot_id = order.tolist()
+    prev = list(range(-1, n - 1))
+    next = list(range(1, n + 1))
+    next[-1] = -1
+
+    ## Heap of (distance, left slot, left id, right id) of neighbouring clusters
+    heap = []
+    for slot in range(n - 1):
+        distance = slot_sum[slot + 1]/slot_count[slot + 1] - slot_sum[slot]/slot_count[slot]
+        heap.append((distance, slot, slot_id[slot], slot_id[slot + 1]))
+    heapq.heapify(heap)
+
+    merges = []
+    n_merges = n - max(n_clusters, 1)
+    heappop = heapq.heappop
+    heappush = heapq.heappush
+    while len(merges) < n_merges and heap:
+        distance, left, left_id, right_id = heappop(heap)
+        right = next[left]
+
+        ## Skip pairs where either cluster has since been merged into something else
+        if slot_id[left] != left_id or right == -1 or slot_id[right] != right_id:
+            continue
+
+        ## The merged cluster takes the left slot, the right slot is unlinked
+        new_id = n + len(merges)
+        slot_sum[left] += slot_sum[right]
+        slot_count[left] += slot_count[right]
+        slot_id[left] = new_id
+        slot_id[right] = -1
+        next[left] = next[right]
+        if next[right] != -1:
+            prev[next[right]] = left
+
+        merges.append((min(left_id, right_id), max(left_id, right_id), distance, slot_count[left]))
+
+        ## Distances to the new neighbours on either side
+        centroid = slot_sum[left]/slot_count[left]
+        if prev[left] != -1:
+            p = prev[left]
+            heappush(heap, (centroid - slot_sum[p]/slot_count[p], p, slot_id[p], new_id))
+        if next[left] != -1:
+            q = next[left]
+            heappush(heap, (slot_sum[q]/slot_count[q] - centroid, left, new_id, slot_id[q]))
+
+    metrics.count('merges', len(merges))
+
+    return np.array(merges, dtype=float).reshape(-1, 4)
+
+
+def merge_labels(merges, n):
+    """
+    Apply a list of merges to n starting clusters, and label every starting cluster with the
+    cluster it ends up in.
 
-                    ## Set best found value to the cluster score difference
-                    best_value = closest_value
+    Input:  (n_merges, 4) linkage array from centroid_linkage
+            Number of starting clusters
+    Output: Array of labels (the id of the final cluster), one per starting cluster
+    """
+    ## Union-find over cluster ids, every merge points both halves at the new cluster
+    parent = list(range(n + len(merges)))
+    for i, (a, b) in enumerate(merges[:, :2].astype(int).tolist()):
+        parent[a] = n + i
+        parent[b] = n + i
 
-                    ## Set the best cluster to this cluster
-                    best_cluster = closest_centroid
+    labels = []
+    for i in range(n):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
 
-                    ## Set the best cluster seed key to this cluster seed key
-                    best_key = centroid_main
+        ## Path compression, so later lookups through this chain are short
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
 
-            ## Put cluster into new cluster dictionary (both cluster dicts are the same at this point)
-            new_clusters[centroid_main] = centroid_cluster
+        labels.append(root)
 
-        ## If a best cluster was found
-        if len(best_cluster) > 0:
+    return np.array(labels)
 
-            ## Add the best cluster seed key to the list of clustered keys
-            best_cluster = [best_key] + best_cluster
 
-            ## Reset the cluster list
-            centroid_cluster = []
+def ward_linkage(sums, counts):
+    """
+    Agglomerative clustering of d-dimensional clusters with Ward linkage, from their sums and
+    counts alone.
+
+    The Ward distance between clusters a and b is sqrt(2*n_a*n_b/(n_a + n_b))*|c_a - c_b|, with
+    c the centroids (the convention of scipy.cluster.hierarchy, so single points are at their
+    Euclidean distance). It only needs the count and centroid of each cluster, so clusters that
+    stand for many points can be merged exactly. Ward linkage never merges a pair closer than an
+    earlier one, so merges are found with the nearest neighbour chain: follow nearest neighbours
+    until two clusters are each other's nearest, and merge them. Distances from the end of the
+    chain are computed as they are needed, for O(m^2) time and O(m) memory over m clusters.
+
+    Input:  (m, d) array of the sum of the points in each starting cluster
+            array of the number of points in each starting cluster
+    Output: (m - 1, 4) linkage array (see centroid_linkage), rows in order of merge distance
+    """
+    ## Working arrays hold the live clusters only, centroids one row per dimension; slots maps
+    #  them back to the starting cluster whose place they took. They are compacted whenever
+    #  half of them are dead.
+    sizes = np.array(counts, dtype=float)
+    m = len(sizes)
+    centroids = (np.array(sums, dtype=float).reshape(m, -1)/sizes[:, None]).T.copy()
+    slots = np.arange(m)
+    active = np.ones(m, dtype=bool)
+    live = m
+
+    pairs = []
+    chain = []
+    for _ in range(m - 1):
+        while True:
+            if not chain:
+                chain.append(int(np.argmax(active)))
+            a = chain[-1]
+            difference = centroids - centroids[:, a, None]
+            distances = np.sqrt(2*sizes*sizes[a]/(sizes + sizes[a])*np.einsum('ij,ij->j', difference, difference))
+            distances[~active] = np.inf
+            distances[a] = np.inf
+            b = int(np.argmin(distances))
+
+            ## On a tie, going back down the chain ends it
+            if len(chain) > 1 and distances[chain[-2]] <= distances[b]:
+                b = chain[-2]
+            if len(chain) > 1 and b == chain[-2]:
+                break
+            chain.append(b)
+
+        chain.pop()
+        chain.pop()
+        pairs.append((int(slots[a]), int(slots[b]), float(distances[b])))
+        total = sizes[a] + sizes[b]
+        centroids[:, a] = (sizes[a]*centroids[:, a] + sizes[b]*centroids[:, b])/total
+        sizes[a] = total
+        active[b] = False
+        live -= 1
+
+        if 2*live < len(active) and live > 1:
+            position = np.cumsum(active) - 1
+            chain = [int(position[c]) for c in chain]
+            centroids, sizes, slots = centroids[:, active], sizes[active], slots[active]
+            active = np.ones(live, dtype=bool)
+
+    metrics.count('merges', len(pairs))
+
+    ## Number the merged clusters in order of distance, the way scipy does, by following every
+    #  slot to the cluster it is currently part of
+    order = sorted(range(len(pairs)), key=lambda i: pairs[i][2])
+    parent = list(range(m))
+    cluster_id = list(range(m))
+    cluster_size = np.asarray(counts, dtype=float).tolist()
+    merges = []
+    for i in order:
+        a, b, distance = pairs[i]
+        while parent[a] != a:
+            a = parent[a]
+        while parent[b] != b:
+            b = parent[b]
+        id_a, id_b = cluster_id[a], cluster_id[b]
+        size = cluster_size[a] + cluster_size[b]
+        merges.append((min(id_a, id_b), max(id_a, id_b), distance, size))
+        parent[b] = a
+        cluster_id[a] = m + len(merges) - 1
+        cluster_size[a] = size
+
+    return np.array(merges, dtype=float).reshape(-1, 4)
+
+
+class MicroClusters:
+    """
+    BIRCH-style summaries of a large set of points, for hierarchical clustering in bounded
+    memory.
+
+    Points are pooled into micro-clusters, each summarized by its clustering feature: the count,
+    sum and sum of squared norms of its points. Points falling in the same cell of a grid of
+    width threshold share a micro-cluster (with threshold 0, only identical points do). The
+    points are fed a batch at a time, and whenever there are more micro-clusters than fit in
+    max_memory the threshold is raised and the micro-clusters are pooled again by their
+    centroids, so memory stays bounded however many points come in. The first threshold is the
+    narrowest of a series of widths that fits, after that it grows by 2**(1/d) in d dimensions,
+    which about halves the number of micro-clusters. Only
+    the micro-cluster of every point (4 bytes a point) and the batch being added are held
+    besides the summaries.
+
+    The micro-clusters are then clustered exactly from their summaries (see linkage).
+    """
 
-            ## Remove all clustered elements from the new_clusters dictionary
-            for centroid in best_cluster:
-                centroid_cluster = centroid_cluster + clusters[centroid]
-                new_clusters.pop(centroid, None)
+    ## Approximate bytes per micro-cluster, for its summary and its share of the agglomeration
+    BYTES = 512
+
+    def __init__(self, max_memory=4 << 20, threshold=0.0):
+        self.max_memory = max_memory
+        self.max_clusters = max(int(max_memory//self.BYTES), 2)
+        self.threshold = threshold
+        self.keys = None
+        self.counts = None
+        self.sums = None
+        self.squares = None
+        self._labels = []
+
+    def __len__(self):
+        return 0 if self.counts is None else len(self.counts)
+
+    def partial_fit_points(self, X):
+        """
+        Add a batch of points to the micro-clusters.
+
+        Input:  (n, d) array of points (or an (n,) array of scores)
+        Output: self
+        """
+        X = np.asarray(X, dtype=float)
+        if X.ndim == 1:
+            X = X[:, None]
+        if len(X) == 0:
+            return self
+        if self.keys is None:
+            self.keys = np.zeros((0, X.shape[1]))
+            self.counts = np.zeros(0)
+            self.sums = np.zeros((0, X.shape[1]))
+            self.squares = np.zeros(0)
+
+        ## New cells go after the existing micro-clusters, which keep their numbers
+        unique, inverse = np.unique(np.concatenate([self.keys, self._cells(X)]), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        m = len(self.keys)
+        position = np.full(len(unique), -1, dtype=np.intp)
+        position[inverse[:m]] = np.arange(m)
+        added = position < 0
+        position[added] = m + np.arange(added.sum())
+        labels = position[inverse[m:]]
+
+        keys = np.empty((len(unique), X.shape[1]))
+        keys[position] = unique
+        self.keys = keys
+        size = len(unique)
+        self.counts = np.concatenate([self.counts, np.zeros(size - m)]) + np.bincount(labels, minlength=size)
+        self.sums = np.concatenate([self.sums, np.zeros((size - m, X.shape[1]))])
+        for j in range(X.shape[1]):
+            self.sums[:, j] += np.bincount(labels, weights=X[:, j], minlength=size)
+        self.squares = np.concatenate([self.squares, np.zeros(size - m)])
+        self.squares += np.bincount(labels, weights=(X**2).sum(axis=1), minlength=size)
+        self._labels.append(labels.astype(np.int32))
+
+        while len(self) > self.max_clusters:
+            self._rebuild()
+
+        return self
+
+    def labels(self):
+        """
+        The micro-cluster of every point, in the order the points were added.
+
+        Input:  None
+        Output: array of micro-cluster numbers
+        """
+        if not self._labels:
+            return np.zeros(0, dtype=np.int32)
+        return np.concatenate(self._labels)
+
+    def error(self):
+        """
+        Sum of squared distances from every point to the centroid of its micro-cluster, the
+        within cluster sum of squares given up by summarizing.
+
+        Input:  None
+        Output: sum of squares
+        """
+        if len(self) == 0:
+            return 0.0
+        return float(self.squares.sum() - ((self.sums**2).sum(axis=1)/self.counts).sum())
+
+    def linkage(self):
+        """
+        Cluster the micro-clusters, all the way down to one cluster.
+
+        Scores (1-D points) are clustered with centroid linkage, the same as
+        cluster_hierarchically. Feature vectors are clustered with Ward linkage, since centroid
+        linkage in more than one dimension can merge a pair closer than an earlier one, and
+        average linkage needs the distances between the points themselves. Both are exact given
+        the micro-clusters.
+
+        Input:  None
+        Output: (len(self) - 1, 4) linkage array over the micro-clusters
+        """
+        if self.sums.shape[1] == 1:
+            return centroid_linkage(self.sums[:, 0], self.counts)
+        return ward_linkage(self.sums, self.counts)
+
+    def _cells(self, X):
+        if self.threshold == 0:
+            return X
+        return np.floor(X/self.threshold)
+
+    def _rebuild(self):
+        """
+        Raise the threshold and pool the micro-clusters by their centroids.
+        """
+        centroids = self.sums/self.counts[:, None]
+        ## Cells 2**(1/d) times wider hold about twice the points, halving the micro-clusters
+        factor = 2**(1.0/centroids.shape[1])
+        if self.threshold == 0:
+            ## A first guess at the width of a grid cell that leaves max_clusters cells. Unless the
+            #  points fill their bounding box it leaves far fewer, so narrow it while it still fits
+            span = float((centroids.max(axis=0) - centroids.min(axis=0)).max())
+            self.threshold = max(span, 1e-12)/self.max_clusters**(1.0/centroids.shape[1])
+            while len(np.unique(np.floor(centroids*factor/self.threshold), axis=0)) <= self.max_clusters:
+                self.threshold /= factor
+        else:
+            self.threshold *= factor
+        metrics.count('micro_cluster_rebuilds')
+
+        self.keys, inverse = np.unique(self._cells(centroids), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        size = len(self.keys)
+        self.counts = np.bincount(inverse, weights=self.counts, minlength=size)
+        self.sums = np.stack([np.bincount(inverse, weights=self.sums[:, j], minlength=size)
+                              for j in range(self.sums.shape[1])], axis=1)
+        self.squares = np.bincount(inverse, weights=self.squares, minlength=size)
+        self._labels = [inverse[labels].astype(np.int32) for labels in self._labels]
+
+
+def summary_linkage(active_sites, features=None, max_memory=4 << 20, batch_size=1 << 16):
+    """
+    Build a hierarchical clustering tree of a set of active sites too large for a distance
+    matrix, over BIRCH-style micro-clusters (see MicroClusters) held in at most max_memory bytes.
+
+    Input:  a list of ActiveSite instances
+            (n, d) array of feature vectors, one per active site (None to use active_site.score)
+            memory ceiling of the micro-clusters in bytes
+            number of sites to add at a time
+    Output: array of the micro-cluster (leaf of the tree) of every active site
+            linkage array over the micro-clusters, to cut with cut_hierarchy(leaves=...)
+    """
+    micro = MicroClusters(max_memory)
+    for start in range(0, len(active_sites), batch_size):
+        if features is None:
+            X = [active_site.score for active_site in active_sites[start:start + batch_size]]
+        else:
+            X = features[start:start + batch_size]
+        micro.partial_fit_points(X)
 
-            ## Add the clustered elements back into the new_clusters dictionary under the cluster seed key
-            new_clusters[best_key] = centroid_cluster
+    return micro.labels(), micro.linkage()
 
 
-        ## Replace the clusters dictionary with the new clusters dictionary, now ready for another round
-        clusters = new_clusters
+def validate_clustering(active_sites, clustering):
+    """
+    Check that a clustering is a partition of the active sites: no cluster is empty, and every
+    active site is in exactly one cluster. This is a debugging aid, the clustering functions
+    never call it themselves.
 
-        ## Reset the stuck clustering flag
-        super_add_mode = False
+    Input:  a list of ActiveSite instances
+            a clustering of them (a list of lists of ActiveSite instances)
+    Output: None, raises ValueError if the clustering is not a partition
+    """
+    if any([len(cluster) == 0 for cluster in clustering]):
+        raise ValueError("Clustering has an empty cluster")
 
-        ## If the original cluster length is the same as the new cluster length, turn on the stuck clustering flag
-        if cluster_length == len(clusters):
-            print("No new clusters found")
-            super_add_mode = True
+    clustered = [id(active_site) for cluster in clustering for active_site in cluster]
+    if len(clustered) != len(set(clustered)):
+        raise ValueError("Clustering has active sites in more than one cluster")
+    if set(clustered) != set([id(active_site) for active_site in active_sites]):
+        raise ValueError("Clustering has %d active sites, expected %d"%(len(set(clustered)), len(active_sites)))
 
-    ## Return a list of clusters
-    return [cluster for cluster in clusters.values()]
 
-def find_closest(check_key, check_dict, banned):
+def find_closest(check_key, check_dict, banned, validate=False):
     """
     Find the closest cluster based on centroid, excluding any banned clusters                                                                #
 
     Input:  Dictionary key for cluster to check against
             Dictionary of clusters
             List of banned clusters (a list of keys)
+            Boolean validate, check the centroid against all cluster averages first (slow, for debugging)
     Output: The closest cluster, formatted as a list of keys
             The difference between the score of the checked cluster and the closest cluster
     """
@@ -187,19 +1115,18 @@ def find_closest(check_key, check_dict, banned):
     ## Find the centroid (average value) of the cluster to check against
     avg_value = find_centroid(check_key, check_dict)
 
-    ## Create a list of all clusters in check_dict (a list of lists of active sites)
-    cluster_list = [cluster for cluster in check_dict.values()]
-
-    ## Checkpoint to make sure everything is working alright
+    ## Checkpoint to make sure everything is working alright, only when asked for since it
+    #  averages every cluster again
     #  The test_for_validity value is a list of cluster averages
     #  The clust_len value is a total number of elements in cluster_list
-    #  A flag can be set to true to display a graph of the clusters based on centroids
-    test_for_validity, clust_len = visualize_h_cluster(cluster_list, False)
+    if validate:
+        cluster_list = [cluster for cluster in check_dict.values()]
+        test_for_validity, clust_len = visualize_h_cluster(cluster_list, False)
 
-    ## Check to make sure the found centroid is also in the list of cluster averages
-    if avg_value not in test_for_validity:
-        print(avg_value)
-        print(test_for_validity)
+        ## Check to make sure the found centroid is also in the list of cluster averages
+        if avg_value not in test_for_validity:
+            print(avg_value)
+            print(test_for_validity)
 
     ## Initializing a closest score
     closest_score = 1000000000 ## Going all in on massive number initialization
@@ -257,6 +1184,8 @@ def visualize_h_cluster(cluster_list, show_plot):
     to visualize that the right things were actually clustering. It also helped to determine if things
     were getting added or deleted to the overall active_site list.
 
+    matplotlib is only imported when a plot is asked for.
+
     Input:  List of lists of active site clusters
             Boolean show plot
     Output: A list of the average values of the clusters
@@ -267,6 +1196,7 @@ def visualize_h_cluster(cluster_list, show_plot):
     for cluster in cluster_list:
         average_values.append(sum([value.score for value in cluster])/len(cluster))
     if show_plot:
+        import matplotlib.pyplot as pp
         pp.figure(figsize=(20,5))
         y_values = np.zeros_like(average_values)
         pp.plot(average_values, y_values, 'x')
@@ -0,0 +1,120 @@
+# Packed, memory-mappable file format for sets of active sites
+
+import json
+import mmap
+import struct
+import numpy as np
+from .store import StructureStore
+from .utils import site_store, raw_active_site_scores
+from .cache import atomic_write
+
+
+## File layout:
+#    8 bytes   magic
+#    8 bytes   length of the JSON header, little endian
+#    header    JSON with the format version and the dtype, shape and file offset of every array
+#    arrays    raw array data, each one starting on an ALIGNMENT byte boundary
+#
+#  Arrays are the StructureStore arrays (site index, residue offsets, atom coordinate block, ...)
+#  plus the raw scores. Text arrays are stored as fixed-width bytes.
+MAGIC = b"HW2SITES"
+VERSION = 1
+ALIGNMENT = 64
+
+## Arrays holding text, which are stored as bytes and decoded when opened
+TEXT_ARRAYS = ('names', 'residue_types', 'atom_types')
+
+
+def write_dataset(path, active_sites):
+    """
+    Write a list of active sites to a packed dataset file, which can be opened with
+    open_dataset without reading it into memory. The file is written through
+    cache.atomic_write, so an interrupted write never leaves a truncated dataset behind.
+
+    Input:  file path
+            list of active sites (for example from io.read_active_sites)
+    Output: None
+    """
+    store, rows = site_store(active_sites)
+    if not np.array_equal(rows, np.arange(store.n_sites)):
+        store = store.take(rows)
+    raw_active_site_scores(store)
+
+    arrays = {array: getattr(store, array) for array in StructureStore.ARRAYS}
+    arrays['raw_scores'] = store.raw_scores
+    for array in TEXT_ARRAYS:
+        arrays[array] = np.char.encode(arrays[array], 'ascii')
+
+    ## Work out where every array goes, after the header
+    sections = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        sections[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes//ALIGNMENT)*ALIGNMENT
+
+    header = json.dumps({'version': VERSION, 'arrays': sections}).encode()
+    start = -(-(len(MAGIC) + 8 + len(header))//ALIGNMENT)*ALIGNMENT
+
+    with atomic_write(path) as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(start + sections[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(start + offset)
+
+
+def open_dataset(path):
+    """
+    Open a packed dataset file as a StructureStore.
+
+    The residue and atom arrays are read-only views of a memory map of the file, so nothing is
+    read until it is used, and the operating system pages data in and out as needed. Only the
+    site names and the type vocabularies are decoded into memory.
+
+    Input:  file path
+    Output: StructureStore
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise IOError("%s is not an active site dataset"%path)
+        header_length = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_length).decode())
+        if header['version'] != VERSION:
+            raise IOError("%s has dataset version %s, expected %d"%(path, header['version'], VERSION))
+        start = -(-(len(MAGIC) + 8 + header_length)//ALIGNMENT)*ALIGNMENT
+
+        ## The map stays open for as long as any array refers to it
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    arrays = {}
+    for name, section in header['arrays'].items():
+        dtype = np.dtype(section['dtype'])
+        count = int(np.prod(section['shape']))
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=start + section['offset'])
+        arrays[name] = array.reshape(section['shape'])
+
+    for name in TEXT_ARRAYS:
+        arrays[name] = np.char.decode(arrays[name], 'ascii')
+
+    store = StructureStore(*[arrays[array] for array in StructureStore.ARRAYS])
+    store.raw_scores = arrays['raw_scores']
+
+    return store
+
+
+def read_dataset(path):
+    """
+    Read in the active sites of a packed dataset file.
+
+    Input:  file path
+    Output: list of ActiveSite instances (views into the memory mapped file)
+    """
+    active_sites = open_dataset(path).sites()
+
+    print("Read in %d active sites from %s"%(len(active_sites), path))
+
+    return active_sites
@@ -0,0 +1,268 @@
+# Per-site features computed from the atom table of a StructureStore, with a cache
+
+import collections
+import hashlib
+import itertools
+import os
+import weakref
+import numpy as np
+from .store import COORD_SCALE
+from .cache import atomic_write
+from . import metrics
+
+
+## Kyte-Doolittle hydrophobicity of every residue type
+score_metric_hydrophobicity = {'ARG': -4.5, 'HIS': -3.2, 'LYS': -3.9,
+'ASP': -3.5, 'GLU': -3.5, 'CYS': 2.5, 'GLY': -0.4, 'PRO': -1.6, 'ALA': 1.8,
+'VAL': 4.2, 'ILE': 4.5, 'LEU': 3.8, 'MET': 1.9, 'PHE': 2.8, 'TYR': -1.3,
+'TRP': -0.9, 'SER': -0.8, 'THR': -0.7, 'ASN': -3.5, 'GLN': -3.5}
+
+## Feature extractors by name, as (function, version). A function takes a StructureStore and
+#  returns one value per site, computed over the whole store at once.
+EXTRACTORS = {}
+
+## The raw features active_site_score normalizes and adds up, in the order of store.raw_scores
+SCORE_FEATURES = ('lys', 'arg', 'hyd')
+
+
+def register(name, version=1):
+    """
+    Register a feature extractor:
+
+        @features.register('his')
+        def histidines(store):
+            ...
+
+    Bump the version whenever the extractor changes what it computes, so cached values of the
+    old version are not used.
+
+    Input:  feature name
+            version of the extractor
+    Output: decorator that registers and returns the function
+    """
+    def decorator(function):
+        EXTRACTORS[name] = (function, version)
+        return function
+    return decorator
+
+
+def vector_sum_magnitude(store, residue_type, atom_type):
+    """
+    Sum the coordinates of one atom type of one residue type per active site, and return the
+    magnitude of every summed vector.
+
+    Input:  StructureStore
+            Residue type to select (e.g. 'LYS')
+            Atom type to select (e.g. 'NZ')
+    Output: Array of vector magnitudes, one per site in the store
+    """
+    if residue_type not in store.residue_types or atom_type not in store.atom_types:
+        return np.zeros(store.n_sites)
+
+    residue_code = np.searchsorted(store.residue_types, residue_type)
+    atom_code = np.searchsorted(store.atom_types, atom_type)
+
+    ## Atoms of the wanted type that sit in residues of the wanted type
+    atom_residue = store.atom_residue()
+    mask = (store.atom_type == atom_code) & (store.residue_type[atom_residue] == residue_code)
+    sites = store.residue_site()[atom_residue[mask]]
+    coords = store.coords[mask]/COORD_SCALE
+
+    ## bincount accumulates in atom order, the same order the atoms were originally added in
+    x, y, z = [np.bincount(sites, weights=coords[:, i], minlength=store.n_sites) for i in range(3)]
+
+    return np.sqrt(x*x + y*y + z*z)
+
+
+@register('lys')
+def lysine(store):
+    """
+    Magnitude of the summed lysine NZ positions of every site.
+    """
+    return vector_sum_magnitude(store, 'LYS', 'NZ')
+
+
+@register('arg')
+def arginine(store):
+    """
+    Magnitude of the summed arginine CZ positions of every site.
+    """
+    return vector_sum_magnitude(store, 'ARG', 'CZ')
+
+
+@register('hyd')
+def hydrophobicity(store):
+    """
+    Summed Kyte-Doolittle hydrophobicity of the residues of every site.
+    """
+    ## Look up the hydrophobicity of each residue type present once, then broadcast
+    present = np.unique(store.residue_type)
+    values = np.zeros(len(store.residue_types))
+    values[present] = [score_metric_hydrophobicity[store.residue_types[t]] for t in present]
+    return np.bincount(store.residue_site(), weights=values[store.residue_type], minlength=store.n_sites)
+
+
+class FeatureCache:
+    """
+    Least recently used cache of feature values, one array per store and feature.
+
+    Stores are told apart by a number handed out the first time they are seen, and their values
+    are dropped when the store is garbage collected. Beyond max_bytes, the least recently used
+    values are evicted. With a directory, values are also saved there as .npy files named after
+    a hash of the store's arrays, so a later run over the same sites (e.g. the same packed
+    dataset) reads them back instead of recomputing them.
+    """
+
+    def __init__(self, max_bytes=256 << 20, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.nbytes = 0
+        self._values = collections.OrderedDict()
+        self._keys = weakref.WeakKeyDictionary()
+        self._digests = {}
+        self._count = itertools.count()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, store, name):
+        """
+        Values of a feature for every site of a store, computed if they are not cached.
+
+        Input:  StructureStore
+                feature name (see EXTRACTORS)
+        Output: array of one value per site
+        """
+        if name not in EXTRACTORS:
+            raise KeyError("Unknown feature %r"%name)
+        function, version = EXTRACTORS[name]
+        key = (self._key(store), name, version)
+
+        values = self._values.get(key)
+        if values is not None:
+            self._values.move_to_end(key)
+            metrics.count('feature_cache_hits')
+            return values
+
+        path = self._path(store, key) if self.directory is not None else None
+        if path is not None and os.path.exists(path):
+            values = np.load(path, allow_pickle=False)
+            metrics.count('feature_cache_hits')
+        else:
+            values = np.asarray(function(store), dtype=float)
+            metrics.count('features_computed')
+            if path is not None:
+                os.makedirs(self.directory, exist_ok=True)
+                with atomic_write(path) as f:
+                    np.save(f, values)
+
+        self._put(key, values)
+        return values
+
+    def clear(self):
+        """
+        Drop every value held in memory (files in the directory are kept).
+        """
+        self._values.clear()
+        self.nbytes = 0
+
+    def _key(self, store):
+        key = self._keys.get(store)
+        if key is None:
+            key = next(self._count)
+            self._keys[store] = key
+            weakref.finalize(store, self._drop, key)
+        return key
+
+    def _path(self, store, key):
+        digest = self._digests.get(key[0])
+        if digest is None:
+            sha = hashlib.sha1()
+            for array in store.ARRAYS:
+                sha.update(np.ascontiguousarray(getattr(store, array)).tobytes())
+            digest = self._digests[key[0]] = sha.hexdigest()
+        return os.path.join(self.directory, "%s-%s-%d.npy"%(digest, key[1], key[2]))
+
+    def _put(self, key, values):
+        self._values[key] = values
+        self.nbytes += values.nbytes
+        while self.nbytes > self.max_bytes and len(self._values) > 1:
+            evicted_key, evicted = self._values.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            metrics.count('feature_cache_evictions')
+
+    def _drop(self, store_key):
+        self._digests.pop(store_key, None)
+        for key in [key for key in self._values if key[0] == store_key]:
+            self.nbytes -= self._values.pop(key).nbytes
+
+
+## Cache used when no other is given
+cache = FeatureCache()
+
+
+def extract(store, names, feature_cache=None):
+    """
+    Compute (or look up) several features for every site of a store.
+
+    The three score features may already be in store.raw_scores (e.g. loaded from a directory
+    cache or a packed dataset), in which case they are taken from there.
+
+    Input:  StructureStore
+            list of feature names
+            FeatureCache to use (the module cache if None)
+    Output: (n_sites, len(names)) array
+    """
+    feature_cache = cache if feature_cache is None else feature_cache
+    columns = []
+    for name in names:
+        if store.raw_scores is not None and name in SCORE_FEATURES:
+            columns.append(store.raw_scores[:, SCORE_FEATURES.index(name)])
+        else:
+            columns.append(feature_cache.get(store, name))
+    return np.stack(columns, axis=1).reshape(store.n_sites, len(names))
+
+
+def feature_matrix(active_sites, names=SCORE_FEATURES, normalize=None, feature_cache=None):
+    """
+    Collect features of a list of active sites, optionally normalizing every feature over the
+    list. Features are extracted from the stores the sites come from and computed at most once
+    per store, so switching normalizations or adding features only computes what is new. Sites
+    without a store (plain ActiveSite instances) are packed into a new store on every call.
+
+    Input:  A list of active sites
+            list of feature names
+            function normalizing an array of feature values (e.g. utils.normalize_scores), or
+            None for raw values
+            FeatureCache to use (the module cache if None)
+    Output: (n_sites, len(names)) array
+    """
+    ## Imported here since utils builds on this module
+    from .utils import site_store
+
+    if len(active_sites) == 0:
+        return np.zeros((0, len(names)))
+
+    ## Sites by the store they come from, as (store, positions in the list, rows in the store).
+    #  Joining the stores with site_store would make a new store, and miss the cache, every call.
+    groups = collections.OrderedDict()
+    loose = []
+    for i, active_site in enumerate(active_sites):
+        store = getattr(active_site, 'store', None)
+        if store is None:
+            loose.append(i)
+        else:
+            group = groups.setdefault(id(store), (store, [], []))
+            group[1].append(i)
+            group[2].append(active_site.index)
+
+    X = np.zeros((len(active_sites), len(names)))
+    for store, positions, rows in groups.values():
+        X[positions] = extract(store, names, feature_cache)[rows]
+    if len(loose) > 0:
+        store, rows = site_store([active_sites[i] for i in loose])
+        X[loose] = extract(store, names, feature_cache)[rows]
+
+    if normalize is not None:
+        X = np.stack([normalize(X[:, j]) for j in range(X.shape[1])], axis=1)
+    return X
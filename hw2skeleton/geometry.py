@@ -0,0 +1,194 @@
+# 3-D shape comparison of active sites
+
+import numpy as np
+from .utils import site_store
+from . import metrics
+
+
+## Levels a site's shape can be described at: every atom, or the centroid of every residue
+LEVELS = ('atoms', 'residues')
+
+## The rotations that only flip the signs of principal axes. Principal axes are only defined up
+#  to sign, so two aligned sites are compared in each of these orientations. Reflections (an odd
+#  number of flips) are left out, since a mirrored site is a different site.
+FLIPS = np.array([[1.0, 1.0, 1.0],
+                  [1.0, -1.0, -1.0],
+                  [-1.0, 1.0, -1.0],
+                  [-1.0, -1.0, 1.0]])
+
+
+class SiteShape:
+    """
+    The points of an active site in its principal frame, with a KD-tree over them
+    """
+
+    __slots__ = ('name', 'points', 'tree')
+
+    def __init__(self, name, points):
+        from scipy.spatial import cKDTree
+        self.name = name
+        self.points = align_points(points)
+        self.tree = cKDTree(self.points)
+
+    # Overload the __repr__ operator to make printing simpler.
+    def __repr__(self):
+        return self.name
+
+
+def site_points(active_sites, level='atoms'):
+    """
+    Get the 3-D points describing each active site.
+
+    Input:  A list of active sites
+            'atoms' for every atom's coordinates, 'residues' for the centroid of every residue
+            (residues without atoms are left out)
+    Output: List of (n_points, 3) float arrays in Angstroms, one per active site
+    """
+    if level not in LEVELS:
+        raise ValueError("Unknown shape level %r"%level)
+
+    ## Only the arrays of the wanted sites are needed, in the order they were asked for
+    store, rows = site_store(active_sites)
+    if not np.array_equal(rows, np.arange(store.n_sites)):
+        store = store.take(rows)
+
+    coords = store.atom_coords()
+    offsets = store.residue_offsets[store.site_offsets]
+
+    if level == 'residues':
+        ## Centroid of every residue by summing its atoms, then keep residues with atoms
+        atom_residue = store.atom_residue()
+        counts = np.diff(store.residue_offsets)
+        sums = np.stack([np.bincount(atom_residue, weights=coords[:, i], minlength=store.n_residues)
+                         for i in range(3)], axis=1)
+        filled = counts > 0
+        coords = sums[filled]/counts[filled][:, None]
+        offsets = np.concatenate([[0], np.cumsum(filled)])[store.site_offsets]
+
+    return [coords[start:stop] for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def align_points(points):
+    """
+    Move a set of points into its principal frame: centered on its centroid, and rotated so that
+    the directions of largest to smallest spread lie along x, y and z.
+
+    Input:  (n, 3) array of points
+    Output: (n, 3) array of aligned points
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) == 0:
+        raise ValueError("Cannot align a site without any points")
+
+    centered = points - points.mean(axis=0)
+
+    ## Eigenvectors of the covariance, largest eigenvalue first, turned into a proper rotation
+    values, vectors = np.linalg.eigh(centered.T @ centered)
+    vectors = vectors[:, ::-1]
+    if np.linalg.det(vectors) < 0:
+        vectors[:, 2] = -vectors[:, 2]
+
+    return centered @ vectors
+
+
+def site_shapes(active_sites, level='atoms'):
+    """
+    Align every active site and build its KD-tree, so it can be compared against many others.
+
+    Input:  A list of active sites
+            'atoms' or 'residues' (see site_points)
+    Output: List of SiteShape instances
+    """
+    return [SiteShape(active_site.name, points)
+            for active_site, points in zip(active_sites, site_points(active_sites, level))]
+
+
+def shape_distance(shape_a, shape_b):
+    """
+    Compare the shapes of two aligned active sites.
+
+    The distance is the symmetric chamfer distance: the mean distance from every point of one
+    site to the closest point of the other, averaged over both directions, and minimized over
+    the sign flips of the principal axes. Closest points are found through each site's KD-tree,
+    in O(m log m) for sites of m points. Identical shapes, in any position and orientation, are
+    at distance 0.
+
+    Input:  two SiteShape instances
+    Output: distance in Angstroms (a floating point number)
+    """
+    ## Flipping b in a's frame is the same as flipping a in b's frame, so all four flips of
+    #  each direction are done with a single query
+    flipped_b = (shape_b.points[None, :, :]*FLIPS[:, None, :]).reshape(-1, 3)
+    flipped_a = (shape_a.points[None, :, :]*FLIPS[:, None, :]).reshape(-1, 3)
+    b_to_a = shape_a.tree.query(flipped_b)[0].reshape(len(FLIPS), -1).mean(axis=1)
+    a_to_b = shape_b.tree.query(flipped_a)[0].reshape(len(FLIPS), -1).mean(axis=1)
+
+    return float(((a_to_b + b_to_a)/2).min())
+
+
+def shape_distances(active_sites, level='atoms', dtype=np.float64, workers=1, block_size=64):
+    """
+    Compare the shapes of every pair of active sites, as a condensed distance matrix (see
+    cluster.pairwise_distances) that the hierarchical clustering can use directly.
+
+    Every site is aligned and indexed once, rather than once per pair. Sites are then taken in
+    blocks of block_size: for every pair of blocks, each site's KD-tree is queried once with the
+    points of the whole other block, in all four flips. Both directions of every pair of the two
+    blocks are then known, and are reduced to one distance per pair right away, so the scratch
+    space is a few block_size**2 arrays whatever the number of sites.
+
+    Input:  A list of active sites
+            'atoms' or 'residues' (see site_points)
+            dtype to store the distances in
+            number of threads for the KD-tree queries (-1 for one per CPU)
+            number of sites per block
+    Output: Array of n*(n - 1)/2 shape distances
+    """
+    shapes = site_shapes(active_sites, level)
+    n = len(shapes)
+    distances = np.empty(n*(n - 1)//2, dtype=dtype)
+    if n < 2:
+        return distances
+
+    ## Points of every block of sites in every flip, one run of points per site and flip
+    blocks = []
+    for first in range(0, n, block_size):
+        block = shapes[first:first + block_size]
+        flipped = np.concatenate([(shape.points[None, :, :]*FLIPS[:, None, :]).reshape(-1, 3) for shape in block])
+        sizes = np.repeat([len(shape.points) for shape in block], len(FLIPS))
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        blocks.append((first, len(block), flipped, sizes, starts))
+
+    def mean_distances(trees, block):
+        ## (len(trees), sites in block, flips) mean distances from the block's sites to every tree
+        first, size, flipped, sizes, starts = block
+        means = np.empty((len(trees), size, len(FLIPS)))
+        for i, shape in enumerate(trees):
+            nearest = shape.tree.query(flipped, workers=workers)[0]
+            means[i] = (np.add.reduceat(nearest, starts)/sizes).reshape(size, len(FLIPS))
+        return means
+
+    for a, block_a in enumerate(blocks):
+        first_a, size_a = block_a[:2]
+        trees_a = shapes[first_a:first_a + size_a]
+        for block_b in blocks[a:]:
+            first_b, size_b = block_b[:2]
+
+            ## a_to_b[i, j] from the points of site i of block a to the tree of site j of block b,
+            #  b_to_a[i, j] the other way around
+            b_to_a = mean_distances(trees_a, block_b)
+            if first_b == first_a:
+                a_to_b = b_to_a.transpose(1, 0, 2)
+            else:
+                a_to_b = mean_distances(shapes[first_b:first_b + size_b], block_a).transpose(1, 0, 2)
+            pair = ((a_to_b + b_to_a)/2).min(axis=2)
+
+            ## Pairs i < j of the two blocks, at their place in the condensed matrix
+            i, j = np.nonzero(np.arange(first_a, first_a + size_a)[:, None] < np.arange(first_b, first_b + size_b)[None, :])
+            s = first_a + i
+            t = first_b + j
+            distances[s*n - s*(s + 1)//2 + (t - s - 1)] = pair[i, j]
+
+    metrics.count('distance_evaluations', len(distances))
+
+    return distances
@@ -1,42 +1,391 @@
+import collections
+import functools
 import glob
+import json
 import os
-from .utils import Atom, Residue, ActiveSite
+import time
+import numpy as np
+from .store import StructureStore, COORD_SCALE, ranges
+from .cache import cache_path, file_stamps, load_cache, load_summary, save_cache
+from .utils import raw_active_site_scores
+from . import metrics
 
 
-def read_active_sites(dir):
+## Available PDB parsers, see parse_active_sites
+PARSERS = ('line', 'buffer')
+
+
+def read_active_sites(dir, workers=None, batch_size=256, parser='buffer', cache=False, lazy=False, max_loaded=1024):
     """
     Read in all of the active sites from the given directory.
 
+    Files are read in sorted order, in batches of batch_size files. With more than one batch the
+    batches are parsed in parallel by a pool of worker processes. The result does not depend on
+    the number of workers.
+
+    With cache turned on, parsed sites and their raw scores are kept in a binary cache file
+    (see cache.py). Only files that are new, or whose modification time or size changed since
+    they were cached, are parsed again.
+
+    All sites share one StructureStore, and are returned as views into it.
+
+    With lazy turned on, only the name, file and raw scores of every site are kept (see
+    LazyActiveSite), which is all scoring and clustering by score need. A site's residues and
+    atoms are read from its file when they are first used, and at most max_loaded read sites
+    are held in memory at once.
+
     Input: directory
+           number of worker processes (None for one per CPU, 1 to parse in this process)
+           number of files per batch
+           parser to use, 'buffer' or 'line' (see parse_active_sites)
+           cache file path, True for the default path in the directory, or False for no cache
+           whether to return lazily loaded sites
+           number of lazily loaded sites to keep in memory
     Output: list of ActiveSite instances
     """
-    files = glob.glob(dir + '/*.pdb')
+    start = time.perf_counter()
+
+    filepaths = sorted(glob.glob(os.path.join(dir, "*.pdb")))
+
+    if lazy:
+        raw_scores, n_cached = _read_summaries(dir, filepaths, cache, workers, batch_size, parser)
+        loaded = SiteCache(max_loaded, parser)
+        active_sites = [LazyActiveSite(filepath, raw, loaded) for filepath, raw in zip(filepaths, raw_scores)]
+    else:
+        if not cache:
+            store = _parse_files(filepaths, workers, batch_size, parser)
+            n_cached = 0
+        else:
+            store, n_cached = _read_cached(_cache_file(dir, cache), filepaths, workers, batch_size, parser)
+        active_sites = store.sites() if store is not None else []
+    metrics.count('files_cached', n_cached)
+
+    elapsed = time.perf_counter() - start
+    print("Read in %d active sites (%d cached) in %.2fs (%.0f files/s)"%(len(active_sites), n_cached, elapsed,
+                                                                         len(filepaths)/elapsed if elapsed > 0 else 0.0))
 
-    active_sites = []
-    # iterate over each .pdb file in the given directory
-    for filepath in glob.iglob(os.path.join(dir, "*.pdb")):
+    return active_sites
 
-        active_sites.append(read_active_site(filepath))
 
-    print("Read in %d active sites"%len(active_sites))
+def _cache_file(dir, cache):
+    """
+    Path of the cache file of a directory, given the cache argument of read_active_sites.
+    """
+    return cache_path(dir) if cache is True else cache
 
-    return active_sites
+
+def _map_batches(function, filepaths, workers, batch_size):
+    """
+    Apply a function to batches of files, in parallel when there is more than one batch.
+
+    Input: function of a list of PDB file paths
+           list of PDB file paths
+           number of worker processes (None for one per CPU)
+           number of files per batch
+    Output: list of results, one per batch in file order
+    """
+    batches = [filepaths[i:i + batch_size] for i in range(0, len(filepaths), batch_size)]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(batches))
+
+    if workers <= 1:
+        return [function(batch) for batch in batches]
+
+    ## map hands back the batches in submission order, so the sites stay sorted
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, batches))
+
+
+def _parse_files(filepaths, workers, batch_size, parser):
+    """
+    Parse PDB files in batches, in parallel when there is more than one batch.
+
+    Input: list of PDB file paths
+           number of worker processes (None for one per CPU)
+           number of files per batch
+           parser to use
+    Output: StructureStore with one site per file, or None if there are no files
+    """
+    if len(filepaths) == 0:
+        return None
+
+    stores = _map_batches(functools.partial(parse_active_sites, parser=parser), filepaths, workers, batch_size)
+
+    store = StructureStore.concatenate(stores)
+    metrics.count('files_parsed', len(filepaths))
+    metrics.count('atoms_read', store.n_atoms)
+
+    return store
+
+
+def _summarize_files(filepaths, parser):
+    """
+    Parse a batch of PDB files and keep only their raw scores.
+
+    Input: list of PDB file paths
+           parser to use
+    Output: (n_files, 3) array of raw scores
+            number of atoms read
+    """
+    store = parse_active_sites(filepaths, parser)
+    return np.stack(raw_active_site_scores(store), axis=1), store.n_atoms
+
+
+def _read_summaries(dir, filepaths, cache, workers, batch_size, parser):
+    """
+    Get the raw scores of PDB files without holding on to their residues and atoms.
+
+    With a cache that holds exactly these files unchanged, only its raw scores are read.
+    Otherwise the files are read through the cache as usual, which brings it up to date. Without
+    a cache the files are parsed a batch at a time, and every batch is dropped once scored.
+
+    Input: directory
+           list of PDB file paths in it
+           cache argument of read_active_sites
+           number of worker processes, files per batch and parser for the files to parse
+    Output: (n_files, 3) array of raw scores
+            number of files whose scores came from the cache
+    """
+    if cache:
+        path = _cache_file(dir, cache)
+        cached, raw_scores = load_summary(path)
+        files = [os.path.basename(filepath) for filepath in filepaths]
+        stamps = file_stamps(filepaths).tolist()
+        fresh = [cached.get(name) == tuple(stamp) for name, stamp in zip(files, stamps)]
+        if raw_scores is not None and len(cached) == len(files) and all(fresh):
+            cached_row = {name: i for i, name in enumerate(cached)}
+            return raw_scores[[cached_row[name] for name in files]].reshape(-1, 3), len(files)
+
+        store, n_cached = _read_cached(path, filepaths, workers, batch_size, parser)
+        return (store.raw_scores if store is not None else np.zeros((0, 3))), n_cached
+
+    if len(filepaths) == 0:
+        return np.zeros((0, 3)), 0
+
+    summaries = _map_batches(functools.partial(_summarize_files, parser=parser), filepaths, workers, batch_size)
+    metrics.count('files_parsed', len(filepaths))
+    metrics.count('atoms_read', sum([n_atoms for raw, n_atoms in summaries]))
+
+    return np.concatenate([raw for raw, n_atoms in summaries]), 0
+
+
+class SiteCache:
+    """
+    The most recently used lazily loaded active sites, by file path. Past max_sites sites, the
+    least recently used one is dropped (and read again if it is needed again).
+    """
+
+    def __init__(self, max_sites=1024, parser='buffer'):
+        self.max_sites = max_sites
+        self.parser = parser
+        self._sites = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._sites)
+
+    def get(self, filepath):
+        """
+        The active site of a PDB file, read in if it is not held already.
+
+        Input:  PDB file path
+        Output: ActiveSite instance
+        """
+        active_site = self._sites.get(filepath)
+        if active_site is not None:
+            self._sites.move_to_end(filepath)
+            return active_site
+
+        active_site = read_active_site(filepath, self.parser)
+        metrics.count('sites_loaded')
+        self._sites[filepath] = active_site
+        while len(self._sites) > max(self.max_sites, 1):
+            self._sites.popitem(last=False)
+
+        return active_site
+
+    def read_store(self, filepaths, batch_size=256):
+        """
+        Read many sites at once into one StructureStore, a batch of files at a time, for code
+        that needs the atoms of all of them together (see utils.site_store). The sites are not
+        kept in the cache.
+
+        Input:  list of PDB file paths
+                number of files per batch
+        Output: StructureStore with one site per file
+        """
+        store = _parse_files(filepaths, 1, batch_size, self.parser)
+        metrics.count('sites_loaded', len(filepaths))
+        return store
+
+
+class LazyActiveSite:
+    """
+    Stand-in for the active site of a PDB file, holding only its name, file path and raw
+    lysine, arginine and hydrophobicity scores (see utils.site_raw_scores). Its residues are
+    read from the file through a SiteCache when they are first used. Code that needs the atoms
+    of many sites at once (shape similarity, writing a packed dataset) goes through
+    utils.site_store, which reads them in batches instead of one at a time.
+
+    Scores are plain attributes, like they are for ActiveSite.
+    """
+
+    __slots__ = ('name', 'path', 'raw_scores', 'loaded', 'score', 'lys_score', 'arg_score', 'hyd_score')
+
+    def __init__(self, path, raw_scores, loaded):
+        self.name = _site_name(path)
+        self.path = path
+        self.raw_scores = raw_scores
+        self.loaded = loaded
+
+    def site(self):
+        """
+        The fully read active site.
+        """
+        return self.loaded.get(self.path)
+
+    @property
+    def residues(self):
+        return self.site().residues
+
+    # Overload the __repr__ operator to make printing simpler.
+    def __repr__(self):
+        return self.name
+
+
+def _read_cached(path, filepaths, workers, batch_size, parser):
+    """
+    Read PDB files through the cache, parsing only the files that are not cached yet or have
+    changed, and update the cache if anything changed.
+
+    Input: path of the cache file
+           list of PDB file paths
+           number of worker processes, files per batch and parser for the files to parse
+    Output: StructureStore with one site per file, or None if there are no files
+            number of sites that came from the cache
+    """
+    files = [os.path.basename(filepath) for filepath in filepaths]
+    stamps = file_stamps(filepaths)
+
+    cached, cached_store = load_cache(path)
+    cached_row = {name: i for i, name in enumerate(cached)}
+
+    stale = [i for i, (name, stamp) in enumerate(zip(files, stamps.tolist())) if cached.get(name) != tuple(stamp)]
+    n_cached = len(files) - len(stale)
+
+    ## Nothing to do if the cache holds exactly these files, unchanged
+    if len(stale) == 0 and len(cached) == len(files):
+        return cached_store, n_cached
+
+    parsed = _parse_files([filepaths[i] for i in stale], workers, batch_size, parser)
+    if parsed is not None:
+        raw_active_site_scores(parsed)
+
+    ## Put the cached and freshly parsed sites back in file order
+    stores = [store for store in (cached_store, parsed) if store is not None]
+    if len(stores) == 0:
+        return None, 0
+    joined = StructureStore.concatenate(stores)
+
+    n_old = cached_store.n_sites if cached_store is not None else 0
+    fresh_row = {i: n_old + j for j, i in enumerate(stale)}
+    rows = [fresh_row[i] if i in fresh_row else cached_row[name] for i, name in enumerate(files)]
+    store = joined.take(rows)
+
+    try:
+        save_cache(path, files, stamps, store)
+    except OSError as error:
+        print("Could not write cache %s: %s"%(path, error))
+
+    return store, n_cached
 
 
-def read_active_site(filepath):
+def parse_active_sites(filepaths, parser='buffer'):
+    """
+    Parse a batch of PDB files into one StructureStore.
+
+    There are two parsers, which give exactly the same result:
+        'line':   reads each file line by line, slicing the columns out of every line
+        'buffer': reads the files as bytes and decodes the fixed-width columns of every line
+                  of the whole batch at once with NumPy
+
+    Input: list of PDB file paths
+           parser to use, 'buffer' or 'line'
+    Output: StructureStore
+    """
+    if parser == 'line':
+        return StructureStore.concatenate([_parse_lines(filepath) for filepath in filepaths])
+
+    if parser == 'buffer':
+        buffers = []
+        for filepath in filepaths:
+            _site_name(filepath)
+            with open(filepath, "rb") as f:
+                buffers.append(f.read())
+        return _parse_buffers(filepaths, buffers)
+
+    raise ValueError("Unknown parser %r, expected one of %s"%(parser, ", ".join(PARSERS)))
+
+
+def read_active_site(filepath, parser='buffer'):
     """
     Read in a single active site given a PDB file
 
     Input: PDB file path
+           parser to use, 'buffer' or 'line' (see parse_active_sites)
     Output: ActiveSite instance
     """
+    return parse_active_site(filepath, parser).sites()[0]
+
+
+def parse_active_site(filepath, parser='buffer'):
+    """
+    Parse a single PDB file into a StructureStore holding one active site.
+
+    A residue starts whenever the residue number changes, and is added to the active site when
+    a TER card is reached.
+
+    Input: PDB file path
+           parser to use, 'buffer' or 'line' (see parse_active_sites)
+    Output: StructureStore
+    """
+    return parse_active_sites([filepath], parser)
+
+
+def _site_name(filepath):
+    """
+    Name of the active site in a PDB file (the file name without extension)
+    """
     basename = os.path.basename(filepath)
     name = os.path.splitext(basename)
 
     if name[1] != ".pdb":
         raise IOError("%s is not a PDB file"%filepath)
 
-    active_site = ActiveSite(name[0])
+    return name[0]
+
+
+def _parse_lines(filepath):
+    """
+    Parse a single PDB file line by line into a StructureStore holding one active site.
+
+    Input: PDB file path
+    Output: StructureStore
+    """
+    name = _site_name(filepath)
+
+    residue_types = []
+    residue_numbers = []
+    residue_offsets = [0]
+    atom_types = []
+    coords = []
+
+    # atoms of the residue currently being read
+    residue_atom_types = []
+    residue_coords = []
+    residue_type = None
 
     r_num = 0
 
@@ -45,65 +394,382 @@ def read_active_site(filepath):
         # iterate over each line in the file
         for line in f:
             if line[0:3] != 'TER':
-                # read in an atom
-                atom_type = line[13:17].strip()
-                x_coord = float(line[30:38])
-                y_coord = float(line[38:46])
-                z_coord = float(line[46:54])
-                atom = Atom(atom_type)
-                atom.coords = (x_coord, y_coord, z_coord)
-
-                residue_type = line[17:20]
                 residue_number = int(line[23:26])
 
                 # make a new residue if needed
                 if residue_number != r_num:
-                    residue = Residue(residue_type, residue_number)
+                    residue_type = line[17:20]
+                    residue_atom_types = []
+                    residue_coords = []
                     r_num = residue_number
 
-                # add the atom to the residue
-                residue.atoms.append(atom)
+                # read in an atom, coordinates are kept in thousandths of an Angstrom
+                residue_atom_types.append(line[13:17].strip())
+                residue_coords.append(round(float(line[30:38])*COORD_SCALE))
+                residue_coords.append(round(float(line[38:46])*COORD_SCALE))
+                residue_coords.append(round(float(line[46:54])*COORD_SCALE))
 
             else:  # I've reached a TER card
-                active_site.residues.append(residue)
+                if residue_type is None:
+                    raise IOError("%s has a TER card before any atom"%filepath)
+
+                residue_types.append(residue_type)
+                residue_numbers.append(r_num)
+                atom_types.extend(residue_atom_types)
+                coords.extend(residue_coords)
+                residue_offsets.append(len(atom_types))
+
+    return StructureStore.from_arrays([name], [0, len(residue_types)], residue_types,
+                                      residue_numbers, residue_offsets, atom_types, coords)
 
-    return active_site
 
+## Digit weights of the fixed-width coordinate columns ("%8.3f", the decimal point is skipped)
+#  and of the residue number columns ("%3d")
+_COORD_WEIGHTS = np.array([1000000, 100000, 10000, 1000, 0, 100, 10, 1], dtype=float)
+_NUMBER_WEIGHTS = np.array([100, 10, 1], dtype=float)
+
+## Number of leading columns of each line that are decoded
+_WIDTH = 54
+
+
+def _decode_fixed_width(columns, weights):
+    """
+    Decode a block of right-aligned, fixed-width number columns into integers.
 
-def write_clustering(filename, clusters):
+    Input:  (n_lines, width) uint8 array of characters
+            Weight of a digit in each column (0 for the decimal point)
+    Output: Array of integers
+    """
+    digits = columns - ord('0')
+    digits[digits > 9] = 0
+    sign = np.where((columns == ord('-')).any(axis=1), -1, 1)
+
+    ## Every partial sum is an integer well below 2**53, so the float product is exact
+    return sign*(digits.astype(float) @ weights).astype(np.int64)
+
+
+def _intern(columns, strip):
+    """
+    Intern a block of fixed-width text columns.
+
+    Input:  (n_lines, width) uint8 array of characters, width at most 4
+            Whether to strip surrounding spaces from the text
+    Output: Sorted array of the distinct strings
+            int16 array with the index of every line's string
+    """
+    ## Pack the characters of each line into one integer, and only decode the distinct ones
+    packed = np.zeros(len(columns), dtype=np.uint32)
+    for i in range(columns.shape[1]):
+        packed = (packed << 8) | columns[:, i]
+    packed, inverse = np.unique(packed, return_inverse=True)
+
+    width = columns.shape[1]
+    text = [bytes([(value >> (8*(width - 1 - i))) & 0xff for i in range(width)]).decode() for value in packed.tolist()]
+    if strip:
+        text = [t.strip() for t in text]
+
+    ## Text that only differed in spacing is merged after stripping
+    types, codes = np.unique(np.array(text, dtype=str), return_inverse=True)
+
+    return types, codes.astype(np.int16)[inverse.ravel()]
+
+
+def _parse_buffers(filepaths, buffers):
+    """
+    Parse the raw bytes of a batch of PDB files into a StructureStore, one site per file.
+
+    All lines of the batch are decoded together. The residue logic is the same as in
+    _parse_lines: a residue starts whenever the residue number changes within a file, and a TER
+    card adds the atoms read since then as a residue of that file's site.
+
+    Input:  list of PDB file paths
+            list of the contents of each file as bytes
+    Output: StructureStore
+    """
+    names = [_site_name(filepath) for filepath in filepaths]
+
+    ## Join all files into one buffer, making sure every file ends with a newline
+    buffers = [buffer if buffer.endswith(b'\n') or len(buffer) == 0 else buffer + b'\n' for buffer in buffers]
+    file_start = np.cumsum([0] + [len(buffer) for buffer in buffers])
+    data = np.frombuffer(b''.join(buffers), dtype=np.uint8)
+
+    line_end = np.flatnonzero(data == ord('\n'))
+    line_start = np.concatenate([[0], line_end + 1])[:len(line_end)].astype(np.int64)
+    line_file = np.searchsorted(file_start, line_start, side='right') - 1
+
+    is_ter = line_end - line_start >= 3
+    for i, char in enumerate(b'TER'):
+        is_ter &= data[np.minimum(line_start + i, len(data) - 1)] == char
+
+    ## Every other line is an atom, and must reach the last coordinate column
+    atom_row = np.flatnonzero(~is_ter)
+    atom_start = line_start[atom_row]
+    atom_file = line_file[atom_row]
+
+    short = line_end[atom_row] - atom_start < _WIDTH
+    if short.any():
+        bad = atom_row[np.flatnonzero(short)[0]]
+        raise ValueError("%s: malformed ATOM record %r"%(filepaths[line_file[bad]],
+                                                        bytes(data[line_start[bad]:line_end[bad]]).decode()))
+
+    ## Fixed-width character matrix of the atom lines, one column at a time (the record name and
+    #  serial number in the first 13 columns are never used)
+    atoms = np.empty((len(atom_row), _WIDTH), dtype=np.uint8)
+    for column in range(13, _WIDTH):
+        atoms[:, column] = data[atom_start + column]
+
+    atom_types, atom_type = _intern(atoms[:, 13:17], strip=True)
+    residue_types, residue_type = _intern(atoms[:, 17:20], strip=False)
+    residue_number = _decode_fixed_width(atoms[:, 23:26], _NUMBER_WEIGHTS)
+    coords = _decode_fixed_width(atoms[:, 30:54].reshape(-1, 8), _COORD_WEIGHTS).reshape(-1, 3)
+
+    ## A residue starts at the first atom of a file, or when the residue number changes
+    new_residue = np.ones(len(atoms), dtype=bool)
+    new_residue[1:] = (residue_number[1:] != residue_number[:-1]) | (atom_file[1:] != atom_file[:-1])
+    residue_start = np.flatnonzero(new_residue)
+
+    ## Every TER card closes the residue of the last atom before it, which must be in the same file
+    ter_row = np.flatnonzero(is_ter)
+    ter_file = line_file[ter_row]
+    stop = np.searchsorted(atom_row, ter_row)
+    orphan = (stop == 0) | (atom_file[np.maximum(stop - 1, 0)] != ter_file)
+    if orphan.any():
+        raise IOError("%s has a TER card before any atom"%filepaths[ter_file[orphan][0]])
+    start = residue_start[np.searchsorted(residue_start, stop - 1, side='right') - 1]
+
+    ## Gather the atoms of every closed residue (normally every atom, in order)
+    residue_offsets = np.concatenate([[0], np.cumsum(stop - start)]).astype(np.int64)
+    gather = ranges(start, stop - start)
+
+    site_offsets = np.concatenate([[0], np.cumsum(np.bincount(ter_file, minlength=len(names)))]).astype(np.int64)
+
+    return StructureStore(np.array(names, dtype=str), site_offsets,
+                          residue_types, residue_type[start], residue_number[start].astype(np.int32),
+                          residue_offsets, atom_types, atom_type[gather], coords[gather].astype(np.int32))
+
+
+## Output formats of the clustering writers. text is the human readable format, the others are
+#  for loading the labels back without parsing text: csv and jsonl are plain text, npz holds
+#  NumPy arrays of the site names and their cluster labels.
+FORMATS = ('text', 'csv', 'jsonl', 'npz')
+
+## Size of the write buffer of the clustering writers, in bytes
+WRITE_BUFFER = 1 << 20
+
+
+def output_format(filename):
+    """
+    Pick an output format from the extension of a file name, text unless it ends in .csv,
+    .jsonl or .npz.
+
+    Input:  file name
+    Output: format name
+    """
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+    return extension if extension in FORMATS else 'text'
+
+
+class ClusteringWriter:
+    """
+    Write clusterings to a file one cluster at a time, so clusters can be written out as soon as
+    they are final:
+
+        with ClusteringWriter("clusters.csv", multiple=True) as writer:
+            writer.begin_clustering(len(clusters))
+            for cluster in clusters:
+                writer.write_cluster(cluster)
+
+    Every cluster is written with one call into a large write buffer. npz files can only be
+    written whole, so their labels are collected and written when the writer is closed.
+
+    Formats (see FORMATS):
+        text    the format of write_clustering, or of write_mult_clusterings with multiple=True
+        csv     a clustering,cluster,site header, then one row per site
+        jsonl   one {"clustering": i, "cluster": j, "sites": [...]} object per line
+        npz     arrays names (n_sites,) and labels (n_clusterings, n_sites), with the sites in
+                the order they were first written
+    """
+
+    def __init__(self, filename, format=None, multiple=False):
+        self.filename = filename
+        self.format = format or output_format(filename)
+        if self.format not in FORMATS:
+            raise ValueError("Unknown clustering format %r"%self.format)
+        self.multiple = multiple
+        self.clustering = -1
+        self.cluster = 0
+        self._names = []
+        self._labels = []
+        self._file = None
+        self._closed = False
+        if self.format != 'npz':
+            self._file = open(filename, 'w', buffering=WRITE_BUFFER)
+            if self.format == 'csv':
+                self._file.write("clustering,cluster,site\n")
+
+    def begin_clustering(self, n_clusters=None):
+        """
+        Start the next clustering. Only needed for files holding several clusterings, the first
+        cluster written starts a clustering by itself.
+
+        Input:  number of clusters, for the header of the text format (left out if None)
+        Output: None
+        """
+        self.clustering += 1
+        self.cluster = 0
+        self._names.append([])
+        self._labels.append([])
+        if self.format == 'text' and self.multiple:
+            if n_clusters is None:
+                self._file.write("\nClustering %d\n============\n"%self.clustering)
+            else:
+                self._file.write("\nClustering %d (%d clusters)\n============\n"%(self.clustering, n_clusters))
+
+    def write_cluster(self, cluster):
+        """
+        Write out one cluster of the current clustering.
+
+        Input:  list of ActiveSite instances
+        Output: None
+        """
+        if self.clustering < 0:
+            self.begin_clustering()
+
+        names = [str(active_site) for active_site in cluster]
+        if self.format == 'text':
+            dashes = "------------" if self.multiple else "--------------"
+            self._file.write("\nCluster %d\n%s\n"%(self.cluster, dashes) + "".join([name + "\n" for name in names]))
+        elif self.format == 'csv':
+            prefix = "%d,%d,"%(self.clustering, self.cluster)
+            text = "".join(names)
+            if ',' in text or '"' in text or '\n' in text:
+                names = [_csv_field(name) for name in names]
+            self._file.write(prefix + ("\n" + prefix).join(names) + "\n" if len(names) > 0 else "")
+        elif self.format == 'jsonl':
+            self._file.write(json.dumps({'clustering': self.clustering, 'cluster': self.cluster, 'sites': names}) + "\n")
+        else:
+            self._names[-1].extend(names)
+            self._labels[-1].append(np.full(len(names), self.cluster, dtype=np.int32))
+
+        self.cluster += 1
+
+    def write_clustering(self, clusters):
+        """
+        Write out a whole clustering.
+
+        Input:  a clustering of ActiveSite instances
+        Output: None
+        """
+        self.begin_clustering(len(clusters))
+        for cluster in clusters:
+            self.write_cluster(cluster)
+
+    def close(self):
+        """
+        Flush everything to the file and close it.
+        """
+        if self._closed:
+            return
+        self._closed = True
+
+        if self.format == 'npz':
+            ## Sites in the order they were first written, sites missing from a clustering get
+            #  label -1
+            written = np.array([name for clustering in self._names for name in clustering], dtype=str)
+            unique, first, inverse = np.unique(written, return_index=True, return_inverse=True)
+            rank = np.empty(len(unique), dtype=np.intp)
+            rank[np.argsort(first, kind='stable')] = np.arange(len(unique))
+            names = written[np.sort(first)]
+
+            labels = np.full((len(self._names), len(unique)), -1, dtype=np.int32)
+            start = 0
+            for i, (clustering, cluster_labels) in enumerate(zip(self._names, self._labels)):
+                if len(clustering) > 0:
+                    labels[i, rank[inverse[start:start + len(clustering)]]] = np.concatenate(cluster_labels)
+                start += len(clustering)
+            with open(self.filename, 'wb') as f:
+                np.savez(f, names=names, labels=labels)
+        else:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+def _csv_field(text):
+    """
+    Quote a CSV field if it needs it.
+    """
+    if any([c in text for c in ',"\n']):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def write_clustering(filename, clusters, format=None):
     """
     Write the clustered ActiveSite instances out to a file.
 
     Input: a filename and a clustering of ActiveSite instances
+           output format (see ClusteringWriter), picked from the file extension if None
     Output: none
     """
 
-    out = open(filename, 'w')
+    with ClusteringWriter(filename, format) as writer:
+        for cluster in clusters:
+            writer.write_cluster(cluster)
 
-    for i in range(len(clusters)):
-        out.write("\nCluster %d\n--------------\n" % i)
-        for j in range(len(clusters[i])):
-            out.write("%s\n" % clusters[i][j])
 
-    out.close()
-
-
-def write_mult_clusterings(filename, clusterings):
+def write_mult_clusterings(filename, clusterings, format=None):
     """
     Write a series of clusterings of ActiveSite instances out to a file.
 
     Input: a filename and a list of clusterings of ActiveSite instances
+           output format (see ClusteringWriter), picked from the file extension if None
     Output: none
     """
 
-    out = open(filename, 'w')
+    with ClusteringWriter(filename, format, multiple=True) as writer:
+        for clusters in clusterings:
+            writer.write_clustering(clusters)
 
-    for i in range(len(clusterings)):
-        clusters = clusterings[i]
 
-        for j in range(len(clusters)):
-            out.write("\nCluster %d\n------------\n" % j)
-            for k in range(len(clusters[j])):
-                out.write("%s\n" % clusters[j][k])
+def read_labels(filename, format=None):
+    """
+    Load the cluster labels of a csv, jsonl or npz clustering file.
 
-    out.close()
+    Input:  file name
+            format, picked from the file extension if None
+    Output: array of site names
+            (n_clusterings, n_sites) int array of cluster labels, -1 where a site is missing
+            from a clustering
+    """
+    format = format or output_format(filename)
+    if format == 'npz':
+        with np.load(filename, allow_pickle=False) as data:
+            return data['names'], data['labels']
+
+    rows = []
+    with open(filename, 'r') as f:
+        if format == 'csv':
+            import csv
+            reader = csv.reader(f)
+            next(reader)
+            rows = [(int(clustering), int(cluster), name) for clustering, cluster, name in reader]
+        elif format == 'jsonl':
+            for line in f:
+                record = json.loads(line)
+                rows.extend([(record['clustering'], record['cluster'], name) for name in record['sites']])
+        else:
+            raise ValueError("Cannot read labels from %s files"%format)
+
+    names = {}
+    for clustering, cluster, name in rows:
+        names.setdefault(name, len(names))
+    labels = np.full((max([row[0] for row in rows], default=-1) + 1, len(names)), -1, dtype=np.int32)
+    for clustering, cluster, name in rows:
+        labels[clustering, names[name]] = cluster
+
+    return np.array(list(names), dtype=str), labels
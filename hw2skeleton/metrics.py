@@ -0,0 +1,91 @@
+# Lightweight counters and stage timers for the clustering pipeline
+
+import contextlib
+import json
+import time
+import tracemalloc
+
+
+## Counters by name, e.g. files_parsed or merges. Code adds to them once per batch of work
+#  rather than once per item, so counting costs next to nothing.
+counters = {}
+
+## Stage timings by name: total seconds, number of calls, and peak traced memory in bytes (only
+#  while tracemalloc is tracing)
+timers = {}
+
+
+def count(name, n=1):
+    """
+    Add to a counter.
+
+    Input:  counter name
+            amount to add
+    Output: None
+    """
+    counters[name] = counters.get(name, 0) + n
+
+
+@contextlib.contextmanager
+def timer(name):
+    """
+    Time a stage of the pipeline:
+
+        with metrics.timer('read'):
+            active_sites = read_active_sites(directory)
+
+    Repeated stages add up. While tracemalloc is tracing, the peak memory of the stage above
+    what was allocated when it started is recorded too.
+
+    Input:  stage name
+    Output: context manager
+    """
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage = timers.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        stage['seconds'] += elapsed
+        stage['calls'] += 1
+        if tracing:
+            peak = tracemalloc.get_traced_memory()[1] - before
+            stage['peak_bytes'] = max(stage.get('peak_bytes', 0), peak)
+
+
+def reset():
+    """
+    Clear all counters and timers.
+    """
+    counters.clear()
+    timers.clear()
+
+
+def report():
+    """
+    Snapshot of all counters and timers.
+
+    Input:  None
+    Output: dictionary with 'counters' and 'timers'
+    """
+    return {'counters': dict(counters), 'timers': {name: dict(stage) for name, stage in timers.items()}}
+
+
+def write_report(path, **extra):
+    """
+    Write the counters and timers to a JSON file.
+
+    Input:  file path
+            any other values to include in the report (e.g. the command line arguments)
+    Output: None
+    """
+    metrics = report()
+    metrics.update(extra)
+    with open(path, "w") as f:
+        json.dump(metrics, f, indent=2, sort_keys=True)
+        f.write("\n")
@@ -0,0 +1,192 @@
+# Nearest neighbour search over the scores or feature vectors of a corpus of active sites
+
+import numpy as np
+from .utils import site_raw_scores, FEATURES
+from .cache import save_npz, load_npz
+
+
+class SiteIndex:
+    """
+    A nearest neighbour index over the active sites of a corpus, for finding the known sites
+    most similar to new ones without comparing against every site.
+
+    Sites are indexed by their score ('score') or by their weighted feature vectors ('vector',
+    the normalized lysine, arginine and hydrophobicity scores scaled by the square root of their
+    weights, so distances are the weighted Euclidean distances of cluster.pairwise_distances).
+    Scores are kept sorted, so queries are binary searches. Vectors go in a KD-tree. Both
+    answer k nearest neighbour and radius queries in O(log n) per query (plus the size of the
+    answer), for one point or a batch of points at once.
+
+    The normalization of the corpus is kept with the index, so new sites are scored exactly as
+    if they had been scored with the corpus (see query_points).
+    """
+
+    ## Version of saved indices (see cache.save_npz)
+    VERSION = 1
+
+    FEATURES = ('score', 'vector')
+
+    def __init__(self, names, points, mean, deviation, features='score', weights=None):
+        if features not in self.FEATURES:
+            raise ValueError("Unknown index features %r"%features)
+        self.names = np.asarray(names, dtype=str)
+        self.points = np.asarray(points, dtype=float).reshape(len(self.names), -1)
+        self.mean = np.asarray(mean, dtype=float)
+        self.deviation = np.asarray(deviation, dtype=float)
+        self.features = features
+        self.weights = np.ones(len(FEATURES)) if weights is None else np.asarray(weights, dtype=float)
+
+        if features == 'score':
+            self.order = np.argsort(self.points[:, 0], kind='stable')
+            self.sorted = self.points[self.order, 0]
+            self.tree = None
+        else:
+            from scipy.spatial import cKDTree
+            self.tree = cKDTree(self.points)
+
+    @classmethod
+    def from_sites(cls, active_sites, features='score', weights=None):
+        """
+        Index a corpus of active sites, normalizing their scores the way active_site_score does.
+
+        Input:  a list of active sites
+                'score' or 'vector'
+                weights of the lysine, arginine and hydrophobicity scores, for 'vector'
+        Output: SiteIndex
+        """
+        raw = site_raw_scores(active_sites)
+        n = len(raw)
+
+        ## The same sums as utils.normalize_scores, so the indexed points are the sites' scores
+        if n > 0:
+            mean = np.cumsum(raw, axis=0)[-1]/n
+            deviation = np.cumsum(np.abs(raw - mean), axis=0)[-1]/n
+        else:
+            mean = deviation = np.zeros(len(FEATURES))
+
+        points = _normalized_points(raw, mean, deviation, features, weights)
+        return cls([active_site.name for active_site in active_sites], points, mean, deviation, features, weights)
+
+    def __len__(self):
+        return len(self.names)
+
+    def query_points(self, active_sites):
+        """
+        Points of new active sites, scored with the normalization of the indexed corpus.
+
+        Input:  a list of active sites
+        Output: (n, 1) or (n, 3) array of points
+        """
+        return _normalized_points(site_raw_scores(active_sites), self.mean, self.deviation, self.features, self.weights)
+
+    def query(self, points, k=1):
+        """
+        Find the k nearest indexed sites of every query point.
+
+        Input:  (m, d) array of query points (an (m,) array or a single score also work for a
+                score index)
+                number of neighbours
+        Output: (m, k) array of distances, closest first
+                (m, k) array of indices of the neighbours (into names)
+        """
+        points = self._as_points(points)
+        k = min(k, len(self))
+        if k <= 0:
+            return np.zeros((len(points), 0)), np.zeros((len(points), 0), dtype=np.intp)
+
+        if self.tree is not None:
+            distances, indices = self.tree.query(points, k=k)
+            return distances.reshape(len(points), k), indices.reshape(len(points), k)
+
+        ## The k nearest scores are among the k sorted scores on either side of the query
+        x = points[:, 0]
+        n = len(self.sorted)
+        candidates = np.searchsorted(self.sorted, x)[:, None] + np.arange(-k, k)[None, :]
+        valid = (candidates >= 0) & (candidates < n)
+        candidates = np.clip(candidates, 0, n - 1)
+        distances = np.where(valid, np.abs(self.sorted[candidates] - x[:, None]), np.inf)
+
+        closest = np.argsort(distances, axis=1, kind='stable')[:, :k]
+        rows = np.arange(len(x))[:, None]
+        return distances[rows, closest], self.order[candidates[rows, closest]]
+
+    def query_radius(self, points, radius):
+        """
+        Find all indexed sites within a distance of every query point.
+
+        Input:  (m, d) array of query points
+                distance
+        Output: list of m arrays of indices (into names), closest first
+        """
+        points = self._as_points(points)
+
+        if self.tree is not None:
+            results = []
+            for point, indices in zip(points, self.tree.query_ball_point(points, radius)):
+                indices = np.array(indices, dtype=np.intp)
+                distances = np.sqrt(((self.points[indices] - point)**2).sum(axis=1))
+                results.append(indices[np.argsort(distances, kind='stable')])
+            return results
+
+        x = points[:, 0]
+        starts = np.searchsorted(self.sorted, x - radius, side='left')
+        stops = np.searchsorted(self.sorted, x + radius, side='right')
+        results = []
+        for value, start, stop in zip(x.tolist(), starts.tolist(), stops.tolist()):
+            closest = np.argsort(np.abs(self.sorted[start:stop] - value), kind='stable')
+            results.append(self.order[start:stop][closest])
+        return results
+
+    def neighbors(self, active_sites, k=1):
+        """
+        Find the most similar indexed sites of new active sites.
+
+        Input:  a list of active sites
+                number of neighbours
+        Output: list of lists of (site name, distance), closest first, one list per active site
+        """
+        distances, indices = self.query(self.query_points(active_sites), k)
+        return [[(str(self.names[i]), d) for i, d in zip(row_indices, row_distances)]
+                for row_indices, row_distances in zip(indices.tolist(), distances.tolist())]
+
+    def save(self, path):
+        """
+        Write the index to a .npz file. The search structure is rebuilt when it is loaded.
+
+        Input:  file path
+        Output: None
+        """
+        save_npz(path, self.VERSION, names=self.names, points=self.points, mean=self.mean,
+                 deviation=self.deviation, features=self.features, weights=self.weights)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read an index saved with save.
+
+        Input:  file path
+        Output: SiteIndex
+        """
+        saved = load_npz(path, cls.VERSION, 'site index')
+        return cls(saved['names'], saved['points'], saved['mean'], saved['deviation'],
+                   str(saved['features']), saved['weights'])
+
+    def _as_points(self, points):
+        points = np.asarray(points, dtype=float)
+        if points.ndim < 2:
+            points = points.reshape(-1, self.points.shape[1])
+        return points
+
+
+def _normalized_points(raw, mean, deviation, features, weights):
+    """
+    Turn raw lysine, arginine and hydrophobicity scores into points of an index: (n, 1) scores
+    or (n, 3) weighted feature vectors. Scores whose deviation is 0 normalize to 0.
+    """
+    normalized = np.zeros_like(raw)
+    filled = deviation > 0
+    normalized[:, filled] = (raw[:, filled] - mean[filled])/deviation[filled]
+
+    if features == 'score':
+        return (normalized[:, 0] + normalized[:, 1] + normalized[:, 2])[:, None]
+    return normalized*np.sqrt(np.ones(len(FEATURES)) if weights is None else np.asarray(weights, dtype=float))
@@ -0,0 +1,325 @@
+# Compact, array-backed storage for many active sites at once
+
+import numpy as np
+
+
+## Coordinates are stored as integer thousandths of an Angstrom. PDB files write coordinates with
+#  exactly three decimals, so this is lossless: coords/1000.0 gives back exactly the same float
+#  that float() gives for the text in the file, in the same 4 bytes a float32 would take.
+COORD_SCALE = 1000.0
+
+
+def ranges(start, length):
+    """
+    Concatenate the integer ranges start[i]:start[i] + length[i].
+
+    Input:  Array of range starts
+            Array of range lengths
+    Output: Array of integers
+    """
+    length = np.asarray(length, dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(length)]).astype(np.int64)
+    return np.repeat(np.asarray(start, dtype=np.int64) - offsets[:-1], length) + np.arange(offsets[-1])
+
+
+class StructureStore:
+    """
+    A struct-of-arrays store for a set of active sites.
+
+    Instead of one Python object per residue and per atom, every residue and atom lives in a row
+    of a few flat NumPy arrays:
+
+        names:           (n_sites,)       site names
+        site_offsets:    (n_sites + 1,)   residues of site i are rows site_offsets[i]:site_offsets[i+1]
+        residue_type:    (n_residues,)    codes into residue_types
+        residue_number:  (n_residues,)    residue numbers
+        residue_offsets: (n_residues + 1,) atoms of residue j are rows residue_offsets[j]:residue_offsets[j+1]
+        atom_type:       (n_atoms,)       codes into atom_types
+        coords:          (n_atoms, 3)     int32 coordinates in thousandths of an Angstrom
+
+    residue_types and atom_types are the interned vocabularies of type names. Sites, residues
+    and atoms are handed out as lightweight views (StoredActiveSite, StoredResidue, StoredAtom)
+    with the same attributes as ActiveSite, Residue and Atom.
+
+    raw_scores optionally holds the (n_sites, 3) un-normalized lysine, arginine and
+    hydrophobicity scores, once they have been computed (see utils.raw_active_site_scores).
+    """
+
+    ## Names of the arrays that make up a store
+    ARRAYS = ('names', 'site_offsets', 'residue_types', 'residue_type', 'residue_number',
+              'residue_offsets', 'atom_types', 'atom_type', 'coords')
+
+    def __init__(self, names, site_offsets, residue_types, residue_type, residue_number,
+                 residue_offsets, atom_types, atom_type, coords):
+        self.names = names
+        self.site_offsets = site_offsets
+        self.residue_types = residue_types
+        self.residue_type = residue_type
+        self.residue_number = residue_number
+        self.residue_offsets = residue_offsets
+        self.atom_types = atom_types
+        self.atom_type = atom_type
+        self.coords = coords
+        self.raw_scores = None
+        self._sites = None
+
+    @classmethod
+    def from_arrays(cls, names, site_offsets, residue_type, residue_number, residue_offsets,
+                    atom_type, coords):
+        """
+        Build a store from un-interned columns.
+
+        Input:  Site names
+                Site residue offsets
+                Residue type names
+                Residue numbers
+                Residue atom offsets
+                Atom type names
+                (n_atoms, 3) coordinates in thousandths of an Angstrom
+        Output: StructureStore
+        """
+        residue_types, residue_type = np.unique(np.asarray(residue_type, dtype=str), return_inverse=True)
+        atom_types, atom_type = np.unique(np.asarray(atom_type, dtype=str), return_inverse=True)
+
+        return cls(np.asarray(names, dtype=str),
+                   np.asarray(site_offsets, dtype=np.int64),
+                   residue_types, residue_type.astype(np.int16),
+                   np.asarray(residue_number, dtype=np.int32),
+                   np.asarray(residue_offsets, dtype=np.int64),
+                   atom_types, atom_type.astype(np.int16),
+                   np.asarray(coords, dtype=np.int32).reshape(-1, 3))
+
+    @classmethod
+    def from_sites(cls, active_sites):
+        """
+        Pack a list of ActiveSite instances (or any objects with the same attributes) into a store.
+
+        Input:  List of active sites
+        Output: StructureStore
+        """
+        site_offsets = [0]
+        residue_type = []
+        residue_number = []
+        residue_offsets = [0]
+        atom_type = []
+        coords = []
+
+        for active_site in active_sites:
+            for residue in active_site.residues:
+                residue_type.append(residue.type)
+                residue_number.append(residue.number)
+                atom_type.extend([atom.type for atom in residue.atoms])
+                coords.extend([atom.coords for atom in residue.atoms])
+                residue_offsets.append(len(atom_type))
+            site_offsets.append(len(residue_type))
+
+        coords = np.rint(np.array(coords, dtype=float).reshape(-1, 3)*COORD_SCALE)
+
+        return cls.from_arrays([active_site.name for active_site in active_sites], site_offsets,
+                               residue_type, residue_number, residue_offsets, atom_type, coords)
+
+    @classmethod
+    def concatenate(cls, stores):
+        """
+        Join several stores into one, merging their type vocabularies.
+
+        Input:  List of StructureStore instances
+        Output: StructureStore
+        """
+        if len(stores) == 0:
+            return cls.from_sites([])
+        if len(stores) == 1:
+            return stores[0]
+
+        residue_types = np.unique(np.concatenate([store.residue_types for store in stores]))
+        atom_types = np.unique(np.concatenate([store.atom_types for store in stores]))
+
+        ## Re-map every store's type codes into the merged vocabularies
+        residue_type = [np.searchsorted(residue_types, store.residue_types).astype(np.int16)[store.residue_type]
+                        for store in stores]
+        atom_type = [np.searchsorted(atom_types, store.atom_types).astype(np.int16)[store.atom_type]
+                     for store in stores]
+
+        ## Offsets of each store are shifted by the number of rows that come before it
+        site_offsets = [np.zeros(1, dtype=np.int64)]
+        residue_offsets = [np.zeros(1, dtype=np.int64)]
+        n_residues = 0
+        n_atoms = 0
+        for store in stores:
+            site_offsets.append(store.site_offsets[1:] + n_residues)
+            residue_offsets.append(store.residue_offsets[1:] + n_atoms)
+            n_residues += store.n_residues
+            n_atoms += store.n_atoms
+
+        joined = cls(np.concatenate([store.names for store in stores]),
+                     np.concatenate(site_offsets),
+                     residue_types, np.concatenate(residue_type),
+                     np.concatenate([store.residue_number for store in stores]),
+                     np.concatenate(residue_offsets),
+                     atom_types, np.concatenate(atom_type),
+                     np.concatenate([store.coords for store in stores]))
+
+        ## Raw scores only depend on each site itself, so they carry over
+        if all([store.raw_scores is not None for store in stores]):
+            joined.raw_scores = np.concatenate([store.raw_scores for store in stores])
+
+        return joined
+
+    def take(self, rows):
+        """
+        Copy some of the sites of the store into a new store.
+
+        Input:  Array of site rows, in the order they should appear in the new store
+        Output: StructureStore
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+
+        ## Residue rows of the selected sites, then atom rows of those residues
+        residue_length = self.site_offsets[rows + 1] - self.site_offsets[rows]
+        residue_rows = ranges(self.site_offsets[rows], residue_length)
+        atom_length = self.residue_offsets[residue_rows + 1] - self.residue_offsets[residue_rows]
+        atom_rows = ranges(self.residue_offsets[residue_rows], atom_length)
+
+        taken = StructureStore(self.names[rows],
+                               np.concatenate([[0], np.cumsum(residue_length)]).astype(np.int64),
+                               self.residue_types, self.residue_type[residue_rows],
+                               self.residue_number[residue_rows],
+                               np.concatenate([[0], np.cumsum(atom_length)]).astype(np.int64),
+                               self.atom_types, self.atom_type[atom_rows], self.coords[atom_rows])
+
+        if self.raw_scores is not None:
+            taken.raw_scores = self.raw_scores[rows]
+
+        return taken
+
+    @property
+    def n_sites(self):
+        return len(self.names)
+
+    @property
+    def n_residues(self):
+        return len(self.residue_type)
+
+    @property
+    def n_atoms(self):
+        return len(self.atom_type)
+
+    @property
+    def nbytes(self):
+        """
+        Total size of the arrays in the store, in bytes.
+        """
+        return sum([getattr(self, array).nbytes for array in self.ARRAYS])
+
+    def residue_site(self):
+        """
+        Site index of every residue.
+        """
+        return np.repeat(np.arange(self.n_sites), np.diff(self.site_offsets))
+
+    def atom_residue(self):
+        """
+        Residue index of every atom.
+        """
+        return np.repeat(np.arange(self.n_residues), np.diff(self.residue_offsets))
+
+    def atom_coords(self):
+        """
+        (n_atoms, 3) float array of atom coordinates, in Angstroms.
+        """
+        return self.coords/COORD_SCALE
+
+    def sites(self):
+        """
+        View every site in the store as an active site. The same view objects are returned on
+        every call, so scores written to them stick.
+
+        Input:  None
+        Output: List of StoredActiveSite instances
+        """
+        if self._sites is None:
+            self._sites = [StoredActiveSite(self, i) for i in range(self.n_sites)]
+        return self._sites
+
+    def __getstate__(self):
+        ## Views are cheap to rebuild and would otherwise be pickled along with the arrays
+        state = self.__dict__.copy()
+        state['_sites'] = None
+        return state
+
+
+class StoredAtom:
+    """
+    View of one atom of a StructureStore, with the attributes of Atom
+    """
+
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def type(self):
+        return str(self.store.atom_types[self.store.atom_type[self.index]])
+
+    @property
+    def coords(self):
+        return tuple([c/COORD_SCALE for c in self.store.coords[self.index].tolist()])
+
+    # Overload the __repr__ operator to make printing simpler.
+    def __repr__(self):
+        return self.type
+
+
+class StoredResidue:
+    """
+    View of one residue of a StructureStore, with the attributes of Residue
+    """
+
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def type(self):
+        return str(self.store.residue_types[self.store.residue_type[self.index]])
+
+    @property
+    def number(self):
+        return int(self.store.residue_number[self.index])
+
+    @property
+    def atoms(self):
+        start, stop = self.store.residue_offsets[self.index:self.index + 2].tolist()
+        return [StoredAtom(self.store, i) for i in range(start, stop)]
+
+    # Overload the __repr__ operator to make printing simpler.
+    def __repr__(self):
+        return "{0} {1}".format(self.type, self.number)
+
+
+class StoredActiveSite:
+    """
+    View of one site of a StructureStore, with the attributes of ActiveSite.
+
+    Scores are plain attributes of the view, like they are for ActiveSite.
+    """
+
+    __slots__ = ('store', 'index', 'name', 'score', 'lys_score', 'arg_score', 'hyd_score')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.name = str(store.names[index])
+
+    @property
+    def residues(self):
+        start, stop = self.store.site_offsets[self.index:self.index + 2].tolist()
+        return [StoredResidue(self.store, i) for i in range(start, stop)]
+
+    # Overload the __repr__ operator to make printing simpler.
+    def __repr__(self):
+        return self.name
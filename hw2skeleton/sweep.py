@@ -0,0 +1,330 @@
+# Clustering quality over a grid of k values and restarts, evaluated in parallel
+
+import itertools
+import os
+import numpy as np
+from .cluster import kmeans, centroid_linkage, merge_labels, group_by_center
+from .utils import cluster_score
+
+
+## Clustering methods, by the flag the command line uses for them
+METHODS = ('P', 'H')
+
+## Columns of a sweep table, in order
+COLUMNS = ('method', 'k', 'seed', 'clusters', 'cluster_score', 'silhouette', 'within', 'between',
+           'calinski_harabasz', 'n_iter')
+
+
+def compact_labels(labels):
+    """
+    Renumber cluster labels to 0, 1, 2, ...
+
+    Input:  Array of cluster labels
+    Output: Array of labels from 0 to the number of clusters - 1
+            Number of clusters
+    """
+    unique, labels = np.unique(labels, return_inverse=True)
+    return labels.ravel(), len(unique)
+
+
+def dispersion(X, labels):
+    """
+    Within and between cluster dispersion of a clustering.
+
+    Input:  (n, d) array of points
+            array of cluster labels from 0 to k - 1
+    Output: sum of absolute deviations from the cluster means (the same as utils.cluster_score
+            for 1-D scores, Euclidean distances otherwise)
+            within cluster sum of squares
+            between cluster sum of squares (of the cluster means around the overall mean,
+            weighted by cluster size)
+    """
+    k = int(labels.max()) + 1
+    counts = np.bincount(labels, minlength=k)
+    means = np.stack([np.bincount(labels, weights=X[:, j], minlength=k) for j in range(X.shape[1])], axis=1)
+    means = means/np.maximum(counts, 1)[:, None]
+
+    deviation = X - means[labels]
+    absolute = np.sqrt((deviation**2).sum(axis=1)).sum()
+    within = (deviation**2).sum()
+    between = (counts[:, None]*(means - X.mean(axis=0))**2).sum()
+
+    return float(absolute), float(within), float(between)
+
+
+def silhouette(scores, labels, order=None):
+    """
+    Mean silhouette of a clustering of 1-D scores.
+
+    The silhouette of a point is (b - a)/max(a, b), with a its mean distance to the other points
+    of its cluster and b its mean distance to the points of the closest other cluster (0 for a
+    point alone in its cluster). The summed distance from a point x to all sorted values v of a
+    cluster is x*L - sum(v[:L]) + sum(v[L:]) - x*(m - L) with L = the number of values below x,
+    so every mean distance comes from a binary search and two prefix sums, in O(n k log n)
+    instead of O(n^2).
+
+    Input:  Array of scores
+            array of cluster labels from 0 to k - 1
+            argsort of the scores, if already known
+    Output: Mean silhouette (nan with fewer than 2 clusters)
+    """
+    scores = np.asarray(scores, dtype=float)
+    k = int(labels.max()) + 1
+    n = len(scores)
+    if k < 2:
+        return float('nan')
+
+    if order is None:
+        order = np.argsort(scores, kind='stable')
+    sorted_labels = labels[order]
+    sorted_values = scores[order]
+
+    ## Mean distance from every point to every cluster
+    mean_distance = np.empty((k, n))
+    counts = np.bincount(labels, minlength=k)
+    for c in range(k):
+        values = sorted_values[sorted_labels == c]
+        prefix = np.concatenate([[0.0], np.cumsum(values)])
+        below = np.searchsorted(values, scores, side='left')
+        total = scores*below - prefix[below] + (prefix[-1] - prefix[below]) - scores*(len(values) - below)
+        mean_distance[c] = total/max(len(values), 1)
+
+    ## A point's own cluster leaves itself out of the mean
+    own = counts[labels]
+    a = mean_distance[labels, np.arange(n)]*own/np.maximum(own - 1, 1)
+    mean_distance[labels, np.arange(n)] = np.inf
+    mean_distance[counts == 0] = np.inf
+    b = mean_distance.min(axis=0)
+
+    s = np.where(np.maximum(a, b) > 0, (b - a)/np.maximum(np.maximum(a, b), 1e-300), 0.0)
+    s[own == 1] = 0.0
+
+    return float(s.mean())
+
+
+def evaluate(scores, labels, order=None):
+    """
+    All quality metrics of one clustering of 1-D scores.
+
+    Input:  Array of scores
+            Array of cluster labels
+            argsort of the scores, if already known
+    Output: Dictionary with clusters, cluster_score, silhouette, within, between and
+            calinski_harabasz (between/(k - 1) over within/(n - k), nan if undefined)
+    """
+    labels, k = compact_labels(labels)
+    n = len(scores)
+    absolute, within, between = dispersion(np.asarray(scores, dtype=float)[:, None], labels)
+
+    if 1 < k < n and within > 0:
+        calinski_harabasz = (between/(k - 1))/(within/(n - k))
+    else:
+        calinski_harabasz = float('nan')
+
+    return {'clusters': k, 'cluster_score': absolute, 'silhouette': silhouette(scores, labels, order),
+            'within': within, 'between': between, 'calinski_harabasz': calinski_harabasz}
+
+
+## Points of the sweep or restarts in this worker process, attached from shared memory by _attach
+_shared = {}
+
+
+def _attach(name, shape, extra):
+    """
+    Pool initializer: map the shared array of scores (or points) into this worker, next to the
+    small extra arrays every task needs.
+    """
+    from multiprocessing import shared_memory
+    _shared.update(extra)
+    block = shared_memory.SharedMemory(name=name)
+    _shared['block'] = block
+    _shared['scores'] = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+    if len(shape) == 1:
+        _shared['order'] = np.argsort(_shared['scores'], kind='stable')
+
+
+def _map_shared(function, tasks, X, workers, extra=None):
+    """
+    Run function on every task, in a pool of worker processes that all read X from one block of
+    shared memory (or in this process with workers <= 1).
+
+    Input:  function of one task, reading the array from _shared['scores']
+            list of tasks
+            contiguous float64 array
+            number of worker processes
+            dictionary of small arrays to also put in _shared, copied to every worker once
+    Output: iterator over the results, in the order of the tasks
+    """
+    extra = {} if extra is None else extra
+    if workers > 1:
+        try:
+            from multiprocessing import shared_memory
+        except ImportError:
+            ## Shared memory is new in Python 3.8, before that the tasks run in this process
+            workers = 1
+
+    if workers <= 1 or len(X) == 0:
+        _shared.update(extra)
+        _shared['scores'] = X
+        if X.ndim == 1:
+            _shared['order'] = np.argsort(X, kind='stable')
+        try:
+            for task in tasks:
+                yield function(task)
+        finally:
+            _shared.clear()
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    block = shared_memory.SharedMemory(create=True, size=max(X.nbytes, 1))
+    try:
+        np.ndarray(X.shape, dtype=np.float64, buffer=block.buf)[:] = X
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(block.name, X.shape, extra)) as executor:
+            for result in executor.map(function, tasks):
+                yield result
+    finally:
+        block.close()
+        block.unlink()
+
+
+def _run(task):
+    """
+    Cluster the shared scores for one point of the grid and evaluate the clustering.
+
+    Input:  (method, k, seed, iterations)
+    Output: row of the sweep table
+    """
+    method, k, seed, iterations = task
+    scores = _shared['scores']
+
+    n_iter = None
+    if method == 'P':
+        labels, centers, inertia, n_iter = kmeans(scores, k, iterations, seed=seed)
+    else:
+        ## Every k is a cut of the same tree, built once by sweep
+        n = len(scores)
+        labels = merge_labels(_shared['merges'][:n - min(max(k, 1), n)], n)
+
+    row = {'method': method, 'k': k, 'seed': seed, 'n_iter': n_iter}
+    row.update(evaluate(scores, labels, _shared['order']))
+    return row
+
+
+def sweep(scores, ks, methods=METHODS, restarts=1, seed=0, iterations=100, workers=1):
+    """
+    Evaluate clusterings of a set of scores over a grid of k values, methods and k-means
+    restarts, for elbow plots and model selection.
+
+    Every point of the grid is one task. With workers > 1 the tasks run in a pool of worker
+    processes, which all read the scores from one block of shared memory instead of each
+    getting a copy. Hierarchical clustering does not depend on the seed, so its tree is built
+    once and cut at every k.
+
+    Input:  Array of scores (e.g. active_site.score of every site), or a list of active sites
+            list of numbers of clusters
+            methods, 'P' (partitioning) and/or 'H' (hierarchical)
+            number of k-means restarts per k, seeded seed, seed + 1, ...
+            first seed
+            maximum number of k-means iterations
+            number of worker processes (None for one per CPU)
+    Output: List of rows (dictionaries with the keys in COLUMNS), ordered by method, k and seed,
+            empty without any scores
+    """
+    if len(scores) > 0 and hasattr(scores[0], 'score'):
+        scores = [active_site.score for active_site in scores]
+    scores = np.ascontiguousarray(scores, dtype=np.float64)
+
+    for method in methods:
+        if method not in METHODS:
+            raise ValueError("Unknown clustering method %r"%method)
+    if len(scores) == 0:
+        return []
+
+    tasks = []
+    for method, k in itertools.product(methods, ks):
+        seeds = range(seed, seed + restarts) if method == 'P' else [None]
+        tasks.extend([(method, k, s, iterations) for s in seeds])
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(tasks))
+
+    extra = {}
+    if 'H' in methods:
+        extra['merges'] = centroid_linkage(scores)
+
+    return list(_map_shared(_run, tasks, scores, workers, extra))
+
+
+def best_rows(table, metric='silhouette', maximize=True):
+    """
+    The best restart of every method and k by one metric, for comparing k values.
+
+    Input:  sweep table
+            metric to select by
+            whether larger values of the metric are better
+    Output: List of rows, one per method and k
+    """
+    best = {}
+    for row in table:
+        key = (row['method'], row['k'])
+        value = row[metric]
+        if key not in best or (value > best[key][metric] if maximize else value < best[key][metric]):
+            best[key] = row
+    return list(best.values())
+
+
+def _restart(task):
+    """
+    One seeded k-means run over the shared points.
+
+    Input:  (k, SeedSequence, iterations)
+    Output: array of labels, (k, d) array of centers, number of iterations
+    """
+    k, seed, iterations = task
+    labels, centers, inertia, n_iter = kmeans(_shared['scores'], k, iterations, seed=seed)
+    return labels.astype(np.int32), centers, n_iter
+
+
+def cluster_with_restarts(active_sites, k, restarts=10, seed=0, iterations=100, workers=1, features=None):
+    """
+    Partition a set of active sites with several independently seeded k-means runs, and keep
+    the clustering with the lowest utils.cluster_score.
+
+    Run r is seeded by child r of numpy's SeedSequence(seed).spawn(restarts), so every run gets
+    its own independent random stream that does not depend on the order of the sites' files or
+    on which process runs it. With workers > 1 the runs are spread over a pool of worker
+    processes reading the points from shared memory. Runs are compared in order, the first of
+    equally good runs winning, so the result is the same for any number of workers.
+
+    Input:  a list of scored active sites
+            number of clusters
+            number of seeded runs
+            random seed
+            maximum number of k-means iterations
+            number of worker processes (None for one per CPU)
+            (n, d) array of features to cluster on, one row per active site (scores if None)
+    Output: the best clustering (a list of lists of active sites, see cluster_by_partitioning)
+            list of the cluster_score of every run, in run order
+    """
+    if len(active_sites) <= 1:
+        return active_sites, []
+
+    if features is None:
+        features = [active_site.score for active_site in active_sites]
+    X = np.ascontiguousarray(features, dtype=np.float64)
+
+    tasks = [(k, child, iterations) for child in np.random.SeedSequence(seed).spawn(restarts)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(tasks))
+
+    best = None
+    run_scores = []
+    for labels, centers, n_iter in _map_shared(_restart, tasks, X, workers):
+        clustering = group_by_center(active_sites, labels, centers)
+        run_scores.append(cluster_score(clustering))
+        if best is None or run_scores[-1] < run_scores[best[0]]:
+            best = (len(run_scores) - 1, clustering)
+
+    return best[1], run_scores
@@ -1,3 +1,11 @@
+import collections
+import itertools
+import numpy as np
+from .store import StructureStore
+## The hydrophobicity table now lives with the feature extractors, it is still importable from here
+from .features import score_metric_hydrophobicity
+from . import features, metrics
+
 # Some utility classes to represent a PDB structure
 
 class Atom:
@@ -5,6 +13,8 @@ class Atom:
     A simple class for an amino acid residue
     """
 
+    __slots__ = ('type', 'coords')
+
     def __init__(self, type):
         self.type = type
         self.coords = (0.0, 0.0, 0.0)
@@ -18,6 +28,8 @@ class Residue:
     A simple class for an amino acid residue
     """
 
+    __slots__ = ('type', 'number', 'atoms')
+
     def __init__(self, type, number):
         self.type = type
         self.number = number
@@ -32,6 +44,8 @@ class ActiveSite:
     A simple class for an active site
     """
 
+    __slots__ = ('name', 'residues', 'score', 'lys_score', 'arg_score', 'hyd_score')
+
     def __init__(self, name):
         self.name = name
         self.residues = []
@@ -40,6 +54,157 @@ class ActiveSite:
     def __repr__(self):
         return self.name
 
+def site_store(active_sites):
+    """
+    Find a single StructureStore holding all of the given active sites.
+
+    Sites read with io.read_active_sites are views into a shared store, which is used as is.
+    Sites from several stores are joined into one. Lazily loaded sites (io.LazyActiveSite) are
+    read from their files together, a batch of files at a time, and plain ActiveSite instances
+    are packed into a new store.
+
+    Input:  A list of active sites
+    Output: StructureStore
+            Array with the row of every active site in the store
+    """
+    stores = collections.OrderedDict()
+    keys = []
+    rows = np.zeros(len(active_sites), dtype=np.intp)
+
+    ## Sites without a store are grouped by the SiteCache they load through (None for plain
+    #  objects), and numbered within their group
+    loose = collections.OrderedDict()
+    for i, active_site in enumerate(active_sites):
+        store = getattr(active_site, 'store', None)
+        if store is not None:
+            key = id(store)
+            stores.setdefault(key, store)
+            rows[i] = active_site.index
+        else:
+            loaded = getattr(active_site, 'loaded', None)
+            key = ('loose', None if loaded is None else id(loaded))
+            group = loose.setdefault(key, (loaded, []))
+            rows[i] = len(group[1])
+            group[1].append(active_site)
+        keys.append(key)
+
+    for key, (loaded, sites) in loose.items():
+        if loaded is None:
+            stores[key] = StructureStore.from_sites(sites)
+        else:
+            stores[key] = loaded.read_store([active_site.path for active_site in sites])
+
+    ## First row of every store once they are joined together
+    first_row = {}
+    n_sites = 0
+    for key, store in stores.items():
+        first_row[key] = n_sites
+        n_sites += store.n_sites
+    rows += np.array([first_row[key] for key in keys], dtype=np.intp).reshape(len(keys))
+
+    return StructureStore.concatenate(list(stores.values())), rows
+
+
+def raw_active_site_scores(store):
+    """
+    Compute the un-normalized lysine, arginine and hydrophobicity scores for every site in a store.
+
+    The scores are the features.SCORE_FEATURES of the feature pipeline, and are kept in
+    store.raw_scores, so they are only computed once per store.
+
+    Input:  StructureStore
+    Output: Three arrays (lysine, arginine, hydrophobicity), one value per site
+    """
+    if store.raw_scores is None:
+        store.raw_scores = features.extract(store, features.SCORE_FEATURES)
+
+    return store.raw_scores[:, 0], store.raw_scores[:, 1], store.raw_scores[:, 2]
+
+
+def site_raw_scores(active_sites):
+    """
+    Get the un-normalized lysine, arginine and hydrophobicity scores of a list of active sites.
+
+    Sites that carry their raw scores with them (a raw_scores attribute, like the lazily loaded
+    sites of io.read_active_sites) use those, so their atoms are not loaded. The rest are scored
+    together through their StructureStore (see site_store).
+
+    Input:  A list of active sites
+    Output: (n_sites, 3) array of raw lysine, arginine and hydrophobicity scores
+    """
+    raw = np.zeros((len(active_sites), 3))
+    carried = [getattr(active_site, 'raw_scores', None) is not None for active_site in active_sites]
+
+    rest = [i for i, known in enumerate(carried) if not known]
+    if len(rest) < len(active_sites):
+        raw[np.array(carried)] = [active_site.raw_scores for active_site, known in zip(active_sites, carried) if known]
+    if len(rest) > 0:
+        store, rows = site_store([active_sites[i] for i in rest])
+        raw[rest] = np.stack(raw_active_site_scores(store), axis=1)[rows]
+
+    return raw
+
+
+def normalize_scores(raw):
+    """
+    Center an array of scores around 0 and scale by the mean absolute deviation.
+
+    If every score is the same the deviation is 0, in which case all normalized scores are 0.
+
+    Input:  Array of raw scores
+    Output: Array of normalized scores
+    """
+    ## Sums are accumulated in site order (cumsum) rather than pairwise, to give exactly the
+    #  same values as summing the scores one at a time
+    m = np.cumsum(raw)[-1]/len(raw)
+    s = np.cumsum(np.abs(raw - m))[-1]/len(raw)
+
+    if s == 0:
+        return np.zeros_like(raw)
+
+    return (raw - m)/s
+
+
+def score_normalization(raw):
+    """
+    Mean and mean absolute deviation of every column of raw scores, summed exactly as
+    normalize_scores sums them.
+
+    Input:  (n_sites, 3) array of raw lysine, arginine and hydrophobicity scores
+    Output: Array of 3 means
+            Array of 3 mean absolute deviations
+    """
+    if len(raw) == 0:
+        return np.zeros(raw.shape[1]), np.zeros(raw.shape[1])
+    mean = np.cumsum(raw, axis=0)[-1]/len(raw)
+    deviation = np.cumsum(np.abs(raw - mean), axis=0)[-1]/len(raw)
+    return mean, deviation
+
+
+def write_scores(active_sites, raw, mean, deviation):
+    """
+    Normalize raw scores with a given mean and deviation, and write the lysine, arginine,
+    hydrophobicity and master scores to the active sites. Scores whose deviation is 0 normalize
+    to 0, like in normalize_scores.
+
+    Input:  A list of active sites
+            (n_sites, 3) array of their raw scores
+            Array of 3 means
+            Array of 3 mean absolute deviations
+    Output: None
+    """
+    normalized = np.zeros((len(raw), 3))
+    filled = deviation > 0
+    normalized[:, filled] = (raw[:, filled] - mean[filled])/deviation[filled]
+    score = normalized[:, 0] + normalized[:, 1] + normalized[:, 2]
+
+    for active_site, (l, a, h), s in zip(active_sites, normalized.tolist(), score.tolist()):
+        active_site.lys_score = l
+        active_site.arg_score = a
+        active_site.hyd_score = h
+        active_site.score = s
+
+
 def active_site_score(active_sites):
     """
     Determine active_site.score. Normalize based on mean and standard deviation.
@@ -49,6 +214,9 @@ def active_site_score(active_sites):
 
     These initial scores are then normalized around 0 and added together to get active_site.score
 
+    All sites are scored together in one pass over the columnar atom arrays of their
+    StructureStore (see site_raw_scores).
+
     This function directly writes to active_site.score.
 
     Input:  A list of active sites
@@ -58,68 +226,155 @@ def active_site_score(active_sites):
     if len(active_sites) <= 0:
         return
 
-    ## The hydrophobicity dictionary
-    score_metric_hydrophobicity = {'ARG': -4.5, 'HIS': -3.2, 'LYS': -3.9,
-    'ASP': -3.5, 'GLU': -3.5, 'CYS': 2.5, 'GLY': -0.4, 'PRO': -1.6, 'ALA': 1.8,
-    'VAL': 4.2, 'ILE': 4.5, 'LEU': 3.8, 'MET': 1.9, 'PHE': 2.8, 'TYR': -1.3,
-    'TRP': -0.9, 'SER': -0.8, 'THR': -0.7, 'ASN': -3.5, 'GLN': -3.5}
-
-    ## Determining lysine positions
-    for active_site in active_sites:
-
-        ## Initial lysine vector of 0
-        lysine_coord_sum = [0.0, 0.0, 0.0]
-        for residue in active_site.residues:
-            if residue.type == "LYS":
-                for atom in residue.atoms:
-                    if atom.type == 'NZ':
-
-                        ## Every time a lysine is found, add the vector
-                        lysine_coord_sum[0] += atom.coords[0]
-                        lysine_coord_sum[1] += atom.coords[1]
-                        lysine_coord_sum[2] += atom.coords[2]
-
-        ## Determine the magnitude of the summed lysine vector, and save to active site
-        lysine_sum_magnitude = pow(sum([pow(pos, 2) for pos in lysine_coord_sum]), 0.5)
-        active_site.lys_score = lysine_sum_magnitude
-
-    ## Determine the mean and standard deviation of the lysine magnitudes
-    lys_m = sum([active_site.lys_score for active_site in active_sites])/len(active_sites)
-    lys_s = sum([abs(active_site.lys_score - lys_m) for active_site in active_sites])/len(active_sites)
+    ## Raw lysine, arginine and hydrophobicity scores for every site at once
+    raw = site_raw_scores(active_sites)
+    lys, arg, hyd = raw[:, 0], raw[:, 1], raw[:, 2]
+    metrics.count('sites_scored', len(active_sites))
 
+    ## Normalize each metric, then add them together into the master score
+    lys = normalize_scores(lys)
+    arg = normalize_scores(arg)
+    hyd = normalize_scores(hyd)
+    score = lys + arg + hyd
 
-    ## Repeat the same process for arginines
-    for active_site in active_sites:
-        arg_coord_sum = [0.0, 0.0, 0.0]
-        for residue in active_site.residues:
-            if residue.type == "ARG":
-                for atom in residue.atoms:
-                    if atom.type == 'CZ':
-                        arg_coord_sum[0] += atom.coords[0]
-                        arg_coord_sum[1] += atom.coords[1]
-                        arg_coord_sum[2] += atom.coords[2]
-        arg_sum_magnitude = pow(sum([pow(pos, 2) for pos in arg_coord_sum]), 0.5)
-        active_site.arg_score = arg_sum_magnitude
+    for active_site, l, a, h, s in zip(active_sites, lys.tolist(), arg.tolist(), hyd.tolist(), score.tolist()):
+        active_site.lys_score = l
+        active_site.arg_score = a
+        active_site.hyd_score = h
+        active_site.score = s
 
-    arg_m = sum([active_site.arg_score for active_site in active_sites])/len(active_sites)
-    arg_s = sum([abs(active_site.arg_score - arg_m) for active_site in active_sites])/len(active_sites)
 
+class StreamingScorer:
+    """
+    Score active sites as they arrive, instead of all at once with active_site_score.
+
+    The scorer keeps running normalization statistics for the lysine, arginine and
+    hydrophobicity scores, and the raw scores of every site seen (three floats per site), but not
+    the sites themselves. The mean is updated with every batch. The mean absolute deviation
+    around it needs every raw score, so it is recomputed only when the number of sites has
+    doubled since it was last computed, and in refresh; the total work stays linear in the
+    number of sites. A new batch is scored against the current mean and the last deviation.
+
+    Sites scored against older statistics keep their scores until they are passed to refresh,
+    which re-normalizes only those from their kept raw scores. After refresh, every site has (up
+    to rounding) the scores active_site_score would give the whole set of sites.
+    """
 
-    ## Hydrophobic score determination usint the dictionary
-    for active_site in active_sites:
-        active_site.hyd_score = sum([score_metric_hydrophobicity[residue.type] for residue in active_site.residues])
-
-    hyd_m = sum([active_site.hyd_score for active_site in active_sites])/len(active_sites)
-    hyd_s = sum([abs(active_site.hyd_score - hyd_m) for active_site in active_sites])/len(active_sites)
-
+    def __init__(self):
+        self.n = 0
+        self.mean = np.zeros(3)
+        self._raw = np.zeros((0, 3))
+        self._normalized_at = np.zeros(0, dtype=np.int64)
+        self._deviation = np.zeros(3)
+        self._deviation_at = 0
+
+    def add(self, active_sites):
+        """
+        Score a batch of new active sites, and fold them into the running statistics.
+
+        Input:  A list of active sites
+        Output: None
+        """
+        if len(active_sites) <= 0:
+            return
+
+        raw = site_raw_scores(active_sites)
+        metrics.count('sites_scored', len(active_sites))
+
+        ## Merge the batch mean into the running one
+        start = self.n
+        self.n = start + len(raw)
+        self.mean = self.mean + (raw.mean(axis=0) - self.mean)*len(raw)/self.n
+
+        ## Raw scores are kept in a buffer that doubles in size as it fills up
+        if self.n > len(self._raw):
+            size = max(2*len(self._raw), self.n)
+            self._raw = np.concatenate([self._raw[:start], np.zeros((size - start, 3))])
+            self._normalized_at = np.concatenate([self._normalized_at[:start],
+                                                  np.zeros(size - start, dtype=np.int64)])
+        self._raw[start:self.n] = raw
+
+        if self.n >= 2*self._deviation_at:
+            self._update_deviation()
+        self._write_scores(np.arange(start, self.n), active_sites)
+
+    def add_stream(self, active_sites, batch_size=256):
+        """
+        Score active sites from any iterable, such as a generator reading new PDB files, in
+        batches of batch_size.
+
+        Input:  Iterable of active sites
+                Number of sites to score at once
+        Output: Number of sites scored
+        """
+        iterator = iter(active_sites)
+        count = 0
+        batch = list(itertools.islice(iterator, batch_size))
+        while len(batch) > 0:
+            self.add(batch)
+            count += len(batch)
+            batch = list(itertools.islice(iterator, batch_size))
+        return count
+
+    def deviation(self):
+        """
+        Mean absolute deviation of every raw score around the mean, as last computed.
+
+        Output: Array of 3 deviations (lysine, arginine, hydrophobicity)
+        """
+        return self._deviation
+
+    def stale(self):
+        """
+        Number of sites whose scores were normalized against older statistics.
+        """
+        return int((self._normalized_at[:self.n] != self.n).sum())
+
+    def refresh(self, active_sites):
+        """
+        Re-normalize every site scored against older statistics, from its kept raw scores.
+
+        Input:  A list of every active site added so far, in the order they were added
+        Output: Number of sites re-normalized
+        """
+        if len(active_sites) != self.n:
+            raise ValueError("Expected the %d sites added so far, got %d"%(self.n, len(active_sites)))
+        if self._deviation_at != self.n:
+            self._update_deviation()
+        stale = np.nonzero(self._normalized_at[:self.n] != self.n)[0]
+        self._write_scores(stale, [active_sites[i] for i in stale.tolist()])
+        return len(stale)
+
+    def _update_deviation(self):
+        self._deviation = np.abs(self._raw[:self.n] - self.mean).mean(axis=0)
+        self._deviation_at = self.n
+
+    def _write_scores(self, indices, active_sites):
+        """
+        Normalize the raw scores of some of the sites with the current statistics, and write the
+        scores to the sites (one per index).
+        """
+        write_scores(active_sites, self._raw[indices], self.mean, self._deviation)
+
+        ## Scores are only up to date if the deviation is
+        self._normalized_at[indices] = self._deviation_at
+
+
+## Normalized metrics that make up active_site.score, in feature vector order
+FEATURES = ('lys_score', 'arg_score', 'hyd_score')
+
+
+def site_features(active_sites):
+    """
+    Collect the normalized metrics of every active site into feature vectors.
 
-    ## For every active site, normalize the scores, then add them together into the master score active_site.score
-    for active_site in active_sites:
-        active_site.lys_score = (active_site.lys_score - lys_m)/lys_s
-        active_site.arg_score = (active_site.arg_score - arg_m)/arg_s
-        active_site.hyd_score = (active_site.hyd_score - hyd_m)/hyd_s
+    active_site_score must have been run on the sites first.
 
-        active_site.score = active_site.lys_score + active_site.arg_score + active_site.hyd_score
+    Input:  A list of active sites
+    Output: (n_sites, 3) array of lysine, arginine and hydrophobicity scores
+    """
+    return np.array([[getattr(active_site, feature) for feature in FEATURES]
+                     for active_site in active_sites], dtype=float).reshape(-1, len(FEATURES))
 
 
 def cluster_score(cluster_list):
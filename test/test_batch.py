@@ -0,0 +1,37 @@
+from hw2skeleton import batch
+from hw2skeleton import cluster
+from hw2skeleton import io
+from hw2skeleton import utils
+import glob
+import os
+import pytest
+import shutil
+
+
+def test_run_batch(tmpdir):
+    ## A second dataset with some of the files of the first
+    subset = tmpdir.mkdir("subset")
+    for filepath in sorted(glob.glob(os.path.join("data", "*.pdb")))[:20]:
+        shutil.copy(filepath, str(subset))
+
+    outputs = {}
+    for workers in [1, 2]:
+        output_dir = str(tmpdir.join("out%d"%workers))
+        written = batch.run_batch(["data", str(subset)], ['P', 'H'], [2, 4], output_dir, cache=False, workers=workers)
+
+        assert [os.path.basename(filename) for filename, sizes in written] == \
+            ["data_P.txt", "data_H.txt", "subset_P.txt", "subset_H.txt"]
+        outputs[workers] = [open(filename).read() for filename, sizes in written]
+
+    ## Same results whether the datasets are run in this process or in a pool
+    assert outputs[1] == outputs[2]
+
+    ## Each file holds the same clusterings a single run would give
+    active_sites = io.read_active_sites("data")
+    utils.active_site_score(active_sites)
+    expected = tmpdir.join("expected.txt")
+    io.write_mult_clusterings(str(expected), [cluster.cluster_hierarchically(active_sites, k) for k in [2, 4]])
+    assert outputs[1][1] == expected.read()
+
+    with pytest.raises(ValueError):
+        batch.run_batch(["data"], ['X'], [2], str(tmpdir))
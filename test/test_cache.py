@@ -0,0 +1,96 @@
+from hw2skeleton import io
+from hw2skeleton import cache
+from hw2skeleton import utils
+from hw2skeleton import metrics
+import os
+import shutil
+import numpy as np
+import pytest
+
+
+def copy_sites(directory, names):
+    for name in names:
+        shutil.copy(os.path.join("data", name), os.path.join(str(directory), name))
+
+
+def site_table(active_sites):
+    return [(site.name, [str(residue) for residue in site.residues],
+             [atom.coords for residue in site.residues for atom in residue.atoms]) for site in active_sites]
+
+
+def test_cache(tmp_path, capsys):
+    copy_sites(tmp_path, ["276.pdb", "4629.pdb", "10701.pdb"])
+
+    cold = io.read_active_sites(str(tmp_path), cache=True)
+    assert os.path.exists(cache.cache_path(str(tmp_path)))
+    assert "(0 cached)" in capsys.readouterr().out
+
+    ## Second read comes entirely from the cache, with the raw scores already filled in
+    warm = io.read_active_sites(str(tmp_path), cache=True)
+    assert "(3 cached)" in capsys.readouterr().out
+    assert site_table(warm) == site_table(cold)
+    assert warm[0].store.raw_scores is not None
+
+    utils.active_site_score(cold)
+    utils.active_site_score(warm)
+    assert [site.score for site in warm] == [site.score for site in cold]
+
+    ## A changed file is parsed again, a new file is added in order, a removed file is dropped
+    shutil.copy(os.path.join("data", "34088.pdb"), os.path.join(str(tmp_path), "4629.pdb"))
+    copy_sites(tmp_path, ["18773.pdb"])
+    os.remove(os.path.join(str(tmp_path), "10701.pdb"))
+
+    updated = io.read_active_sites(str(tmp_path), cache=True)
+    assert "(1 cached)" in capsys.readouterr().out
+    assert site_table(updated) == site_table(io.read_active_sites(str(tmp_path)))
+
+
+def test_unusable_cache(tmp_path):
+    copy_sites(tmp_path, ["276.pdb"])
+    with open(cache.cache_path(str(tmp_path)), "w") as f:
+        f.write("not a cache")
+
+    ## A broken cache is ignored and replaced
+    active_sites = io.read_active_sites(str(tmp_path), cache=True)
+    assert [site.name for site in active_sites] == ["276"]
+    assert cache.load_cache(cache.cache_path(str(tmp_path)))[1] is not None
+
+
+def test_saved_files(tmp_path):
+    path = str(tmp_path / "saved.npz")
+    cache.save_npz(path, 2, values=np.arange(3))
+    assert cache.load_npz(path, 2, 'test file')['values'].tolist() == [0, 1, 2]
+    with pytest.raises(IOError):
+        cache.load_npz(path, 1, 'test file')
+
+    ## A failed write leaves the old file in place, and no temporary file behind
+    with pytest.raises(RuntimeError):
+        with cache.atomic_write(path) as f:
+            f.write(b"partial")
+            raise RuntimeError()
+    assert os.listdir(str(tmp_path)) == ["saved.npz"]
+    assert cache.load_npz(path, 2, 'test file')['values'].tolist() == [0, 1, 2]
+
+
+def test_lazy_sites(tmp_path):
+    copy_sites(tmp_path, ["276.pdb", "4629.pdb", "10701.pdb", "34088.pdb"])
+    eager = io.read_active_sites(str(tmp_path))
+    utils.active_site_score(eager)
+
+    ## Scored without reading any atoms, whether parsed or read from the cache
+    for cached in (False, True, True):
+        lazy = io.read_active_sites(str(tmp_path), cache=cached, lazy=True, max_loaded=2)
+        utils.active_site_score(lazy)
+        assert [site.name for site in lazy] == [site.name for site in eager]
+        assert [site.score for site in lazy] == [site.score for site in eager]
+        assert len(lazy[0].loaded) == 0
+
+    ## Atoms are read when used, keeping at most max_loaded sites
+    assert site_table(lazy) == site_table(eager)
+    assert len(lazy[0].loaded) == 2
+
+    ## Code that needs the atoms of every site reads them in one go, past the SiteCache
+    metrics.reset()
+    store, rows = utils.site_store(lazy[::-1])
+    assert site_table(store.take(rows).sites()) == site_table(eager[::-1])
+    assert metrics.counters['sites_loaded'] == 4
@@ -5,6 +5,8 @@ from hw2skeleton import cluster
 import os
 import matplotlib.pyplot as pp
 import math
+import numpy as np
+import pytest
 
 
 def test_similarity():
@@ -23,31 +25,15 @@ def test_similarity():
 
 def test_partition_clustering():
 
-    active_sites = io.read_active_sites("../Data")
+    active_sites = io.read_active_sites("data")
 
     utils.active_site_score(active_sites)
 
-    ## This section shows that less than 20 iterations are needed until the cluster score converges
-    #  it tests up to 100 iterations.
-    score_list = [0]
-    x_list = []
-    for i in range(0, 100):
-        score = utils.cluster_score(cluster.cluster_by_partitioning(active_sites, 3, i+1))
-
-        ## If it is the same for two iterations (only reason for two was to see the convergence line)
-        if score == score_list[i-1]:
-            score_list = score_list[1:]
-            break
-        score_list.append(score)
-        x_list.append(i+1)
-
-    pp.figure(figsize=(20,10))
-    pp.plot(x_list, score_list, 'x-')
-    pp.grid(True)
-    pp.title("Iterations until cluster score convergence")
-    pp.xlabel("number of iterations")
-    pp.ylabel("cluster score")
-    pp.show()
+    ## This section shows that less than 20 iterations are needed until the clustering converges.
+    #  k-means stops by itself once it has converged and reports how many iterations it took.
+    scores = [site.score for site in active_sites]
+    labels, centers, inertia, n_iter = cluster.kmeans(scores, 3, 100)
+    assert n_iter < 20
 
     ## This section shows the clustering quality based on the cluster_score function. The higher the y value
     #  the worse the cluster (many points far from the mean).
@@ -80,7 +66,7 @@ def test_hierarchical_clustering():
     ## I am going for all active sites
 
 
-    active_sites = io.read_active_sites("../Data")
+    active_sites = io.read_active_sites("data")
 
     utils.active_site_score(active_sites)
 
@@ -108,7 +94,7 @@ def test_hierarchical_clustering():
 
 def test_cluster_differences():
 
-    active_sites = io.read_active_sites("../Data")
+    active_sites = io.read_active_sites("data")
 
     utils.active_site_score(active_sites)
 
@@ -131,3 +117,292 @@ def test_cluster_differences():
     pp.xlabel("number of clusters (k)")
     pp.ylabel("cluster score difference")
     pp.show()
+
+
+def naive_centroid_clustering(values, k):
+    ## Reference: repeatedly merge the two clusters with the closest centroids
+    clusters = [[value] for value in values]
+    while len(clusters) > k:
+        pairs = [(abs(sum(a)/len(a) - sum(b)/len(b)), i, j)
+                 for i, a in enumerate(clusters) for j, b in enumerate(clusters) if i < j]
+        distance, i, j = min(pairs)
+        clusters[i] = clusters[i] + clusters[j]
+        del clusters[j]
+    return sorted([sorted(cluster) for cluster in clusters])
+
+
+def test_hierarchical_engine():
+    values = np.random.RandomState(0).normal(size=60).tolist()
+
+    for k in [1, 2, 5, 17, 59, 60]:
+        merges = cluster.centroid_linkage(values, n_clusters=k)
+        labels = cluster.merge_labels(merges, len(values))
+
+        clusters = {}
+        for value, label in zip(values, labels):
+            clusters.setdefault(label, []).append(value)
+
+        assert sorted([sorted(c) for c in clusters.values()]) == naive_centroid_clustering(values, k)
+
+    ## Merge distances never shrink in one dimension
+    merges = cluster.centroid_linkage(values)
+    assert (np.diff(merges[:, 2]) >= 0).all()
+
+
+def test_hierarchical_exact_k():
+    active_sites = io.read_active_sites("data")
+    utils.active_site_score(active_sites)
+
+    ## Sites with identical scores are still merged one pair at a time, so exactly k clusters come back
+    for k in [1, 3, 50, len(active_sites) - 1, len(active_sites)]:
+        clusters = cluster.cluster_hierarchically(active_sites, k)
+        assert len(clusters) == k
+        assert sorted([site.name for c in clusters for site in c]) == sorted([site.name for site in active_sites])
+
+
+def test_cut_hierarchy():
+    active_sites = io.read_active_sites("data")
+    utils.active_site_score(active_sites)
+
+    merges = cluster.hierarchical_linkage(active_sites)
+    assert merges.shape == (len(active_sites) - 1, 4)
+    assert merges[-1, 3] == len(active_sites)
+
+    ## Cutting the full tree at k gives the same clusters as clustering down to k
+    for k in [1, 2, 3, 10, 40]:
+        cut = cluster.cut_hierarchy(active_sites, merges, k=k)
+        direct = cluster.cluster_hierarchically(active_sites, k)
+        assert sorted([sorted([site.name for site in c]) for c in cut]) == \
+            sorted([sorted([site.name for site in c]) for c in direct])
+
+    ## Cutting at the distance of the third to last merge undoes the last three merges
+    threshold = merges[-3, 2]
+    assert len(cluster.cut_hierarchy(active_sites, merges, threshold=threshold)) == 4
+
+
+def test_kmeans():
+    ## Three well separated groups of points, in 1-D and 2-D
+    rng = np.random.RandomState(1)
+    points = np.concatenate([rng.normal(center, 0.1, size=50) for center in (-5.0, 0.0, 5.0)])
+
+    for X in (points, np.stack([points, -points], axis=1)):
+        labels, centers, inertia, n_iter = cluster.kmeans(X, 3, 100, n_init=4, seed=3)
+
+        assert sorted(np.bincount(labels).tolist()) == [50, 50, 50]
+        assert len(set(labels[:50])) == len(set(labels[50:100])) == len(set(labels[100:])) == 1
+        assert n_iter < 100
+
+        ## Same seed, same answer
+        again = cluster.kmeans(X, 3, 100, n_init=4, seed=3)
+        assert (again[0] == labels).all() and again[2] == inertia
+
+
+def test_kmeans_duplicates():
+    ## Duplicate scores must not merge clusters or divide by zero, even with more clusters than
+    #  distinct values
+    X = np.array([1.0, 1.0, 1.0, 2.0, 2.0, 7.0])
+
+    labels, centers, inertia, n_iter = cluster.kmeans(X, 5, 20, init='first')
+    assert inertia == 0.0
+    assert np.isfinite(centers).all()
+
+    sites = io.read_active_sites("data")[:6]
+    for site, score in zip(sites, X):
+        site.score = score
+    clusters = cluster.cluster_by_partitioning(sites, 3, 20)
+    assert sorted([len(c) for c in clusters]) == [1, 2, 3]
+
+
+def test_pairwise_distances():
+    from scipy.spatial.distance import pdist
+
+    rng = np.random.RandomState(2)
+    X = rng.normal(size=(37, 3))
+    X[5] = 0.0
+    weights = [2.0, 0.5, 1.0]
+
+    ## Small blocks cover every block boundary case
+    for block_size in [1, 40, 2**22]:
+        distances = cluster.pairwise_distances(X, 'euclidean', weights, block_size=block_size)
+        assert np.allclose(distances, pdist(X, 'euclidean', w=weights), rtol=1e-12, atol=0)
+
+        distances = cluster.pairwise_distances(X, 'cosine', weights, block_size=block_size)
+        with np.errstate(invalid='ignore'):
+            expected = pdist(X, 'cosine', w=weights)
+        mask = np.isfinite(expected)
+        assert np.allclose(distances[mask], expected[mask], atol=1e-12)
+
+    ## Entry lookup, and float32 storage
+    i, j = 30, 4
+    assert cluster.pairwise_distances(X)[cluster.condensed_index(len(X), i, j)] == \
+        pytest.approx(np.linalg.norm(X[i] - X[j]))
+    assert cluster.pairwise_distances(X, dtype=np.float32).dtype == np.float32
+
+    with pytest.raises(ValueError):
+        cluster.pairwise_distances(X, 'manhattan')
+
+
+def test_feature_similarity():
+    active_sites = io.read_active_sites("data")
+    utils.active_site_score(active_sites)
+    features = utils.site_features(active_sites)
+
+    ## The pair distance of compute_similarity agrees with the precomputed matrix
+    distances = cluster.pairwise_distances(features, 'euclidean', [1.0, 1.0, 2.0])
+    index = cluster.condensed_index(len(active_sites), 3, 7)
+    assert cluster.compute_similarity(active_sites[3], active_sites[7], 'euclidean', [1.0, 1.0, 2.0]) == \
+        pytest.approx(distances[index])
+
+    ## Both clustering methods take the features or distances in place of the score
+    for k in [1, 4, 20]:
+        for clusters in [cluster.cluster_hierarchically(active_sites, k, distances),
+                         cluster.cluster_by_partitioning(active_sites, k, 50, features=features)]:
+            assert len(clusters) == k
+            assert sorted([site.name for c in clusters for site in c]) == sorted([site.name for site in active_sites])
+
+    merges = cluster.hierarchical_linkage(active_sites, distances.astype(np.float32))
+    assert merges.shape == (len(active_sites) - 1, 4)
+
+
+def test_minibatch_kmeans(tmpdir):
+    rng = np.random.RandomState(5)
+    centers = np.array([[-5.0, 0.0], [0.0, 5.0], [5.0, 0.0]])
+    X = np.concatenate([rng.normal(center, 0.2, size=(300, 2)) for center in centers])
+    X = X[rng.permutation(len(X))]
+    truth = np.argmin(((X[:, None, :] - centers[None])**2).sum(axis=2), axis=1)
+
+    ## Fed in chunks, the first of them smaller than k
+    model = cluster.MiniBatchKMeans(3, seed=1)
+    model.partial_fit_points(X[:2])
+    assert model.centers is None
+    for start in range(2, len(X), 50):
+        model.partial_fit_points(X[start:start + 50])
+
+    assert model.counts.sum() == len(X)
+    labels = model.predict_points(X)
+    for i in range(3):
+        assert len(set(labels[truth == i])) == 1
+    assert len(set(labels)) == 3
+
+    ## A saved model predicts and learns exactly like the original
+    path = str(tmpdir.join("model.npz"))
+    model.save(path)
+    loaded = cluster.MiniBatchKMeans.load(path)
+    assert (loaded.predict_points(X) == labels).all()
+    model.partial_fit_points(X[:100])
+    loaded.partial_fit_points(X[:100])
+    assert (loaded.centers == model.centers).all()
+
+    ## A center without points takes a point from a cluster that keeps one, not a lone point
+    model = cluster.MiniBatchKMeans(3)
+    model.centers = np.array([[0.0], [10.0], [100.0]])
+    model.counts = np.zeros(3, dtype=np.int64)
+    model.partial_fit_points(np.array([0.0, 0.1, 15.0]))
+    assert model.counts.tolist() == [1, 1, 1]
+    assert model.centers[:, 0] == pytest.approx([0.0, 15.0, 0.1])
+
+
+def test_minibatch_kmeans_sites():
+    active_sites = io.read_active_sites("data")
+    utils.active_site_score(active_sites)
+
+    ## Sites streamed one batch at a time end up in the same clusters predict gives
+    model = cluster.MiniBatchKMeans(4).fit_stream(iter(active_sites), batch_size=16)
+    clusters = model.cluster(active_sites)
+    assert sum([len(c) for c in clusters]) == len(active_sites)
+
+    for label, site in zip(model.predict(active_sites), active_sites):
+        assert abs(site.score - model.centers[label, 0]) == min([abs(site.score - c) for c in model.centers[:, 0]])
+
+
+def test_minibatch_kmeans_model(tmpdir):
+    active_sites = io.read_active_sites("data")
+    path = str(tmpdir.join("model.npz"))
+
+    ## The first sites scored fix the normalization, as active_site_score would score them
+    model = cluster.MiniBatchKMeans(3)
+    model.score(active_sites[:100])
+    model.fit_stream(active_sites[:100], batch_size=32)
+    model.save(path)
+    expected = [site.score for site in active_sites[:100]]
+    utils.active_site_score(active_sites[:100])
+    assert [site.score for site in active_sites[:100]] == expected
+
+    ## A later run scores every site the same way, and only learns from the new ones
+    loaded = cluster.MiniBatchKMeans.load(path)
+    again = io.read_active_sites("data")
+    loaded.score(again)
+    assert [site.score for site in again[:100]] == expected
+    loaded.fit_stream(again)
+    assert loaded.counts.sum() == len(again)
+    loaded.fit_stream(again)
+    assert loaded.counts.sum() == len(again)
+    assert len(loaded.seen) == len(again)
+
+
+def test_validate_clustering():
+    active_sites = io.read_active_sites("data")
+    utils.active_site_score(active_sites)
+
+    for k in [1, 7]:
+        cluster.validate_clustering(active_sites, cluster.cluster_hierarchically(active_sites, k))
+        cluster.validate_clustering(active_sites, cluster.cluster_by_partitioning(active_sites, k, 20))
+
+    for clustering in [[active_sites[:10], active_sites[5:]], [active_sites[1:]], [active_sites, []]]:
+        with pytest.raises(ValueError):
+            cluster.validate_clustering(active_sites, clustering)
+
+
+def test_ward_linkage():
+    from scipy.cluster import hierarchy
+
+    rng = np.random.RandomState(2)
+    X = rng.normal(size=(200, 3))
+
+    ## Single points give scipy's Ward linkage
+    merges = cluster.ward_linkage(X, np.ones(len(X)))
+    expected = hierarchy.linkage(X, 'ward')
+    assert np.allclose(merges[:, 2], expected[:, 2])
+    assert (merges[:, :2] == np.sort(expected[:, :2], axis=1)).all()
+    assert (merges[:, 3] == expected[:, 3]).all()
+
+    ## Clusters given by their sums and counts merge at the growth in within cluster sum of squares
+    sse = lambda points: ((points - points.mean(axis=0))**2).sum()
+    a, b = X[:50], X[50:]
+    merges = cluster.ward_linkage([a.sum(axis=0), b.sum(axis=0)], [len(a), len(b)])
+    assert np.isclose(merges[0, 2], np.sqrt(2*(sse(X) - sse(a) - sse(b))))
+
+
+def test_summary_linkage():
+    active_sites = io.read_active_sites("data")
+    utils.active_site_score(active_sites)
+
+    ## With room for every site, the same clusters as clustering the sites themselves
+    for k in (2, 5, 20):
+        expected = cluster.cluster_hierarchically(active_sites, k)
+        found = cluster.cluster_hierarchically(active_sites, k, max_memory=1 << 20)
+        assert sorted([sorted(map(str, c)) for c in found]) == sorted([sorted(map(str, c)) for c in expected])
+
+    ## Squeezed into a few micro-clusters, every site still ends up in exactly one cluster
+    features = utils.site_features(active_sites)
+    for X in (None, features):
+        micro = cluster.MicroClusters(max_memory=20*cluster.MicroClusters.BYTES)
+        for start in range(0, len(active_sites), 25):
+            micro.partial_fit_points(features[start:start + 25] if X is not None else
+                                     [site.score for site in active_sites[start:start + 25]])
+        assert 10 <= len(micro) <= 20
+        assert micro.counts.sum() == len(active_sites)
+        assert (np.bincount(micro.labels(), minlength=len(micro)) == micro.counts).all()
+        assert micro.error() > 0
+
+        leaves, merges = cluster.summary_linkage(active_sites, X, max_memory=20*cluster.MicroClusters.BYTES,
+                                                 batch_size=25)
+        assert (leaves == micro.labels()).all()
+        clustering = cluster.cut_hierarchy(active_sites, merges, k=4, leaves=leaves)
+        cluster.validate_clustering(active_sites, clustering)
+        assert len(clustering) == 4
+
+        ## Micro-clusters cannot be split into more clusters than there are of them
+        assert len(cluster.cut_hierarchy(active_sites, merges, k=len(micro), leaves=leaves)) == len(micro)
+        with pytest.raises(ValueError):
+            cluster.cut_hierarchy(active_sites, merges, k=len(micro) + 1, leaves=leaves)
@@ -0,0 +1,46 @@
+from hw2skeleton import io
+from hw2skeleton import cluster
+from hw2skeleton import dataset
+from hw2skeleton import utils
+import numpy as np
+
+
+def test_dataset_round_trip(tmp_path):
+    active_sites = io.read_active_sites("data")
+    path = str(tmp_path / "data.sites")
+
+    dataset.write_dataset(path, active_sites)
+    store = dataset.open_dataset(path)
+
+    ## Residue and atom arrays are backed by the file, not copied into memory
+    assert not store.coords.flags.owndata
+    assert not store.coords.flags.writeable
+
+    original = active_sites[0].store
+    for array in original.ARRAYS:
+        assert np.array_equal(getattr(store, array), getattr(original, array))
+
+    mapped = store.sites()
+    assert [str(residue) for residue in mapped[3].residues] == [str(residue) for residue in active_sites[3].residues]
+
+    utils.active_site_score(active_sites)
+    utils.active_site_score(mapped)
+    assert [site.score for site in mapped] == [site.score for site in active_sites]
+
+    clusters = cluster.cluster_by_partitioning(mapped, 3, 5)
+    assert sum([len(c) for c in clusters]) == len(mapped)
+
+
+def test_dataset_subset(tmp_path):
+    active_sites = io.read_active_sites("data")
+    path = str(tmp_path / "subset.sites")
+
+    ## Any list of sites can be written, in any order
+    subset = active_sites[10:4:-2]
+    dataset.write_dataset(path, subset)
+
+    assert [site.name for site in dataset.read_dataset(path)] == [site.name for site in subset]
+
+    ## An empty list of sites makes an empty dataset
+    dataset.write_dataset(path, [])
+    assert dataset.read_dataset(path) == []
@@ -0,0 +1,94 @@
+from hw2skeleton import features
+from hw2skeleton import io
+from hw2skeleton import metrics
+from hw2skeleton import utils
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def tyrosines():
+    ## A feature of our own, unregistered again afterwards
+    @features.register('tyr')
+    def tyrosines(store):
+        return np.bincount(store.residue_site(), weights=store.residue_types[store.residue_type] == 'TYR',
+                           minlength=store.n_sites)
+    yield 'tyr'
+    del features.EXTRACTORS['tyr']
+
+
+def test_feature_pipeline(tyrosines):
+    active_sites = io.read_active_sites("data", cache=False)
+    store = active_sites[0].store
+    raw = np.stack(utils.raw_active_site_scores(store), axis=1)
+
+    ## Score features read in with the sites are used as they are, the rest are computed once
+    #  per store and then come from the cache
+    cache = features.FeatureCache()
+    metrics.reset()
+    X = features.extract(store, ('hyd', 'lys', tyrosines), cache)
+    assert (X[:, :2] == raw[:, [2, 0]]).all()
+    assert metrics.counters['features_computed'] == 1
+    features.extract(store, ('lys', 'arg', tyrosines), cache)
+    assert metrics.counters['features_computed'] == 1
+
+    store.raw_scores = None
+    assert (features.extract(store, features.SCORE_FEATURES + (tyrosines,), cache)[:, :3] == raw).all()
+    assert metrics.counters['features_computed'] == 4
+    assert len(cache) == 4
+
+    ## Normalizing the cached features gives the scores of active_site_score
+    utils.active_site_score(active_sites)
+    store.raw_scores = None
+    normalized = features.feature_matrix(active_sites, normalize=utils.normalize_scores, feature_cache=cache)
+    assert np.allclose(normalized, utils.site_features(active_sites))
+    assert metrics.counters['features_computed'] == 4
+
+    ## Least recently used values go first once the cache is full
+    small = features.FeatureCache(max_bytes=2*store.n_sites*8)
+    for name in ('lys', 'arg', 'lys', 'hyd'):
+        small.get(store, name)
+    assert sorted([key[1] for key in small._values]) == ['hyd', 'lys']
+
+
+def test_feature_matrix_stores(tyrosines):
+    ## Sites from two separate reads, and a plain ActiveSite
+    first = io.read_active_sites("data", cache=False)
+    second = io.read_active_sites("data", cache=False)
+    plain = utils.ActiveSite(first[7].name)
+    plain.residues = first[7].residues
+    active_sites = first[:5] + second[5:10] + [plain]
+
+    ## Features are computed once for every store the sites come from
+    cache = features.FeatureCache()
+    metrics.reset()
+    for repeat in range(3):
+        X = features.feature_matrix(second[5:10] + first[:5], (tyrosines,), feature_cache=cache)
+    assert metrics.counters['features_computed'] == 2
+    assert len(cache) == 2
+
+    ## Rows come back in the order of the sites, whatever store they are in
+    X = features.feature_matrix(active_sites, (tyrosines, 'hyd'), feature_cache=cache)
+    expected = features.extract(first[0].store, (tyrosines, 'hyd'), cache)[[0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 7]]
+    assert (X == expected).all()
+
+
+def test_feature_disk_cache(tmpdir):
+    active_sites = io.read_active_sites("data", cache=False)
+    store = active_sites[0].store
+
+    first = features.FeatureCache(directory=str(tmpdir))
+    values = first.get(store, 'hyd')
+
+    ## A new cache over the same sites reads the values back instead of computing them
+    metrics.reset()
+    again = io.read_active_sites("data", cache=False)[0].store
+    second = features.FeatureCache(directory=str(tmpdir))
+    assert (second.get(again, 'hyd') == values).all()
+    assert 'features_computed' not in metrics.counters
+
+    ## Values are dropped from memory with their store
+    del store, active_sites
+    import gc
+    gc.collect()
+    assert len(first) == 0
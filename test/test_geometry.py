@@ -0,0 +1,68 @@
+from hw2skeleton import cluster
+from hw2skeleton import geometry
+from hw2skeleton import io
+from hw2skeleton import utils
+import numpy as np
+import pytest
+import os
+
+
+def moved_copy(active_site, rotation, shift):
+    ## Copy an active site with every atom rotated and shifted
+    copy = utils.ActiveSite(active_site.name + "_moved")
+    for residue in active_site.residues:
+        new_residue = utils.Residue(residue.type, residue.number)
+        for atom in residue.atoms:
+            new_atom = utils.Atom(atom.type)
+            new_atom.coords = tuple((rotation @ np.array(atom.coords) + shift).tolist())
+            new_residue.atoms.append(new_atom)
+        copy.residues.append(new_residue)
+    return copy
+
+
+def test_shape_invariance():
+    site_a = io.read_active_site(os.path.join("data", "276.pdb"))
+    site_b = io.read_active_site(os.path.join("data", "4629.pdb"))
+
+    ## A random proper rotation
+    q, r = np.linalg.qr(np.random.RandomState(4).normal(size=(3, 3)))
+    rotation = q*np.sign(np.diag(r))
+    if np.linalg.det(rotation) < 0:
+        rotation[:, 0] = -rotation[:, 0]
+    moved = moved_copy(site_a, rotation, np.array([10.0, -3.0, 7.5]))
+
+    ## Copies only differ by rounding the moved coordinates to the 3 decimals of a PDB file
+    for level in geometry.LEVELS:
+        shape_a, shape_moved, shape_b = geometry.site_shapes([site_a, moved, site_b], level)
+        assert geometry.shape_distance(shape_a, shape_moved) < 1e-2
+        assert geometry.shape_distance(shape_a, shape_b) > 0.5
+        assert geometry.shape_distance(shape_a, shape_b) == pytest.approx(geometry.shape_distance(shape_b, shape_a))
+
+    assert cluster.compute_similarity(site_a, moved, 'shape') < 1e-2
+
+
+def test_shape_distances():
+    active_sites = io.read_active_sites("data")[:12]
+    utils.active_site_score(active_sites)
+
+    distances = geometry.shape_distances(active_sites)
+    assert len(distances) == 12*11//2
+    assert (distances >= 0).all()
+
+    ## The batched queries give the distance of every pair on its own
+    shapes = geometry.site_shapes(active_sites)
+    for i in range(len(shapes) - 1):
+        for j in range(i + 1, len(shapes)):
+            index = cluster.condensed_index(len(shapes), i, j)
+            assert distances[index] == pytest.approx(geometry.shape_distance(shapes[i], shapes[j]))
+    index = cluster.condensed_index(len(active_sites), 2, 9)
+    assert distances[index] == pytest.approx(cluster.compute_similarity(active_sites[2], active_sites[9], 'shape'))
+    assert (geometry.shape_distances(active_sites, workers=2) == distances).all()
+    assert geometry.shape_distances(active_sites, block_size=5) == pytest.approx(distances)
+
+    clusters = cluster.cluster_hierarchically(active_sites, 3, distances)
+    assert len(clusters) == 3
+
+    ## Residue centroids, one point per residue with atoms
+    points = geometry.site_points(active_sites, 'residues')
+    assert [len(p) for p in points] == [len(site.residues) for site in active_sites]
@@ -31,3 +31,74 @@ def test_atoms(filename, residue_number, atoms, xs, ys, zs):
 
     assert [atom.type for atom in residue.atoms] == atoms
     assert [atom.coords for atom in residue.atoms] == list(zip(xs, ys, zs))
+
+
+def test_read_active_sites_parallel():
+    serial = io.read_active_sites("data", workers=1)
+    parallel = io.read_active_sites("data", workers=2, batch_size=10)
+
+    ## Sites come back sorted by file name, whatever the number of workers
+    assert [site.name for site in serial] == [site.name for site in parallel]
+    assert [site.name + ".pdb" for site in serial] == sorted(os.listdir("data"))
+
+    assert [[str(residue) for residue in site.residues] for site in serial] == \
+        [[str(residue) for residue in site.residues] for site in parallel]
+    assert (serial[0].store.coords == parallel[0].store.coords).all()
+
+
+def test_parsers_agree():
+    filepaths = sorted([os.path.join("data", name) for name in os.listdir("data")])
+
+    line = io.parse_active_sites(filepaths, parser="line")
+    buffer = io.parse_active_sites(filepaths, parser="buffer")
+
+    for array in ["names", "site_offsets", "residue_types", "residue_type", "residue_number",
+                  "residue_offsets", "atom_types", "atom_type", "coords"]:
+        assert (getattr(line, array) == getattr(buffer, array)).all()
+
+
+@pytest.mark.parametrize("parser", ["line", "buffer"])
+def test_malformed_atom(tmp_path, parser):
+    filepath = tmp_path / "bad.pdb"
+    with open(os.path.join("data", "276.pdb")) as f:
+        filepath.write_text(f.read() + "END\n")
+
+    with pytest.raises(ValueError):
+        io.read_active_site(str(filepath), parser=parser)
+
+
+def test_write_formats(tmp_path):
+    active_sites = io.read_active_sites("data")[:9]
+    clusterings = [[active_sites[:4], active_sites[4:]], [active_sites[:2], active_sites[2:5], active_sites[5:]]]
+
+    ## The text formats are unchanged
+    io.write_clustering(str(tmp_path / "one.txt"), clusterings[0])
+    assert (tmp_path / "one.txt").read_text() == "".join(
+        ["\nCluster %d\n--------------\n"%i + "".join(["%s\n"%site for site in c]) for i, c in enumerate(clusterings[0])])
+    io.write_mult_clusterings(str(tmp_path / "mult.txt"), clusterings)
+    assert (tmp_path / "mult.txt").read_text().startswith("\nClustering 0 (2 clusters)\n============\n\nCluster 0\n------------\n")
+
+    ## Every machine readable format loads back to the same labels
+    names = [site.name for site in active_sites]
+    expected = [[0]*4 + [1]*5, [0]*2 + [1]*3 + [2]*4]
+    for format in ["csv", "jsonl", "npz"]:
+        filename = str(tmp_path / ("mult." + format))
+        io.write_mult_clusterings(filename, clusterings)
+        loaded_names, labels = io.read_labels(filename)
+        assert loaded_names.tolist() == names
+        assert labels.tolist() == expected
+
+
+def test_clustering_writer(tmp_path):
+    active_sites = io.read_active_sites("data")[:5]
+
+    ## Clusters are written out as they come, the file is complete once the writer is closed
+    filename = str(tmp_path / "stream.jsonl")
+    with io.ClusteringWriter(filename) as writer:
+        writer.write_cluster(active_sites[:1])
+        writer.write_cluster(active_sites[1:])
+    names, labels = io.read_labels(filename)
+    assert labels.tolist() == [[0, 1, 1, 1, 1]]
+
+    with pytest.raises(ValueError):
+        io.ClusteringWriter(str(tmp_path / "x.txt"), format="xml")
@@ -0,0 +1,46 @@
+from hw2skeleton import cluster
+from hw2skeleton import io
+from hw2skeleton import metrics
+from hw2skeleton import utils
+import json
+import tracemalloc
+
+
+def test_pipeline_counters():
+    metrics.reset()
+
+    with metrics.timer('read'):
+        active_sites = io.read_active_sites("data")
+    utils.active_site_score(active_sites)
+    cluster.cluster_hierarchically(active_sites, 5)
+    labels, centers, inertia, n_iter = cluster.kmeans([site.score for site in active_sites], 3, 100)
+
+    counters = metrics.report()['counters']
+    assert counters['files_parsed'] == len(active_sites)
+    assert counters['atoms_read'] == active_sites[0].store.n_atoms
+    assert counters['sites_scored'] == len(active_sites)
+    assert counters['merges'] == len(active_sites) - 5
+    assert counters['kmeans_iterations'] == n_iter
+    assert counters['distance_evaluations'] == (n_iter + 1)*len(active_sites)
+
+
+def test_timer_report(tmpdir):
+    metrics.reset()
+
+    tracemalloc.start()
+    try:
+        for i in range(2):
+            with metrics.timer('stage'):
+                data = bytearray(10**6)
+    finally:
+        tracemalloc.stop()
+
+    path = str(tmpdir.join("metrics.json"))
+    metrics.write_report(path, sites=3)
+    with open(path) as f:
+        report = json.load(f)
+
+    assert report['sites'] == 3
+    assert report['timers']['stage']['calls'] == 2
+    assert report['timers']['stage']['seconds'] >= 0
+    assert report['timers']['stage']['peak_bytes'] >= 10**6
@@ -0,0 +1,68 @@
+from hw2skeleton import neighbors
+from hw2skeleton import cluster
+from hw2skeleton import io
+from hw2skeleton import utils
+import numpy as np
+
+
+def brute_force(points, queries):
+    return np.sqrt(((queries[:, None, :] - points[None, :, :])**2).sum(axis=2))
+
+
+def test_site_index_queries():
+    rng = np.random.RandomState(3)
+
+    for d in (1, 3):
+        points = rng.normal(size=(500, d))
+        ## Repeated values, so ties are covered too
+        points[:50] = points[50:100]
+        index = neighbors.SiteIndex(["s%d"%i for i in range(len(points))], points, np.zeros(3), np.ones(3),
+                                    'score' if d == 1 else 'vector')
+        queries = np.concatenate([rng.normal(size=(40, d)), points[:10], [[10.0]*d, [-10.0]*d]])
+        distances = brute_force(index.points, queries)
+
+        ## k nearest neighbours, in one batch
+        found, indices = index.query(queries, k=7)
+        assert found.shape == (len(queries), 7)
+        assert np.allclose(found, np.sort(distances, axis=1)[:, :7])
+        assert np.allclose(distances[np.arange(len(queries))[:, None], indices], found)
+
+        ## More neighbours than sites
+        found, indices = index.query(queries[:2], k=1000)
+        assert sorted(indices[0].tolist()) == list(range(len(points)))
+
+        ## Everything within a radius, closest first
+        for query, result, row in zip(queries, index.query_radius(queries, 0.3), distances):
+            assert sorted(result.tolist()) == np.flatnonzero(row <= 0.3).tolist()
+            assert (np.diff(row[result]) >= 0).all()
+
+
+def test_site_index_sites(tmpdir):
+    active_sites = io.read_active_sites("data")
+    known, new = active_sites[:-5], active_sites[-5:]
+    utils.active_site_score(known)
+
+    index = neighbors.SiteIndex.from_sites(known)
+    assert np.allclose(index.points[:, 0], [active_site.score for active_site in known])
+
+    ## Same nearest site as comparing new sites against every known site, with their scores
+    #  normalized like the known sites
+    for active_site, found in zip(new, index.neighbors(new, k=3)):
+        query = index.query_points([active_site])[0, 0]
+        distances = [abs(query - site.score) for site in known]
+        assert np.isclose(found[0][1], min(distances))
+        assert [name for name, distance in found] == [known[i].name for i in np.argsort(distances, kind='stable')[:3]]
+
+    ## Weighted feature vectors give the distances of pairwise_distances
+    weights = [1.0, 2.0, 0.5]
+    index = neighbors.SiteIndex.from_sites(known, 'vector', weights)
+    distances, indices = index.query(index.query_points(known[:1]), k=len(known))
+    full = cluster.pairwise_distances(utils.site_features(known), 'euclidean', weights)
+    expected = [0.0] + [full[cluster.condensed_index(len(known), 0, j)] for j in range(1, len(known))]
+    assert np.allclose(np.sort(expected), distances[0])
+
+    ## A saved index answers the same queries
+    path = str(tmpdir.join("index.npz"))
+    index.save(path)
+    loaded = neighbors.SiteIndex.load(path)
+    assert loaded.neighbors(new, k=4) == index.neighbors(new, k=4)
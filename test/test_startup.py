@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+
+## Budget for importing everything the command line tool needs, in seconds. NumPy alone takes
+#  about a tenth of a second; scipy and matplotlib would blow the budget, so they are only
+#  imported when they are used.
+IMPORT_BUDGET = 1.0
+
+## Modules the command line tool must not import up front
+LAZY_MODULES = ('scipy', 'matplotlib', 'concurrent.futures.process', 'cProfile')
+
+
+def cli_imports():
+    ## Run the command line tool under -X importtime, --help imports everything and exits
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-m", "hw2skeleton", "--help"],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, universal_newlines=True)
+    assert result.returncode == 0
+
+    ## Lines look like "import time:   self [us] | cumulative | module", nested modules are indented
+    imports = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_time, cumulative, module = line[len("import time:"):].split("|")
+        imports[module.strip()] = (int(cumulative), not module.startswith("  "))
+    return imports
+
+
+def test_cli_import_time():
+    imports = cli_imports()
+
+    for module in imports:
+        assert not any([module == lazy or module.startswith(lazy + ".") for lazy in LAZY_MODULES]), module
+
+    total = sum([cumulative for cumulative, top_level in imports.values() if top_level])/1e6
+    assert total < IMPORT_BUDGET
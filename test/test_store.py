@@ -0,0 +1,30 @@
+from hw2skeleton import io
+from hw2skeleton.store import StructureStore
+import os
+
+
+def test_store_round_trip():
+    filepaths = [os.path.join("data", name) for name in ["276.pdb", "4629.pdb"]]
+    active_sites = [io.read_active_site(filepath) for filepath in filepaths]
+
+    ## Joining stores and repacking views must keep every residue and atom intact
+    joined = StructureStore.concatenate([site.store for site in active_sites]).sites()
+    repacked = StructureStore.from_sites(active_sites).sites()
+
+    for sites in (joined, repacked):
+        for original, copy in zip(active_sites, sites):
+            assert copy.name == original.name
+            assert [str(residue) for residue in copy.residues] == [str(residue) for residue in original.residues]
+            for residue_a, residue_b in zip(copy.residues, original.residues):
+                assert [atom.type for atom in residue_a.atoms] == [atom.type for atom in residue_b.atoms]
+                assert [atom.coords for atom in residue_a.atoms] == [atom.coords for atom in residue_b.atoms]
+
+
+def test_store_size():
+    active_sites = io.read_active_sites("data")
+    store = active_sites[0].store
+
+    assert all([site.store is store for site in active_sites])
+
+    ## Each atom should only take a handful of bytes
+    assert store.nbytes/store.n_atoms < 32
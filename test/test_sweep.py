@@ -0,0 +1,89 @@
+from hw2skeleton import cluster
+from hw2skeleton import io
+from hw2skeleton import sweep
+from hw2skeleton import utils
+import numpy as np
+import pytest
+
+
+def naive_silhouette(scores, labels):
+    ## Reference: the silhouette straight from its definition
+    silhouettes = []
+    for i, x in enumerate(scores):
+        own = [abs(x - y) for j, y in enumerate(scores) if labels[j] == labels[i] and j != i]
+        if len(own) == 0:
+            silhouettes.append(0.0)
+            continue
+        a = sum(own)/len(own)
+        b = min([np.mean([abs(x - y) for j, y in enumerate(scores) if labels[j] == c])
+                 for c in set(labels) if c != labels[i]])
+        silhouettes.append((b - a)/max(a, b) if max(a, b) > 0 else 0.0)
+    return np.mean(silhouettes)
+
+
+def without_nan(table):
+    ## nan never equals itself, so swap it out before comparing tables
+    return [{key: None if isinstance(value, float) and np.isnan(value) else value for key, value in row.items()}
+            for row in table]
+
+
+def test_metrics():
+    rng = np.random.RandomState(6)
+    scores = np.round(rng.normal(size=80), 1)
+
+    for k in [2, 3, 9, 40]:
+        labels, centers, inertia, n_iter = cluster.kmeans(scores, k, 50)
+        metrics = sweep.evaluate(scores, labels)
+
+        assert metrics['silhouette'] == pytest.approx(naive_silhouette(scores, labels))
+        assert metrics['within'] == pytest.approx(inertia)
+        assert metrics['within'] + metrics['between'] == pytest.approx(((scores - scores.mean())**2).sum())
+
+    assert np.isnan(sweep.evaluate(scores, np.zeros(len(scores), dtype=int))['silhouette'])
+
+
+def test_sweep():
+    active_sites = io.read_active_sites("data")
+    utils.active_site_score(active_sites)
+
+    ks = [1, 2, 4, 8]
+    table = sweep.sweep(active_sites, ks, restarts=3)
+    assert len(table) == len(ks)*3 + len(ks)
+    assert all([set(row) == set(sweep.COLUMNS) for row in table])
+
+    assert sweep.sweep([], ks) == []
+
+    ## The same table from a pool of workers reading the scores from shared memory
+    assert without_nan(sweep.sweep(active_sites, ks, restarts=3, workers=2)) == without_nan(table)
+
+    ## cluster_score matches scoring the actual clusterings
+    for row in table:
+        if row['method'] == 'H':
+            clusters = cluster.cluster_hierarchically(active_sites, row['k'])
+            assert row['cluster_score'] == pytest.approx(utils.cluster_score(clusters))
+
+    best = sweep.best_rows(table, 'cluster_score', maximize=False)
+    assert len(best) == 2*len(ks)
+
+
+def test_cluster_with_restarts():
+    active_sites = io.read_active_sites("data")
+    utils.active_site_score(active_sites)
+    names = lambda clustering: [[active_site.name for active_site in cluster] for cluster in clustering]
+
+    clustering, run_scores = sweep.cluster_with_restarts(active_sites, 4, restarts=6, seed=7)
+    assert len(run_scores) == 6
+    assert utils.cluster_score(clustering) == min(run_scores)
+    cluster.validate_clustering(active_sites, clustering)
+
+    ## The same runs and the same winner with any number of workers
+    parallel, parallel_scores = sweep.cluster_with_restarts(active_sites, 4, restarts=6, seed=7, workers=3)
+    assert parallel_scores == run_scores
+    assert names(parallel) == names(clustering)
+
+    ## Runs follow the seed, and feature vectors work the same way
+    assert sweep.cluster_with_restarts(active_sites, 4, restarts=6, seed=8)[1] != run_scores
+    features = utils.site_features(active_sites)
+    serial = sweep.cluster_with_restarts(active_sites, 3, restarts=4, features=features)
+    assert names(sweep.cluster_with_restarts(active_sites, 3, restarts=4, features=features, workers=2)[0]) == \
+        names(serial[0])
@@ -0,0 +1,78 @@
+from hw2skeleton import io
+from hw2skeleton import utils
+import pytest
+import numpy as np
+import glob
+import os
+
+
+def make_site(name, residues):
+    ## Build an active site by hand from a list of (residue type, [(atom type, coords), ...])
+    active_site = utils.ActiveSite(name)
+    for number, (residue_type, atoms) in enumerate(residues):
+        residue = utils.Residue(residue_type, number)
+        for atom_type, coords in atoms:
+            atom = utils.Atom(atom_type)
+            atom.coords = coords
+            residue.atoms.append(atom)
+        active_site.residues.append(residue)
+    return active_site
+
+
+def test_raw_scores():
+    site_a = make_site("a", [("LYS", [("CA", (9.0, 9.0, 9.0)), ("NZ", (1.0, 2.0, 2.0))]),
+                             ("LYS", [("NZ", (2.0, 2.0, 1.0))]),
+                             ("ALA", [("CA", (5.0, 5.0, 5.0))])])
+    site_b = make_site("b", [("ARG", [("CZ", (0.0, 3.0, 4.0))]),
+                             ("VAL", [])])
+
+    store, rows = utils.site_store([site_a, site_b])
+    lys, arg, hyd = [raw[rows] for raw in utils.raw_active_site_scores(store)]
+
+    ## Lysine NZ vectors (1, 2, 2) + (2, 2, 1) = (3, 4, 3)
+    assert list(lys) == pytest.approx([34**0.5, 0.0])
+    assert list(arg) == pytest.approx([0.0, 5.0])
+    assert list(hyd) == pytest.approx([-3.9 - 3.9 + 1.8, -4.5 + 4.2])
+
+
+def test_active_site_score():
+    active_sites = [io.read_active_site(os.path.join("data", name))
+                    for name in ["276.pdb", "4629.pdb", "10701.pdb", "34088.pdb"]]
+
+    utils.active_site_score(active_sites)
+
+    ## Every normalized metric is centered around 0, and the score is their sum
+    for metric in ["lys_score", "arg_score", "hyd_score"]:
+        assert sum([getattr(site, metric) for site in active_sites]) == pytest.approx(0.0, abs=1e-9)
+
+    for site in active_sites:
+        assert site.score == site.lys_score + site.arg_score + site.hyd_score
+
+
+def test_streaming_scorer():
+    filepaths = sorted(glob.glob(os.path.join("data", "*.pdb")))
+
+    ## Score the files as they are read, a few at a time
+    scorer = utils.StreamingScorer()
+    streamed = [io.read_active_site(filepath) for filepath in filepaths[:50]]
+    assert scorer.add_stream(iter(streamed), batch_size=7) == 50
+    streamed += io.read_active_sites("data")[50:]
+    scorer.add(streamed[50:])
+    assert scorer.n == len(filepaths)
+
+    ## Only sites scored before the last batch are out of date
+    assert scorer.stale() == 50
+    assert scorer.refresh(streamed) == 50
+    assert scorer.stale() == 0
+    with pytest.raises(ValueError):
+        scorer.refresh(streamed[:10])
+
+    active_sites = io.read_active_sites("data")
+    utils.active_site_score(active_sites)
+    for streamed_site, site in zip(streamed, active_sites):
+        assert streamed_site.name == site.name
+        for metric in ["lys_score", "arg_score", "hyd_score", "score"]:
+            assert getattr(streamed_site, metric) == pytest.approx(getattr(site, metric), abs=1e-9)
+
+    raw = np.stack(utils.raw_active_site_scores(active_sites[0].store), axis=1)
+    assert scorer.deviation() == pytest.approx(np.abs(raw - raw.mean(axis=0)).mean(axis=0))